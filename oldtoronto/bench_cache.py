@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""Compare the throughput of the fetcher.Cache storage backends.
+
+Usage:
+
+    oldtoronto/bench_cache.py --num_urls 20000
+
+This fills a fresh cache of each kind with synthetic Geocoding API responses, then reports
+inserts/sec, lookups/sec for hits and misses, the time to open the cache and look up a single
+URL, and how long migrate_cache.py takes to convert the file-per-URL cache.
+
+It then stores synthetic Toronto Archives detail pages with each available compression codec,
+and reports how much space they take and how quickly they can be read and parsed with
+parse_records.parse_html.
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+import fetcher
+import migrate_cache
+import parse_records
+from fetcher import Cache
+
+
+def make_urls(num_urls):
+    return [
+        f'https://maps.googleapis.com/maps/api/geocode/json?address={i}+king+street&key=abc'
+        for i in range(num_urls)
+    ]
+
+
+def make_response(url, size):
+    """A JSON response of roughly size bytes."""
+    return json.dumps({'status': 'OK', 'url': url, 'padding': 'x' * size}).encode('utf8')
+
+
+# Boilerplate which every detail page repeats, roughly as it appears on the archives' site.
+PAGE_TEMPLATE = '''<!DOCTYPE html>
+<html><head><title>City of Toronto Archives</title>
+<link rel="stylesheet" href="/css/bootstrap.min.css"><script src="/js/jquery.min.js"></script>
+</head><body><nav class="navbar">%(nav)s</nav>
+<div class="container">%(rows)s
+<a class="img-thumbnail" href="/images/%(id)s.jpg"><img src="/thumbs/%(id)s.jpg"></a>
+</div><footer>%(nav)s</footer></body></html>
+'''
+
+NAV = ''.join(f'<li><a href="/section/{i}">Section {i}</a></li>' for i in range(60))
+
+ROW_TEMPLATE = '''
+<div class="row"><div class="col-md-3"><span id="displayLabel">%s</span></div>
+<div class="col-md-9"><span id="displayData">%s</span></div></div>'''
+
+
+def make_page(i):
+    rng = random.Random(i)
+    rows = {
+        'Title': f'{rng.randint(1, 999)} King St. W., looking east from Spadina Ave.',
+        'Date(s) of creation of record(s)': f'{rng.randint(1890, 1980)}',
+        'Physical description of record(s)': '1 photograph : b&w negative',
+        'Scope and content': ' '.join(f'{rng.random():.6f}' for _ in range(20)),
+        'Archival citation': f'Fonds 1244, Item {i}',
+        'Copyright conditions': 'Copyright is in the public domain.',
+    }
+    return (PAGE_TEMPLATE % {
+        'nav': NAV,
+        'rows': ''.join(ROW_TEMPLATE % item for item in rows.items()),
+        'id': i
+    }).encode('utf8')
+
+
+def rate(n, secs):
+    return f'{n / secs:>10,.0f}/s'
+
+
+def bench_backend(cache_dir, backend, urls, response_size):
+    cache = Cache(cache_dir, backend=backend)
+    start = time.perf_counter()
+    for url in urls:
+        cache.store_url_in_cache(url, make_response(url, response_size))
+    cache.flush()
+    insert_secs = time.perf_counter() - start
+
+    start = time.perf_counter()
+    cache = Cache(cache_dir, backend=backend)
+    cache.fetch_url_from_cache(urls[0])
+    open_secs = time.perf_counter() - start
+
+    hits = random.Random(0).sample(urls, len(urls))
+    start = time.perf_counter()
+    for url in hits:
+        cache.fetch_url_from_cache(url)
+    hit_secs = time.perf_counter() - start
+
+    misses = [url.replace('king', 'queen') for url in urls]
+    start = time.perf_counter()
+    for url in misses:
+        cache.is_url_in_cache(url)
+    miss_secs = time.perf_counter() - start
+
+    print(f'{backend:>7}: insert {rate(len(urls), insert_secs)}, '
+          f'hit {rate(len(hits), hit_secs)}, miss {rate(len(misses), miss_secs)}, '
+          f'open + first lookup {open_secs * 1000:.2f}ms')
+
+
+def bench_compression(num_pages):
+    urls = [f'https://gencat.eloquent-systems.com/page?KEY_{i}' for i in range(num_pages)]
+    pages = [make_page(i) for i in range(num_pages)]
+    raw_bytes = sum(len(page) for page in pages)
+    print(f'{num_pages:,} detail pages, {raw_bytes / num_pages:,.0f} bytes each')
+    codecs = [None, 'gzip'] + (['zstd'] if fetcher.zstandard else [])
+    for compression in codecs:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = Cache(cache_dir, backend='sqlite', compression=compression)
+            start = time.perf_counter()
+            for url, page in zip(urls, pages):
+                cache.store_url_in_cache(url, page)
+            cache.flush()
+            insert_secs = time.perf_counter() - start
+            stored_bytes = sum(len(cache._storage.get(*cache._cache_key(url))) for url in urls)
+
+            start = time.perf_counter()
+            for url in urls:
+                cache.fetch_url_from_cache(url)
+            read_secs = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for url in urls:
+                parse_records.parse_html(cache.fetch_url_from_cache(url).decode('utf8'))
+            parse_secs = time.perf_counter() - start
+
+        print(f'{compression or "raw":>7}: {stored_bytes / 1e6:6.1f} MB '
+              f'({stored_bytes / raw_bytes:4.0%}), insert {rate(num_pages, insert_secs)}, '
+              f'read {rate(num_pages, read_secs)}, read + parse {rate(num_pages, parse_secs)}')
+
+
+def main(num_urls, response_size, num_pages):
+    urls = make_urls(num_urls)
+    print(f'{num_urls:,} URLs, ~{response_size:,} byte responses')
+    with tempfile.TemporaryDirectory() as files_dir, \
+            tempfile.TemporaryDirectory() as sqlite_dir:
+        bench_backend(files_dir, 'files', urls, response_size)
+        bench_backend(sqlite_dir, 'sqlite', urls, response_size)
+
+        start = time.perf_counter()
+        migrate_cache.migrate(files_dir)
+        print(f'migrate: {rate(num_urls, time.perf_counter() - start)}')
+        sqlite_size = os.path.getsize(os.path.join(sqlite_dir, 'cache.sqlite3'))
+        print(f'sqlite database: {sqlite_size / 1e6:.1f} MB')
+    print()
+    bench_compression(num_pages)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Benchmark the fetcher.Cache storage backends.')
+    parser.add_argument('--num_urls', type=int, help='Number of responses to store',
+                        default=20000)
+    parser.add_argument('--response_size', type=int, help='Approximate bytes per response',
+                        default=2000)
+    parser.add_argument('--num_pages', type=int,
+                        help='Number of detail pages for the compression benchmark',
+                        default=2000)
+    args = parser.parse_args()
+
+    main(args.num_urls, args.response_size, args.num_pages)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""Measure how quickly parse_records.py parses record pages, and check its modes agree.
+
+Usage:
+
+    oldtoronto/bench_parse_records.py --num_pages 2000 --workers 4
+    oldtoronto/bench_parse_records.py --ids_file data/toronto-archives/record-ids.txt
+
+By default this parses synthetic pages (see bench_cache.py). With --ids_file, it parses the
+cached record pages for those IDs instead. Either way, it reports pages/sec for a full parse,
+for --fast, and for --fast with --workers, and lists any pages for which the fast modes don't
+produce exactly the same records.ndjson line as a full parse.
+"""
+
+import argparse
+import os
+import time
+
+import fetcher
+import parse_records
+from bench_cache import make_page
+from utils.parallel import process_map
+
+
+def cached_pages(ids_file, limit):
+    f = fetcher.Fetcher()
+    pages = []
+    for _, id_, page in parse_records.cached_pages(f, open(ids_file)):
+        pages.append((id_, page))
+        if limit and len(pages) >= limit:
+            break
+    return pages
+
+
+def time_mode(pages, fast, workers):
+    """Returns (elapsed seconds, records.ndjson lines) for parsing the pages."""
+    jobs = ((num, id_, page, fast) for num, (id_, page) in enumerate(pages))
+    start = time.perf_counter()
+    lines = [line for _, line in process_map(parse_records._numbered_record_json, jobs,
+                                             workers=workers)]
+    return time.perf_counter() - start, lines
+
+
+def main(pages, workers):
+    num_bytes = sum(len(page) for _, page in pages)
+    print(f'{len(pages):,} pages, {num_bytes / len(pages):,.0f} bytes each')
+    baseline = None
+    for name, fast, num_workers in [('full', False, 1),
+                                    ('fast', True, 1),
+                                    (f'fast, {workers} workers', True, workers)]:
+        secs, lines = time_mode(pages, fast, num_workers)
+        if baseline is None:
+            baseline = lines
+        mismatches = [id_ for (id_, _), a, b in zip(pages, baseline, lines) if a != b]
+        print(f'{name:>20}: {len(pages) / secs:8,.0f} pages/sec, '
+              f'{len(mismatches):,} pages differ from a full parse')
+        for id_ in mismatches[:10]:
+            print(f'    {id_}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Benchmark parse_records.py.')
+    parser.add_argument('--num_pages', type=int,
+                        help='Number of pages to parse. Defaults to all cached pages with '
+                             '--ids_file, or 2000 synthetic ones.',
+                        default=None)
+    parser.add_argument('--ids_file', type=str,
+                        help='Parse the cached record pages for these IDs', default=None)
+    parser.add_argument('--workers', type=int, help='Number of processes for the last mode',
+                        default=os.cpu_count())
+    args = parser.parse_args()
+
+    if args.ids_file:
+        pages = cached_pages(args.ids_file, args.num_pages)
+    else:
+        pages = [(str(i), make_page(i)) for i in range(args.num_pages or 2000)]
+    main(pages, args.workers)
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""Measure how quickly date_distribution.parse_year gets through the dates of a corpus.
+
+Usage:
+
+    oldtoronto/bench_parse_year.py --input data/toronto-archives/images.ndjson
+
+This reports how many of the date strings are distinct, how many of those dateutil has to
+parse, and dates/sec for parse_year with an empty memo, with a warm memo and without one.
+"""
+
+import argparse
+import time
+
+import date_distribution
+from utils.generators import read_ndjson_file
+
+
+def dates_per_sec(fn, dates):
+    start = time.perf_counter()
+    for date in dates:
+        fn(date)
+    return len(dates) / (time.perf_counter() - start)
+
+
+def main(input_file):
+    dates = [row.get('date', '').strip() for row in read_ndjson_file(input_file)]
+    dates = [date for date in dates if date]
+    unique_dates = set(dates)
+    print(f'{len(dates):,} dates, {len(unique_dates):,} distinct')
+
+    num_dateutil = 0
+    use_date_util_parser = date_distribution.use_date_util_parser
+
+    def counting_date_util_parser(date_string):
+        nonlocal num_dateutil
+        num_dateutil += 1
+        return use_date_util_parser(date_string)
+
+    date_distribution.use_date_util_parser = counting_date_util_parser
+    try:
+        uncached = date_distribution.parse_year.__wrapped__
+        num_parsed = sum(1 for date in unique_dates if uncached(date))
+    finally:
+        date_distribution.use_date_util_parser = use_date_util_parser
+    print(f'{num_parsed:,} distinct dates parsed, {num_dateutil:,} of them needed dateutil')
+
+    date_distribution.parse_year.cache_clear()
+    cold = dates_per_sec(date_distribution.parse_year, dates)
+    warm = dates_per_sec(date_distribution.parse_year, dates)
+    no_memo = dates_per_sec(date_distribution.parse_year.__wrapped__, dates)
+    print(f'   empty memo: {cold:10,.0f} dates/sec')
+    print(f'    warm memo: {warm:10,.0f} dates/sec')
+    print(f'      no memo: {no_memo:10,.0f} dates/sec')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Benchmark date_distribution.parse_year.')
+    parser.add_argument('--input', type=str, help='NDJSON file of image records',
+                        default='data/toronto-archives/images.ndjson')
+    args = parser.parse_args()
+
+    main(args.input)
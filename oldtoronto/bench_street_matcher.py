@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""Compare the speed of the street regexes and StreetMatcher on a corpus of titles.
+
+Usage:
+
+    oldtoronto/bench_street_matcher.py --input data/toronto-archives/images.ndjson
+
+This runs the street finding done by parse_exact_address and parse_two_streets over every
+title, reports titles/sec for both implementations and checks that their outputs agree.
+"""
+
+import argparse
+import time
+
+import geocode
+from street_matcher import StreetMatcher
+from utils.generators import read_ndjson_file
+
+
+def time_it(fn, titles):
+    """Run fn over all the titles, returning (elapsed seconds, outputs)."""
+    start = time.perf_counter()
+    outputs = [fn(title) for title in titles]
+    return time.perf_counter() - start, outputs
+
+
+def main(input_file, street_names_file):
+    titles = [
+        title
+        for title in (geocode.get_title(row) for row in read_ndjson_file(input_file))
+        if title
+    ]
+    street_names = open(street_names_file).read().split('\n')
+    print(f'{len(titles):,} titles, {len(street_names):,} streets')
+
+    start = time.perf_counter()
+    street_re_str = geocode.build_is_a_toronto_street_regex_str(street_names)
+    exact_address_re = geocode.exact_address_regex(street_re_str)
+    standalone_street_re = geocode.standalone_street_regex(street_re_str)
+    regex_build_secs = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matcher = StreetMatcher(street_names)
+    trie_build_secs = time.perf_counter() - start
+
+    def with_regex(title):
+        m = exact_address_re.match(title.lower())
+        return (
+            (m.group(1), m.group(2)) if m else None,
+            standalone_street_re.findall(title)
+        )
+
+    def with_trie(title):
+        return (
+            matcher.match_exact_address(title.lower()),
+            matcher.findall(title)
+        )
+
+    regex_secs, regex_outputs = time_it(with_regex, titles)
+    trie_secs, trie_outputs = time_it(with_trie, titles)
+
+    mismatches = [
+        (title, a, b)
+        for title, a, b in zip(titles, regex_outputs, trie_outputs)
+        if a != b
+    ]
+
+    print(f'  regex: build {regex_build_secs:.3f}s, '
+          f'{len(titles) / regex_secs:,.0f} titles/sec ({regex_secs:.2f}s)')
+    print(f'   trie: build {trie_build_secs:.3f}s, '
+          f'{len(titles) / trie_secs:,.0f} titles/sec ({trie_secs:.2f}s)')
+    print(f'speedup: {regex_secs / trie_secs:.1f}x')
+    print(f'mismatches: {len(mismatches)}')
+    for title, a, b in mismatches[:10]:
+        print(f'  {title}\n    regex: {a}\n     trie: {b}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Benchmark the street regexes against StreetMatcher.')
+    parser.add_argument('--input', type=str,
+                        help='ndjson formatted file containing the titles to parse',
+                        default='data/toronto-archives/images.ndjson')
+    parser.add_argument('--street_names', type=str,
+                        help='text file containing street names',
+                        default='data/streets.txt')
+    args = parser.parse_args()
+
+    main(args.input, args.street_names)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""Compare the title regexes in geocode.py with the matchers in title_matchers.py.
+
+Usage:
+
+    oldtoronto/bench_title_matchers.py --input data/toronto-archives/images.ndjson
+
+This does two things:
+- Runs both implementations over every title, reporting titles/sec and checking that their
+  outputs agree.
+- Times both on pathological titles, e.g. a long run of capital letters which never reaches an
+  " and ". The regexes take exponential time on these, so they're only run on short titles;
+  the matchers should scale linearly.
+"""
+
+import argparse
+import time
+
+import geocode
+import title_matchers
+from utils.generators import read_ndjson_file
+
+PATTERNS = [
+    ('joined_by_and', geocode.JOINED_BY_AND_RE, title_matchers.match_joined_by_and),
+    ('direction_from', geocode.DIRECTION_FROM_RE, title_matchers.match_direction_from),
+    ('corner_of_x_and_y', geocode.PARSE_CORNER_OF_X_AND_Y_RE,
+     title_matchers.match_corner_of_x_and_y),
+    ('x_at_y_corner', geocode.X_AT_Y_RE, title_matchers.match_x_at_y_corner),
+    ('corner_of', geocode.CORNER_OF_X_AND_Y, title_matchers.match_corner_of),
+]
+
+# Functions of n which build titles that make the regexes backtrack.
+PATHOLOGICAL_TITLES = {
+    'joined_by_and': lambda n: 'A' * n + '! and B',
+    'direction_from': lambda n: 'A' * n + '! looking north from B',
+    'corner_of_x_and_y': lambda n: 'Northeast corner of ' + 'A' * n + ' and',
+    'x_at_y_corner': lambda n: 'A' * n + ' at ' + 'A' * n + ' corner',
+    'corner_of': lambda n: 'Corner of ' + 'A' * n + ' and',
+}
+
+# Stop growing a title once a single regex match takes longer than this.
+MAX_REGEX_SECS = 1.0
+
+
+def regex_groups(regex, title):
+    m = regex.match(title)
+    return m.groups()[:2] if m else None
+
+
+def time_it(fn, titles):
+    """Run fn over all the titles, returning (elapsed seconds, outputs)."""
+    start = time.perf_counter()
+    outputs = [fn(title) for title in titles]
+    return time.perf_counter() - start, outputs
+
+
+def bench_corpus(titles):
+    print(f'{len(titles):,} titles')
+    for name, regex, matcher in PATTERNS:
+        regex_secs, regex_outputs = time_it(lambda title: regex_groups(regex, title), titles)
+        matcher_secs, matcher_outputs = time_it(matcher, titles)
+        mismatches = [
+            (title, a, b)
+            for title, a, b in zip(titles, regex_outputs, matcher_outputs)
+            if a != b
+        ]
+        print(f'{name:>18}: regex {len(titles) / regex_secs:,.0f} titles/sec, '
+              f'matcher {len(titles) / matcher_secs:,.0f} titles/sec, '
+              f'{len(mismatches)} mismatches')
+        for title, a, b in mismatches[:10]:
+            print(f'  {title}\n    regex: {a}\n  matcher: {b}')
+
+
+def bench_pathological():
+    for name, regex, matcher in PATTERNS:
+        make_title = PATHOLOGICAL_TITLES[name]
+        print(f'{name}:')
+        n = 4
+        while True:
+            title = make_title(n)
+            regex_secs, _ = time_it(lambda title: regex_groups(regex, title), [title])
+            matcher_secs, _ = time_it(matcher, [title])
+            print(f'  n={n:>3}: regex {regex_secs:8.4f}s, matcher {matcher_secs:8.6f}s')
+            if regex_secs > MAX_REGEX_SECS:
+                break
+            n += 1
+        for n in (1000, 10000, 100000):
+            matcher_secs, _ = time_it(matcher, [make_title(n)])
+            print(f'  n={n:>6}: matcher {matcher_secs:8.4f}s')
+
+
+def main(input_file):
+    titles = [
+        title
+        for title in (geocode.get_title(row) for row in read_ndjson_file(input_file))
+        if title
+    ]
+    bench_corpus(titles)
+    bench_pathological()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Benchmark the title regexes against title_matchers.')
+    parser.add_argument('--input', type=str,
+                        help='ndjson formatted file containing the titles to parse',
+                        default='data/toronto-archives/images.ndjson')
+    args = parser.parse_args()
+
+    main(args.input)
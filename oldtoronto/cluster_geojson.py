@@ -1,19 +1,18 @@
 #!/usr/bin/env python3
 """ Takes a .geojson file that is a feature collection and rewrites the coordinates according the
 centroid of the cluster computed by the dbscan algorithm.
+
+The input is read twice, once for the coordinates and once to rewrite them, so only the IDs and
+coordinates are held in memory. It can also be a GeoJSONSeq (.geojsonl) file, as can the output.
 """
 import argparse
-import json
 import sys
 
 from haversine import haversine
 import numpy as np
 from sklearn.cluster import DBSCAN
 
-
-def get_feature_collection_from_file(input_file):
-    with open(input_file) as f:
-        return json.load(f)
+from utils.geojson import FeatureWriter, iter_features
 
 
 def get_furthest_coordinate(original_coordinates, new_coordinates, ids):
@@ -76,28 +75,26 @@ def cluster_coordinates(coordinates, epsilon, ids):
 
 
 def main(input_file, output_file, epsilon):
-    feature_collection = get_feature_collection_from_file(input_file)
     features = [
         (feature['id'],
          (feature['geometry']['coordinates'][0], feature['geometry']['coordinates'][1]))
-        for feature in feature_collection['features']
+        for feature in iter_features(input_file)
         if feature['geometry']]
     ids, coordinates = zip(*features)
     id_to_new_coordinates = cluster_coordinates(coordinates, epsilon, ids)
     n_remapped_features = 0
-    for feature in feature_collection['features']:
-        if feature['geometry'] and feature['id'] in id_to_new_coordinates:
-            new_coordinate = id_to_new_coordinates[feature['id']]
-            old_coordinate = feature['geometry']['coordinates']
-            distance_km = haversine(new_coordinate, old_coordinate)
-            if distance_km > 0.0001:
-                n_remapped_features += 1
-                feature['geometry']['coordinates'] = new_coordinate
+    with FeatureWriter(output_file) as out:
+        for feature in iter_features(input_file):
+            if feature['geometry'] and feature['id'] in id_to_new_coordinates:
+                new_coordinate = id_to_new_coordinates[feature['id']]
+                old_coordinate = feature['geometry']['coordinates']
+                distance_km = haversine(new_coordinate, old_coordinate)
+                if distance_km > 0.0001:
+                    n_remapped_features += 1
+                    feature['geometry']['coordinates'] = new_coordinate
+            out.write(feature)
     sys.stderr.write(f'changed the location of {n_remapped_features} features\n')
 
-    with open(output_file, 'w') as f:
-        json.dump(feature_collection, f)
-
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser('implement dbscan for everyone')
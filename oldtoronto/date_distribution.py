@@ -6,6 +6,7 @@ Usage:
 """
 
 from collections import defaultdict
+import functools
 import json
 import logging
 import re
@@ -36,6 +37,10 @@ CLEANER_RES = [
     re.compile('^(?:spring|summer|fall|winter) (.*)')
 ]
 
+# All the CLEANER_RES as one regex. Alternatives are tried in order, so the first cleaner which
+# matches wins, just as when they're tried one by one. Each has a single capture group.
+CLEANER_RE = re.compile('|'.join(f'(?:{cleaner_re.pattern})' for cleaner_re in CLEANER_RES))
+
 
 def _year_range(m):
     """Helper function to construct a range of years from a regex."""
@@ -81,6 +86,19 @@ PARSERS = [
 ]
 
 
+MONTH = (r'(?:january|february|march|april|may|june|july|august|september|october|november|'
+         r'december|jan|feb|mar|apr|jun|jul|aug|sept?|oct|nov|dec)\.?')
+
+# Shapes of date which dateutil would parse into a single year, e.g. 'november 27, 1914',
+# '27 november 1914', 'june 1922' and '1946'. These are common enough to be worth matching
+# directly: dateutil is far slower than a regex.
+SINGLE_YEAR_RE = re.compile(
+    r'^(?:' + MONTH + r' (?:\d{1,2},? )?|\d{1,2} ' + MONTH + r',? )?(\d{4})$')
+
+# The number of distinct date strings which parse_year remembers.
+PARSE_YEAR_CACHE_SIZE = 100000
+
+
 def is_valid_year(year):
     """Is the (integer) year in a plausible range of dates?"""
     return 1750 <= year <= 2019
@@ -97,27 +115,34 @@ def use_date_util_parser(date_string):
         return None
 
 
+@functools.lru_cache(maxsize=PARSE_YEAR_CACHE_SIZE)
 def parse_year(date_string):
     """Parse string and extract a range of years from date.
 
+    The archives use a few thousand distinct date strings, so results are memoized.
+
     Return:
         None if a year is not found in the string, otherwise the parsed date is returned as a
         (start_year, end_year) string tuple. If either is unknown, it will be None.
     """
-    if len(date_string) == 0:
-        return None
-
     date_string = date_string.lower()
-    for cleaner_re in CLEANER_RES:
-        m = cleaner_re.match(date_string)
-        if m:
-            return parse_year(m.group(1))
+    while True:
+        if len(date_string) == 0:
+            return None
+        m = CLEANER_RE.match(date_string)
+        if not m:
+            break
+        date_string = m.group(m.lastindex)
 
     for pattern, parser in PARSERS:
         m = pattern.match(date_string)
         if m:
             return parser(m)
 
+    m = SINGLE_YEAR_RE.match(date_string)
+    if m and is_valid_year(int(m.group(1))):
+        return (m.group(1), m.group(1))
+
     result = use_date_util_parser(date_string)
     if result:
         return result
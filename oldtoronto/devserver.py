@@ -3,6 +3,10 @@
 
 This is useful for iterating on geocoding since it will reload the GeoJSON file if it changes.
 
+With --patch_csv, the corrections in the override sheet are applied on top of the GeoJSON, as
+generate_geojson.py would apply them. The sheet is reloaded when it changes (or every
+--patch_refresh_secs, if it's a URL), so corrections show up without regenerating the GeoJSON.
+
 Supported endpoints:
 - /api/oldtoronto/lat_lng_counts?var=lat_lons
 - /api/oldtoronto/by_location?lat=43.651501&lng=-79.359842
@@ -14,13 +18,22 @@ from collections import defaultdict, Counter
 import copy
 import json
 import os
+import time
 
 from flask import Flask, abort, jsonify, request, Response
 from haversine import haversine
 
+from generate_geojson import load_patch_csv
+from utils.geojson import iter_features
+
 geojson_file = None  # filled in in __main__
 mtime = 0  # last modified time
-features = []
+patch_csv = None  # filled in in __main__, if there is one
+patch_refresh_secs = 60
+patch_version = 0  # mtime of a local patch_csv, or when a remote one was last fetched
+geojson_features = []  # as loaded from geojson_file
+patches = {}  # photo id --> (lat, lng), or None to hide it. See load_patch_csv.
+features = []  # geojson_features with the patches applied
 
 
 def old_toronto_key(lat, lng):
@@ -42,20 +55,58 @@ def old_toronto_key(lat, lng):
 app = Flask(__name__)
 
 
-# Check for changes to the GeoJSON file before every request.
+def apply_patches(features, patches):
+    """Move or drop features according to the override sheet, leaving the originals alone."""
+    patched = []
+    for f in features:
+        if f['id'] not in patches:
+            patched.append(f)
+            continue
+        lat_lng = patches[f['id']]
+        if lat_lng is None:
+            continue
+        f = dict(f, geometry=dict(f['geometry'], coordinates=[lat_lng[1], lat_lng[0]]))
+        patched.append(f)
+    return patched
+
+
+def maybe_load_patches():
+    """Reload patch_csv if it has changed. Returns whether it was reloaded."""
+    global patches, patch_version
+    if os.path.exists(patch_csv):
+        new_version = os.stat(patch_csv).st_mtime
+    else:
+        now = time.time()
+        new_version = now if now - patch_version > patch_refresh_secs else patch_version
+    if new_version <= patch_version:
+        return False
+    patch_version = new_version
+    try:
+        patches = load_patch_csv(patch_csv)
+    except (OSError, KeyError, ValueError) as e:
+        # e.g. an ambiguous fix or a renamed column, part way through editing the sheet. Keep
+        # the last good one.
+        print(f'Unable to load {patch_csv}, keeping the previous corrections: {e}')
+        return False
+    print(f'Loaded {len(patches)} corrections from {patch_csv}')
+    return True
+
+
+# Check for changes to the GeoJSON file and corrections before every request.
 @app.before_request
 def maybe_load_features():
-    global features, mtime
+    global features, geojson_features, mtime
     new_mtime = os.stat(geojson_file).st_mtime
-    if new_mtime > mtime:
+    is_changed = new_mtime > mtime
+    if is_changed:
         mtime = new_mtime
         # Filter out the null geometries ahead of time.
-        features = [
-            f
-            for f in json.load(open(args.geojson))['features']
-            if f['geometry']
-        ]
-        print(f'Loaded {len(features)} features from {geojson_file}')
+        geojson_features = [f for f in iter_features(geojson_file) if f['geometry']]
+        print(f'Loaded {len(geojson_features)} features from {geojson_file}')
+    if patch_csv and maybe_load_patches():
+        is_changed = True
+    if is_changed:
+        features = apply_patches(geojson_features, patches)
 
 
 @app.route('/api/oldtoronto/lat_lng_counts')
@@ -102,9 +153,17 @@ if __name__ == '__main__':
     parser.add_argument('--port', type=int, help='Port on which to serve.', default=8081)
     parser.add_argument('geojson', type=str, default='data/images.geojson',
                         help='Path to images.geojson')
+    parser.add_argument('--patch_csv', type=str,
+                        help='Override sheet to apply on top of the GeoJSON, as for '
+                             'generate_geojson.py. Can be local or remote.',
+                        default=None)
+    parser.add_argument('--patch_refresh_secs', type=float,
+                        help='How often to fetch a remote --patch_csv again', default=60)
     args = parser.parse_args()
 
     geojson_file = args.geojson
+    patch_csv = args.patch_csv
+    patch_refresh_secs = args.patch_refresh_secs
     maybe_load_features()
 
     app.run(host='0.0.0.0', port=args.port, debug=True)
@@ -1,5 +1,5 @@
 #!/usr/bin/env python
-"""Debug tool to read a single URL from the sqlite cache.
+"""Debug tool to read a single URL from the cache.
 
 Usage:
 
@@ -17,7 +17,7 @@ def main():
     (_, url) = sys.argv
     f = fetcher.Fetcher()
     content = f.fetch_url_from_cache(url)
-    sys.stderr.write('Loading cached content from %s\n' % f._cache_path(url))
+    sys.stderr.write('Loading cached content from %s\n' % f.cache_location(url))
     print(content.decode('utf8'))
 
 
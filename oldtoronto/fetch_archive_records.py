@@ -6,8 +6,14 @@ Usage:
     ./fetch_archive_records.py list-of-ids.txt
 
 These can then be parsed into an ndjson file with parse_records.py.
+
+By default, this makes one request every two seconds. To crawl faster, allow several requests
+at once and let the rate rise while the server keeps up, e.g.:
+
+    ./fetch_archive_records.py --workers 4 --max_qps 5 list-of-ids.txt
 """
 
+import argparse
 import fileinput
 
 import fetcher
@@ -15,16 +21,22 @@ from toronto_archives import url_for_unique_id
 
 
 if __name__ == '__main__':
-    f = fetcher.Fetcher(throttle_secs=2.0)
-    any_uncached_fetches = False
-    for i, line in enumerate(fileinput.input()):
-        id_ = line.strip()
-        url = url_for_unique_id(id_)
-        in_cache = f.is_url_in_cache(url)
-        if in_cache and not any_uncached_fetches:
-            # Skip leading cached fetches to reduce logging verbosity.
+    parser = argparse.ArgumentParser('Fetch Toronto Archives record pages into the cache.')
+    parser.add_argument('files', nargs='*', help='Files of record IDs, one per line')
+    fetcher.add_concurrent_fetcher_args(parser, qps=0.5)
+    args = parser.parse_args()
+
+    f = fetcher.ConcurrentFetcher.from_args(args)
+    ids = [line.strip() for line in fileinput.input(args.files)]
+    urls = [url_for_unique_id(id_) for id_ in ids]
+    # Skip leading cached fetches to reduce logging verbosity.
+    num_cached = 0
+    while num_cached < len(urls) and f.is_url_in_cache(urls[num_cached]):
+        num_cached += 1
+
+    results = f.fetch_urls(urls[num_cached:])
+    for i, (id_, (url, content, error)) in enumerate(zip(ids[num_cached:], results)):
+        if error:
+            print('%5d Failed to fetch %s: %s (%s)' % (num_cached + i + 1, id_, url, error))
             continue
-        print('%5d Fetching %s: %s' % (i + 1, id_, url))
-        any_uncached_fetches = True
-        content = f.fetch_url(url)
-        print('  %d bytes%s' % (len(content), ' (cached)' if in_cache else ''))
+        print('%5d Fetched %s: %s, %d bytes' % (num_cached + i + 1, id_, url, len(content)))
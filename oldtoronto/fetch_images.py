@@ -2,8 +2,16 @@
 """Download all the images referenced from an images.ndjson file.
 
 Usage: ./fetch_images.py images.ndjson
+
+Images are streamed straight into images/, without going through the URL cache. Images which
+are already there are skipped, and partial downloads (images/*.part) from an interrupted run
+are resumed where they left off.
+
+By default this makes one request every three seconds. See fetch_archive_records.py for how to
+speed it up with --workers and --max_qps.
 """
 
+import argparse
 import fileinput
 import json
 import os
@@ -12,25 +20,41 @@ import requests
 
 import fetcher
 
-if __name__ == '__main__':
-    f = fetcher.Fetcher()
-    os.makedirs('images', exist_ok=True)
 
-    for i, line in enumerate(fileinput.input()):
+def image_path(url):
+    return os.path.join('images', os.path.basename(url))
+
+
+def images_to_fetch(files):
+    """Yield (url, path) for the images in the images.ndjson files which aren't downloaded."""
+    seen = set()
+    for line in fileinput.input(files):
         image = json.loads(line)
         url = image.get('imageLink')
         if not url:
             continue
-        path = os.path.join('images', os.path.basename(url))
-        if os.path.exists(path):
+        path = image_path(url)
+        if path in seen or os.path.exists(path):
             continue
-        try:
-            content = f.fetch_url(url)
-        except requests.exceptions.HTTPError as e:
-            if e.response.status_code == 404:
+        seen.add(path)
+        yield url, path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Download the images referenced from images.ndjson files.')
+    parser.add_argument('files', nargs='*', help='images.ndjson files')
+    fetcher.add_concurrent_fetcher_args(parser, qps=1 / 3)
+    args = parser.parse_args()
+
+    f = fetcher.ConcurrentFetcher.from_args(args)
+    os.makedirs('images', exist_ok=True)
+
+    for i, (url, path, error) in enumerate(f.download_all(images_to_fetch(args.files))):
+        if error:
+            if (isinstance(error, requests.exceptions.HTTPError) and
+                    error.response is not None and error.response.status_code == 404):
                 continue  # sadly, some images are just missing
-            raise
+            raise error
 
-        open(path, 'wb').write(content)
         if i > 0 and i % 20 == 0:
             print('Fetched %d images' % i)
@@ -1,7 +1,9 @@
 #!/usr/bin/env python
 """Fetch a bunch of URLs and store them permanently on-disk.
 
-This does rate-throttling.
+This does rate-throttling. Fetcher fetches one URL at a time; ConcurrentFetcher fetches many in
+parallel, with a limit on concurrent requests to each host and a rate which adapts to how the
+host is coping.
 
 The cache key is the URL. URLs are stored in a directory correspoding with their
 hostname and under their MD5 hash to avoid issues with escaping URLs in file names.
@@ -14,28 +16,144 @@ The storage format on disk is
     www.google.com/MD53
     ...
 
+Alternatively, everything can live in a single SQLite database, cache/cache.sqlite3, which is
+much faster to copy and to open. If that file exists, it's used instead of the directories. To
+convert a cache, run migrate_cache.py.
+
+Responses can optionally be stored compressed with gzip or zstd (if the zstandard package is
+installed), e.g. Cache(compression='gzip'), or CACHE_COMPRESSION in settings.py. They're
+decompressed transparently when read, and uncompressed responses can always be read. To
+compress (or decompress) an existing cache, run recompress_cache.py.
+
+The cache can be given a budget, e.g. Cache(max_bytes=10 ** 9), or CACHE_MAX_BYTES in
+settings.py. Once it's over budget, the least recently used responses are evicted. The Cache
+records when each response was last read, and how many lookups hit or missed in each program's
+last run (in cache/run_stats.json). To see these, or to clean up the cache, run manage_cache.py.
+
 Usage:
     ./fetcher.py path-to-list-of.urls.txt
 """
 
+import atexit
+import collections
+import concurrent.futures
+import datetime
 import fileinput
+import gzip
 import hashlib
 import io
 import json
 import logging
 import os
+import re
+import sqlite3
 import sys
+import threading
 import time
 import urllib
 
 from logging_configuration import configure_logging
+import settings
+from utils.rate_limiter import AdaptiveTokenBucket
 
 import requests
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 
 LOG = logging.getLogger(__name__)
 
 
+# Responses are stored under the SHA1 of their URL.
+HASH_RE = re.compile(r'[0-9a-f]{40}')
+
+# The file in the cache directory which holds the SQLite backend.
+SQLITE_FILE = 'cache.sqlite3'
+
+SQLITE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,  -- SHA1 of the URL, minus any API key.
+    host TEXT NOT NULL,
+    url TEXT,
+    contents BLOB NOT NULL,
+    accessed REAL  -- Unix time of the last read or write.
+)'''
+
+# Where each program's hit and miss counts from its last run are kept, in the cache directory.
+RUN_STATS_FILE = 'run_stats.json'
+
+# When the cache goes over its budget, evict responses until it's down to this fraction of it,
+# so that it doesn't have to evict again on the very next store.
+EVICT_TO_FRACTION = 0.9
+
+
+# Compressed responses start with this marker, then the codec name and a newline. Raw responses
+# are stored as-is; none of the cached HTML, XML, JSON or images start with a NUL byte.
+COMPRESSED_MARKER = b'\x00oldto-cache:'
+
+# Only store the compressed version if it's at most this fraction of the raw size. Responses
+# like JPEGs don't compress, and aren't worth decompressing on every read.
+MAX_COMPRESSED_RATIO = 0.9
+
+
+def _zstd_compress(contents):
+    return zstandard.ZstdCompressor(level=3).compress(contents)
+
+
+def _zstd_decompress(data):
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+# codec --> (compress, decompress)
+CODECS = {
+    'gzip': (lambda contents: gzip.compress(contents, compresslevel=6, mtime=0),
+             gzip.decompress),
+    'zstd': (_zstd_compress, _zstd_decompress)
+}
+
+
+def check_compression(compression):
+    """Raise ValueError unless compression is None or a usable codec."""
+    if compression is None:
+        return
+    if compression not in CODECS:
+        raise ValueError(f'Unknown cache compression: {compression}')
+    if compression == 'zstd' and not zstandard:
+        raise ValueError('zstd cache compression requires the zstandard package')
+
+
+def encode_contents(contents, compression):
+    """The blob to store for a response: either the compressed or the raw contents."""
+    if compression is None:
+        return contents
+    data = CODECS[compression][0](contents)
+    if len(data) > MAX_COMPRESSED_RATIO * len(contents):
+        return contents
+    return COMPRESSED_MARKER + compression.encode('ascii') + b'\n' + data
+
+
+def blob_compression(blob):
+    """The codec which a stored blob was compressed with, or None if it's raw."""
+    if not blob.startswith(COMPRESSED_MARKER):
+        return None
+    end = blob.index(b'\n', len(COMPRESSED_MARKER))
+    return blob[len(COMPRESSED_MARKER):end].decode('ascii')
+
+
+def decode_contents(blob):
+    """The original contents of a stored blob, decompressing it if need be."""
+    compression = blob_compression(blob)
+    if compression is None:
+        return blob
+    if compression == 'zstd' and not zstandard:
+        raise ValueError('Reading zstd-compressed responses requires the zstandard package')
+    header_len = len(COMPRESSED_MARKER) + len(compression) + 1
+    return CODECS[compression][1](memoryview(blob)[header_len:])
+
+
 class NotInCacheError(Exception):
     pass
 
@@ -48,39 +166,343 @@ class Response(object):
         return json.load(io.BytesIO(self.contents))
 
 
-class CacheSession(requests.Session):
-    """Monkey patch this is to replace requests.Session in order to cache get requests."""
-    def __init__(self, cache=None):
+# geocode.py replaces requests.Session with CacheSession, so dig out the real one.
+HttpSession = next(
+    cls for cls in requests.Session.__mro__ if cls.__module__ == 'requests.sessions')
+
+
+class CacheSession(HttpSession):
+    """Monkey patch this is to replace requests.Session in order to cache get requests.
+
+    If rate_limiter is set (e.g. to a utils.rate_limiter.TokenBucket), cache misses acquire a
+    token from it before going to the network. Cache hits are never throttled.
+    """
+    def __init__(self, cache=None, rate_limiter=None):
         super(CacheSession, self).__init__()
         self._cache = cache if cache else Cache()
+        self.rate_limiter = rate_limiter
+
+    @property
+    def cache(self):
+        return self._cache
 
     def send(self, request, **kwargs):
         url = request.url
         assert request.method == 'GET'
         resp = None
-        if self._cache.is_url_in_cache(url):
+        try:
+            contents = self._cache.fetch_url_from_cache(url)
             LOG.debug(f'cache hit for url: {url}')
             resp = Response()
-            resp.contents = self._cache.fetch_url_from_cache(url)
-        else:
+            resp.contents = contents
+        except NotInCacheError:
             LOG.debug(f'cache miss for url: {url}')
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
             resp = super(CacheSession, self).send(request, **kwargs)
             self._cache.store_url_in_cache(url, resp.content)
         return resp
 
 
+def _sha1(text):
+    return hashlib.sha1(text.encode('utf8')).hexdigest()
+
+
+class FileStorage(object):
+    """Stores each response in its own file, <cache_dir>/<host>/<key>, listed in urls.txt."""
+    def __init__(self, cache_dir):
+        self._cache_dir = cache_dir
+        self._urls_file = os.path.join(cache_dir, 'urls.txt')
+        self._urls_lock = threading.Lock()  # responses may be stored from several threads.
+
+    def location(self, host, key):
+        return os.path.join(self._cache_dir, host, key)
+
+    def get(self, host, key):
+        try:
+            with open(self.location(host, key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, host, key, url, contents):
+        path = self.location(host, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write the response under a temporary name first, so that a crash or a concurrent
+        # reader never sees (and serves) a partial one.
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(contents)
+        os.replace(tmp_path, path)
+        with self._urls_lock:
+            with open(self._urls_file, 'a') as f:
+                f.write('%s\t%s\n' % (_sha1(url), url))
+
+    def rewrite(self, host, key, contents):
+        """Replace an existing response atomically, e.g. to recompress it.
+
+        The new file keeps the old one's atime and mtime, so the LRU order is unchanged.
+        """
+        path = self.location(host, key)
+        stat = os.stat(path)
+        tmp_path = path + '.tmp'
+        open(tmp_path, 'wb').write(contents)
+        os.utime(tmp_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        os.replace(tmp_path, path)
+
+    def remove(self, host, key):
+        # Note: we leave the URL in cache/urls.txt. It's harmless there.
+        path = self.location(host, key)
+        if os.path.exists(path):
+            os.unlink(path)
+
+    def keys(self):
+        """Yield the (host, key) of every stored response, in directory order."""
+        for host_entry in os.scandir(self._cache_dir):
+            if not host_entry.is_dir():
+                continue
+            for entry in os.scandir(host_entry.path):
+                if HASH_RE.fullmatch(entry.name):
+                    yield host_entry.name, entry.name
+
+    def entries(self):
+        """Yield (host, key, size, accessed) for every stored response, in directory order.
+
+        accessed is the file's atime, which Cache sets explicitly when it reads a response.
+        """
+        for host_entry in os.scandir(self._cache_dir):
+            if not host_entry.is_dir():
+                continue
+            for entry in os.scandir(host_entry.path):
+                if HASH_RE.fullmatch(entry.name):
+                    stat = entry.stat()
+                    yield host_entry.name, entry.name, stat.st_size, stat.st_atime
+
+    def touch(self, accessed):
+        """Record access times, given a dict mapping (host, key) --> Unix time."""
+        for (host, key), t in accessed.items():
+            path = self.location(host, key)
+            try:
+                os.utime(path, (t, os.stat(path).st_mtime))
+            except FileNotFoundError:
+                pass  # removed since it was read.
+
+    def urls(self):
+        """All the URLs which were ever stored, oldest first. Some may have been removed."""
+        if not os.path.exists(self._urls_file):
+            return
+        for line in open(self._urls_file):
+            yield line.rstrip('\n').partition('\t')[2]
+
+    def compact(self, is_live):
+        """Rewrite urls.txt without the URLs for which is_live(url) is false, or duplicates.
+
+        A URL which was stored several times keeps its last position. This shouldn't be run
+        while another process is storing responses in the same cache.
+
+        Returns:
+            The number of lines in urls.txt before and after.
+        """
+        if not os.path.exists(self._urls_file):
+            return 0, 0
+        with self._urls_lock:
+            lines = open(self._urls_file).readlines()
+            last = {}  # url --> index of its last line
+            for i, line in enumerate(lines):
+                last[line.rstrip('\n').partition('\t')[2]] = i
+            keep = sorted(i for url, i in last.items() if is_live(url))
+            tmp_path = self._urls_file + '.tmp'
+            with open(tmp_path, 'w') as f:
+                f.writelines(lines[i] for i in keep)
+            os.replace(tmp_path, self._urls_file)
+        return len(lines), len(keep)
+
+    def flush(self):
+        pass
+
+
+class SqliteStorage(object):
+    """Stores all the responses in a single SQLite database.
+
+    Writes are committed in batches of commit_every, and when the process exits. The database
+    uses write-ahead logging, so other processes can read it while this one writes.
+    """
+    def __init__(self, path, commit_every=100):
+        self._path = path
+        self._commit_every = commit_every
+        self._num_pending = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(SQLITE_SCHEMA)
+        columns = [row[1] for row in self._db.execute('PRAGMA table_info(responses)')]
+        if 'accessed' not in columns:  # created before access times were recorded.
+            self._db.execute('ALTER TABLE responses ADD COLUMN accessed REAL')
+        self._db.commit()
+        atexit.register(self.flush)
+
+    def location(self, host, key):
+        return f'{self._path}#{key}'
+
+    def get(self, host, key):
+        with self._lock:
+            row = self._db.execute(
+                'SELECT contents FROM responses WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, host, key, url, contents):
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO responses (key, host, url, contents, accessed) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (key, host, url, contents, time.time()))
+            self._wrote()
+
+    def rewrite(self, host, key, contents):
+        with self._lock:
+            self._db.execute('UPDATE responses SET contents = ? WHERE key = ?', (contents, key))
+            self._wrote()
+
+    def remove(self, host, key):
+        with self._lock:
+            self._db.execute('DELETE FROM responses WHERE key = ?', (key,))
+            self._wrote()
+
+    def keys(self):
+        """Yield the (host, key) of every stored response, in key order."""
+        with self._lock:
+            rows = self._db.execute('SELECT host, key FROM responses ORDER BY key').fetchall()
+        yield from rows
+
+    def entries(self):
+        """Yield (host, key, size, accessed) for every stored response, in key order.
+
+        Responses which were stored before access times were recorded have an accessed of 0.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT host, key, length(contents), coalesce(accessed, 0) FROM responses '
+                'ORDER BY key').fetchall()
+        yield from rows
+
+    def touch(self, accessed):
+        """Record access times, given a dict mapping (host, key) --> Unix time."""
+        with self._lock:
+            self._db.executemany(
+                'UPDATE responses SET accessed = ? WHERE key = ?',
+                [(t, key) for (_, key), t in accessed.items()])
+            self._db.commit()
+            self._num_pending = 0
+
+    def urls(self):
+        """All the URLs in the database, oldest first."""
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT url FROM responses WHERE url IS NOT NULL ORDER BY rowid').fetchall()
+        for (url,) in rows:
+            yield url
+
+    def compact(self, is_live):
+        """Reclaim the space of removed responses. The database has no dead URLs to drop.
+
+        Returns:
+            The number of URLs before and after, which are the same.
+        """
+        with self._lock:
+            self._db.commit()
+            self._num_pending = 0
+            self._db.execute('VACUUM')
+            num_urls = self._db.execute(
+                'SELECT count(*) FROM responses WHERE url IS NOT NULL').fetchone()[0]
+        return num_urls, num_urls
+
+    def _wrote(self):
+        self._num_pending += 1
+        if self._num_pending >= self._commit_every:
+            self._db.commit()
+            self._num_pending = 0
+
+    def flush(self):
+        with self._lock:
+            self._db.commit()
+            self._num_pending = 0
+
+
+def least_recently_used(entries, max_bytes):
+    """Pick the responses to evict to bring a cache down to max_bytes.
+
+    entries are (host, key, size, accessed) tuples, as yielded by Cache.entries().
+
+    Returns:
+        The (host, key) of the least recently used responses which need to go, and the number
+        of bytes which would be left.
+    """
+    entries = sorted(entries, key=lambda entry: entry[3])
+    num_bytes = sum(entry[2] for entry in entries)
+    evicted = []
+    for host, key, size, _ in entries:
+        if num_bytes <= max_bytes:
+            break
+        num_bytes -= size
+        evicted.append((host, key))
+    return evicted, num_bytes
+
+
+# This process's hit, miss, store and eviction counts, by cache directory. All the Caches on the
+# same directory share them, e.g. the ones in CacheSession and OfflineGeocoder.from_cache.
+_RUN_COUNTS = collections.defaultdict(collections.Counter)
+_RUN_COUNTS_LOCK = threading.Lock()
+
+
 class Cache(object):
-    """Store get request responses, keyed by their url."""
-    def __init__(self, cache_dir='cache'):
+    """Store get request responses, keyed by their url.
+
+    backend is either 'files' (one file per URL) or 'sqlite' (a single cache.sqlite3 file in
+    cache_dir). By default, the SQLite backend is used if that file exists. See migrate_cache.py.
+
+    compression is the codec for newly stored responses: None, 'gzip' or 'zstd'. It defaults to
+    settings.CACHE_COMPRESSION. Responses are read the same way whatever it is.
+
+    The first lookup loads the keys of all the cached responses into memory, so that checking
+    whether an URL is cached doesn't touch the disk. The index stays consistent with this
+    Cache's own stores, removals and evictions, even from several threads, but not with other
+    processes writing to the same cache.
+
+    max_bytes is the most space which the stored responses may take up, or None for no limit.
+    It defaults to settings.CACHE_MAX_BYTES. When a store takes the cache over the limit, the
+    least recently used responses are evicted. Access times and run stats are written by
+    flush(), which is called when the process exits.
+    """
+    def __init__(self, cache_dir='cache', backend=None, compression=None, max_bytes=None):
         super(Cache, self).__init__()
         self._cache_dir = cache_dir
+        self._compression = compression or settings.CACHE_COMPRESSION
+        check_compression(self._compression)
+        self._max_bytes = max_bytes or settings.CACHE_MAX_BYTES
         os.makedirs(self._cache_dir, exist_ok=True)
-        self._urls_file = os.path.join(self._cache_dir, 'urls.txt')
-
-    def _cache_path(self, url):
-        """Returns path to the cached version of an URL, regardless of whether it exists."""
+        sqlite_path = os.path.join(self._cache_dir, SQLITE_FILE)
+        if backend is None:
+            backend = 'sqlite' if os.path.exists(sqlite_path) else 'files'
+        if backend == 'sqlite':
+            self._storage = SqliteStorage(sqlite_path)
+        elif backend == 'files':
+            self._storage = FileStorage(self._cache_dir)
+        else:
+            raise ValueError(f'Unknown cache backend: {backend}')
+        self._index = None  # (host, key) --> position in storage order
+        self._index_lock = threading.Lock()
+        self._num_bytes = None  # size of all the stored responses, once it's needed.
+        self._accessed = {}  # (host, key) --> time of a read which hasn't been recorded yet
+        self._run_counts = _RUN_COUNTS[os.path.realpath(cache_dir)]
+        atexit.register(self.flush)
+
+    def _cache_key(self, url):
+        """Returns the (hostname, hash) under which an URL is cached, regardless of whether it is.
+
+        The hash ignores the API key, if there is one.
+        """
         parsed_url = urllib.parse.urlparse(url)
-        dir_path = os.path.join(self._cache_dir, parsed_url.netloc)
         query_minus_api_key = urllib.parse.urlencode(
             self._remove_api_key_query_param(parsed_url.query))
         url_transformed = urllib.parse.urlunparse((
@@ -90,44 +512,184 @@ class Cache(object):
             parsed_url.params,
             query_minus_api_key,
             parsed_url.fragment))
-        return os.path.join(dir_path, self._hash(url_transformed))
+        return parsed_url.netloc, self._hash(url_transformed)
 
     def _hash(self, url):
         """Compute SHA1 checksum for the URL."""
-        return hashlib.sha1(url.encode('utf8')).hexdigest()
+        return _sha1(url)
 
     def _remove_api_key_query_param(self, qp):
         parsed = urllib.parse.parse_qsl(qp)
         return [(k, v) for k, v in parsed if k != 'key']
 
+    def _keys(self):
+        """The index of cached responses, which is loaded on first use."""
+        if self._index is None:
+            with self._index_lock:
+                if self._index is None:
+                    index = {}
+                    for host_key in self._storage.keys():
+                        index.setdefault(host_key, len(index))
+                    LOG.debug(f'Indexed {len(index):,} cached responses')
+                    self._index = index
+        return self._index
+
+    def location(self, url):
+        """Where an URL is (or would be) cached, e.g. a path. Useful for debugging."""
+        return self._storage.location(*self._cache_key(url))
+
     def fetch_url_from_cache(self, url):
-        path = self._cache_path(url)
-        if not os.path.exists(path):
+        host_key = self._cache_key(url)
+        index = self._keys()
+        contents = self._storage.get(*host_key) if host_key in index else None
+        if contents is None:
+            index.pop(host_key, None)  # e.g. deleted by another process.
+            self._count('misses')
             raise NotInCacheError()
-        return open(path, 'rb').read()
+        self._record_hit(host_key)
+        return decode_contents(contents)
 
     def is_url_in_cache(self, url):
-        return os.path.exists(self._cache_path(url))
+        return self._cache_key(url) in self._keys()
 
     def store_url_in_cache(self, url, contents):
-        path = self._cache_path(url)
-        os.makedirs(os.path.dirname(path), exist_ok=True)
-        open(path, 'wb').write(contents)
-        open(self._urls_file, 'a').write('%s\t%s\n' % (self._hash(url), url))
+        host, key = self._cache_key(url)
+        blob = encode_contents(contents, self._compression)
+        index = self._keys()
+        # Stores, removals and evictions hold the index lock, so that the index stays in step
+        # with storage when they come from several threads.
+        with self._index_lock:
+            self._storage.put(host, key, url, blob)
+            index.setdefault((host, key), len(index))
+            num_bytes = self._add_bytes(len(blob))
+        self._count('stores')
+        if self._max_bytes and num_bytes > self._max_bytes:
+            self.evict(int(EVICT_TO_FRACTION * self._max_bytes))
 
     def remove_url_from_cache(self, url):
-        # Note: we leave the URL in cache/urls.txt. It's harmless there.
-        path = self._cache_path(url)
-        if os.path.exists(path):
-            os.unlink(path)
+        host_key = self._cache_key(url)
+        index = self._keys()
+        with self._index_lock:
+            self._storage.remove(*host_key)
+            index.pop(host_key, None)
+
+    def iter_cached(self, urls):
+        """Yield (url, contents) for each of the urls which is cached, in storage order.
+
+        Reading many responses in the order in which they're stored (directory order for files,
+        key order for SQLite) is faster than reading them in an arbitrary order.
+        """
+        index = self._keys()
+        cached = []
+        for url in urls:
+            host_key = self._cache_key(url)
+            if host_key in index:
+                cached.append((index[host_key], url, host_key))
+        cached.sort(key=lambda c: c[0])
+        for _, url, host_key in cached:
+            contents = self._storage.get(*host_key)
+            if contents is not None:
+                self._record_hit(host_key)
+                yield url, decode_contents(contents)
+
+    def urls(self):
+        """Iterate over the URLs which have been cached, oldest first."""
+        return self._storage.urls()
+
+    def entries(self):
+        """Yield (host, key, size, accessed) for every cached response, in storage order."""
+        return self._storage.entries()
+
+    def _count(self, event, n=1):
+        with _RUN_COUNTS_LOCK:
+            self._run_counts[event] += n
+
+    def _record_hit(self, host_key):
+        with _RUN_COUNTS_LOCK:
+            self._run_counts['hits'] += 1
+            self._accessed[host_key] = time.time()
+
+    def _add_bytes(self, num_bytes):
+        """Keep track of the total size of the cache, which is computed on first use.
+
+        The caller must hold the index lock.
+        """
+        if self._num_bytes is None:
+            self._num_bytes = sum(entry[2] for entry in self._storage.entries())
+        else:
+            self._num_bytes += num_bytes
+        return self._num_bytes
+
+    def evict(self, max_bytes):
+        """Remove the least recently used responses until the cache is at most max_bytes.
+
+        Returns:
+            The (host, key) of each evicted response, least recently used first.
+        """
+        self._save_accessed()
+        index = self._keys()
+        with self._index_lock:
+            evicted, num_bytes = least_recently_used(self._storage.entries(), max_bytes)
+            for host_key in evicted:
+                self._storage.remove(*host_key)
+                index.pop(host_key, None)
+            self._num_bytes = num_bytes
+        if evicted:
+            self._count('evictions', len(evicted))
+            LOG.info(f'Evicted {len(evicted):,} responses from {self._cache_dir}; '
+                     f'{num_bytes:,} bytes remain.')
+        return evicted
+
+    def compact(self):
+        """Drop URLs which are no longer cached from urls.txt, or reclaim space in SQLite.
+
+        Returns:
+            The number of URLs listed before and after.
+        """
+        index = self._keys()
+        return self._storage.compact(lambda url: self._cache_key(url) in index)
+
+    def _save_accessed(self):
+        with _RUN_COUNTS_LOCK:
+            accessed, self._accessed = self._accessed, {}
+        if accessed:
+            self._storage.touch(accessed)
+
+    def _save_run_stats(self):
+        """Record this program's counts in run_stats.json, replacing those of its last run."""
+        with _RUN_COUNTS_LOCK:
+            counts = dict(self._run_counts)
+        if not counts or not os.path.isdir(self._cache_dir):
+            return
+        path = os.path.join(self._cache_dir, RUN_STATS_FILE)
+        try:
+            run_stats = json.load(open(path))
+        except (FileNotFoundError, ValueError):
+            run_stats = {}
+        program = os.path.basename(sys.argv[0]) or 'python'
+        run_stats[program] = {
+            'finished': datetime.datetime.now().isoformat(timespec='seconds'),
+            **{event: counts.get(event, 0) for event in ('hits', 'misses', 'stores', 'evictions')}
+        }
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(run_stats, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, path)
+
+    def flush(self):
+        """Make sure that everything which has been stored or read is recorded on disk."""
+        self._save_accessed()
+        self._storage.flush()
+        self._save_run_stats()
 
 
 class Fetcher(object):
     """Provides throttling on top of the cache object."""
-    def __init__(self, throttle_secs=3.0, cache_dir='cache'):
-        self._cache = Cache(cache_dir)
+    def __init__(self, throttle_secs=3.0, cache_dir='cache', compression=None, max_bytes=None):
+        self._cache = Cache(cache_dir, compression=compression, max_bytes=max_bytes)
         self._throttle_secs = throttle_secs
         self._last_fetch = 0.0
+        self._session = HttpSession()  # reuses connections between requests.
 
     def fetch_url(self, url, force_refetch=False):
         if force_refetch:
@@ -145,7 +707,7 @@ class Fetcher(object):
 
         print('Fetching %s...' % url)
         self._last_fetch = time.time()
-        response = requests.get(url)
+        response = self._session.get(url)
         response.raise_for_status()  # checks for status == 200 OK
 
         contents = response.content
@@ -162,6 +724,268 @@ class Fetcher(object):
         # Note: we leave the URL in cache/urls.txt. It's harmless there.
         self._cache.remove_url_from_cache(url)
 
+    def cache_location(self, url):
+        return self._cache.location(url)
+
+
+# Responses with these statuses mean that the server is overloaded, or asking us to slow down.
+# Requests which get them are retried.
+THROTTLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class IncompleteDownloadError(requests.exceptions.RequestException):
+    """A download's body was shorter than its Content-Length, e.g. the connection dropped."""
+
+
+def content_length(response):
+    """The length of a response's body according to its headers, or None if they don't say."""
+    try:
+        return int(response.headers['Content-Length'])
+    except (KeyError, ValueError):
+        return None
+
+
+def retry_after_secs(response):
+    """How long a response asks us to wait before trying again, if it says in seconds."""
+    try:
+        return float(response.headers.get('Retry-After', ''))
+    except ValueError:
+        return None
+
+
+class ConcurrentFetcher(object):
+    """Fetches many URLs in parallel, caching them like Fetcher.
+
+    At most per_host requests to any one host are in flight at once. Each host also gets an
+    AdaptiveTokenBucket which starts at rate requests/sec and can speed up to max_rate while
+    the host responds promptly. 429 and 5xx responses, connection errors and responses slower
+    than slow_secs slow it down again. Throttled and failed requests are retried up to retries
+    times. Connections are kept alive and reused, up to per_host of them for each host.
+
+    Cached URLs are returned without touching the network, or counting against the rate.
+    """
+    def __init__(self, cache_dir='cache', per_host=4, rate=1.0, max_rate=None, workers=None,
+                 retries=3, slow_secs=10.0, timeout_secs=60.0, cache=None):
+        self._cache = cache if cache else Cache(cache_dir)
+        self._per_host = per_host
+        self._rate = rate
+        self._max_rate = max_rate if max_rate is not None else rate
+        self._workers = workers or per_host
+        self._retries = retries
+        self._slow_secs = slow_secs
+        self._timeout_secs = timeout_secs
+        self._hosts = {}  # host --> (semaphore, AdaptiveTokenBucket)
+        self._hosts_lock = threading.Lock()
+        self._session = HttpSession()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=per_host, pool_block=True)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    def _host(self, url):
+        host = urllib.parse.urlparse(url).netloc
+        with self._hosts_lock:
+            if host not in self._hosts:
+                self._hosts[host] = (
+                    threading.BoundedSemaphore(self._per_host),
+                    AdaptiveTokenBucket(self._rate, max_rate=self._max_rate,
+                                        slow_secs=self._slow_secs))
+            return self._hosts[host]
+
+    @classmethod
+    def from_args(cls, args, **kwargs):
+        """Construct a ConcurrentFetcher from the flags added by add_concurrent_fetcher_args."""
+        return cls(per_host=args.workers, rate=args.qps, max_rate=args.max_qps, **kwargs)
+
+    def rate(self, host):
+        """The current request rate for a host, in requests/sec."""
+        return self._hosts[host][1].rate
+
+    def fetch_url(self, url):
+        """Fetch a single URL, from the cache if possible.
+
+        Returns:
+            A (url, contents, error) tuple. If the fetch failed, contents is None and error is
+            the exception, e.g. a requests.HTTPError for a 404.
+        """
+        try:
+            return url, self._cache.fetch_url_from_cache(url), None
+        except NotInCacheError:
+            pass
+
+        slots, bucket = self._host(url)
+        error = None
+        for _ in range(1 + self._retries):
+            with slots:
+                bucket.acquire()
+                start = time.monotonic()
+                try:
+                    response = self._session.get(url, timeout=self._timeout_secs)
+                except requests.exceptions.RequestException as e:
+                    LOG.warn(f'Error fetching {url}: {e}')
+                    bucket.on_throttle()
+                    error = e
+                    continue
+                latency = time.monotonic() - start
+            try:
+                response.raise_for_status()
+            except requests.exceptions.HTTPError as e:
+                error = e
+                if response.status_code in THROTTLE_STATUSES:
+                    LOG.warn(f'Throttled fetching {url}: {response.status_code}')
+                    bucket.on_throttle(retry_after_secs(response))
+                    continue
+                bucket.on_success(latency)
+                return url, None, e  # e.g. a 404, which won't go away by retrying.
+            bucket.on_success(latency)
+            self._cache.store_url_in_cache(url, response.content)
+            return url, response.content, None
+        return url, None, error
+
+    def download(self, url, path, chunk_size=64 * 1024):
+        """Stream a URL straight into a file, without keeping it in memory or the cache.
+
+        The response is written to path + '.part' in chunks, which is renamed to path once it's
+        complete. If a .part file is left over from an interrupted download, only the rest of
+        it is requested, with an HTTP Range header. A body which comes up short of its
+        Content-Length is kept in the .part file and resumed by the next attempt, so path only
+        ever holds a whole response. If the URL was cached by an older version of this script,
+        the cached copy is used instead.
+
+        Returns:
+            A (url, path, error) tuple. error is None if the download succeeded.
+        """
+        part_path = path + '.part'
+        if self._cache.is_url_in_cache(url):
+            try:
+                contents = self._cache.fetch_url_from_cache(url)
+            except NotInCacheError:
+                pass
+            else:
+                with open(part_path, 'wb') as f:
+                    f.write(contents)
+                os.replace(part_path, path)
+                return url, path, None
+
+        slots, bucket = self._host(url)
+        error = None
+        for _ in range(1 + self._retries):
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            # Without compression, Content-Length is the number of bytes which get written.
+            headers = {'Accept-Encoding': 'identity'}
+            if offset:
+                headers['Range'] = f'bytes={offset}-'
+            with slots:
+                bucket.acquire()
+                start = time.monotonic()
+                try:
+                    with self._session.get(url, headers=headers, stream=True,
+                                           timeout=self._timeout_secs) as response:
+                        latency = time.monotonic() - start
+                        if response.status_code == 416 and offset:
+                            os.unlink(part_path)  # the partial file is bad. Start over.
+                            error = requests.exceptions.HTTPError(response=response)
+                            continue
+                        if response.status_code in THROTTLE_STATUSES:
+                            LOG.warn(f'Throttled downloading {url}: {response.status_code}')
+                            bucket.on_throttle(retry_after_secs(response))
+                            error = requests.exceptions.HTTPError(response=response)
+                            continue
+                        if response.status_code >= 400:
+                            bucket.on_success(latency)
+                            return url, path, requests.exceptions.HTTPError(
+                                f'{response.status_code} for url: {url}', response=response)
+                        content_range = response.headers.get('Content-Range', '')
+                        if (response.status_code == 206 and
+                                not content_range.startswith(f'bytes {offset}-')):
+                            # Not the rest of the .part file, so start over without a Range.
+                            LOG.warn(f'Unexpected Content-Range downloading {url}: '
+                                     f'{content_range!r}')
+                            if os.path.exists(part_path):
+                                os.unlink(part_path)
+                            error = requests.exceptions.HTTPError(
+                                f'Unexpected Content-Range {content_range!r} for url: {url}',
+                                response=response)
+                            continue
+                        # A 200 rather than a 206 means the server ignored the Range header.
+                        start = offset if response.status_code == 206 else 0
+                        with open(part_path, 'ab' if start else 'wb') as f:
+                            for chunk in response.iter_content(chunk_size):
+                                f.write(chunk)
+                        length = content_length(response)
+                        size = os.path.getsize(part_path)
+                        if length is not None and size != start + length:
+                            # urllib3 doesn't always notice a connection which closes early.
+                            LOG.warn(f'Incomplete download of {url}: got {size:,} of '
+                                     f'{start + length:,} bytes')
+                            bucket.on_throttle()
+                            error = IncompleteDownloadError(
+                                f'Got {size:,} of {start + length:,} bytes of {url}')
+                            continue
+                except requests.exceptions.RequestException as e:
+                    # Whatever made it into the .part file is kept for the next attempt.
+                    LOG.warn(f'Error downloading {url}: {e}')
+                    bucket.on_throttle()
+                    error = e
+                    continue
+            bucket.on_success(latency)
+            os.replace(part_path, path)
+            return url, path, None
+        return url, path, error
+
+    def _map(self, fn, args):
+        """Call fn(*a) for each a in args from the thread pool, yielding results in order."""
+        pending = collections.deque()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self._workers) as executor:
+            for a in args:
+                pending.append(executor.submit(fn, *a))
+                # Don't read far ahead of the slowest in-flight request.
+                while len(pending) > 4 * self._workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def fetch_urls(self, urls):
+        """Fetch many URLs in parallel.
+
+        Yields:
+            A (url, contents, error) tuple for each URL, in the same order as urls. See
+            fetch_url.
+        """
+        return self._map(self.fetch_url, ((url,) for url in urls))
+
+    def download_all(self, urls_and_paths):
+        """Download many (url, path) pairs in parallel.
+
+        No two of the paths may be the same.
+
+        Yields:
+            A (url, path, error) tuple for each pair, in order. See download.
+        """
+        return self._map(self.download, urls_and_paths)
+
+    def is_url_in_cache(self, url):
+        return self._cache.is_url_in_cache(url)
+
+    def fetch_url_from_cache(self, url):
+        return self._cache.fetch_url_from_cache(url)
+
+
+def add_concurrent_fetcher_args(parser, qps):
+    """Add the flags for ConcurrentFetcher.from_args to an ArgumentParser.
+
+    The defaults make one request at a time, at qps requests/sec.
+    """
+    parser.add_argument('--workers', type=int,
+                        help='Maximum number of concurrent requests to each host',
+                        default=1)
+    parser.add_argument('--qps', type=float,
+                        help='Requests per second to each host to start with',
+                        default=qps)
+    parser.add_argument('--max_qps', type=float,
+                        help='The request rate rises to this while the host responds quickly, '
+                             'and falls on errors. Defaults to --qps.',
+                        default=None)
+
 
 if __name__ == '__main__':
     configure_logging()
@@ -4,20 +4,37 @@
 Inputs:
     data/images.ndjson
     data/geocode_results.json
-    data/image-sizes.txt
+    data/image-sizes.txt (from image_sizes.py)
 
 Output:
     data/images.geojson
+
+To combine several sources into one file, describe each with --source_spec instead, e.g.
+
+    oldtoronto/generate_geojson.py \\
+      --source_spec source=toronto-archives,input=data/toronto-archives/images.ndjson,... \\
+      --source_spec source=tpl,input=data/tpl/non-star-images.ndjson,...,drop_unlocated \\
+      --output data/images.geojson
+
+Each source is then processed in its own worker process. Their features are written to the
+output in the order the sources are given, and counts are printed for each source.
 """
 import argparse
+import collections
 import json
+import multiprocessing
 import os
+import queue
+import traceback
+
 import pandas as pd
 
 from date_distribution import parse_year
+from image_sizes import load_image_sizes
 from toronto_archives import SHORT_URL_PATTERN
 from utils.generators import read_ndjson_file
 from utils.deep_update import deep_update
+from utils.geojson import FeatureWriter
 
 # Possible sources of imagery.
 SOURCE_TPL = 'tpl'
@@ -29,23 +46,8 @@ ARCHIVES_FIELDS = ('date', 'physical_desc', 'citation', 'condition', 'scope')
 TPL_FIELDS = ('date', 'creator', 'description', 'subject')
 
 
-def load_image_sizes(sizes_file):
-    """Load image sizes into a path --> [width, height] dict."""
-    # The image sizes file is the output of something like
-    # identify 'images/*.jpg' > image-sizes.txt
-    # A sample line looks like:
-    # images/f0124_fl0001_id0001.jpg JPEG 1050x715 1050x715+0+0 8-bit sRGB 122804B 0.000u 0:00.009
-    path_to_dimensions = {}
-    for line in open(sizes_file):
-        parts = line.split(' ')
-        path = os.path.basename(parts[0])
-        dims = [int(x) for x in parts[2].split('x')]
-        path_to_dimensions[path] = dims
-    return path_to_dimensions
-
-
 def url_to_filename(url):
-    return os.path.splitext(os.path.basename(image_url))[0]
+    return os.path.splitext(os.path.basename(url))[0]
 
 
 def get_thumbnail_url(image_url):
@@ -68,7 +70,8 @@ def load_patch_csv(patch_csv):
     """
     Load the patch csv as a dict. All photo's that have an explicit lat, lng
     value are returned. Photo's occuring more than once are returned with a value
-    of None unless their Fixed column is set to the 'Yes' (case sensitive).
+    of None unless they have a lat, lng or their Fixed column is set to the 'Yes'
+    (case sensitive). Photo's marked as Fixed are left out altogether.
 
     Args:
         patch_csv: path or remote spec of the csv
@@ -78,20 +81,23 @@ def load_patch_csv(patch_csv):
         if it contains a tuple, use that as an override value for lat, lng
     """
     data = pd.read_csv(patch_csv, dtype={'Fixed': object})
-    fixed = set(data[data['Fixed'] == 'Yes']['Photo Id'])
-    photo_id_to_lat_lng = {}
-    for _, row in data[pd.notnull(data['Lat']) & pd.notnull(data['Lng'])].iterrows():
-        lat_lng = (row['Lat'], row['Lng'])
-        photo_id = row['Photo Id']
-        if photo_id_to_lat_lng.get(photo_id, lat_lng) != lat_lng:
-            raise ValueError(f'Ambiguous fix for {photo_id}')
-        photo_id_to_lat_lng[photo_id] = lat_lng
-    photo_counts = data['Photo Id'].value_counts()
-    occurs_often = set(photo_counts[photo_counts > 1].index)
-    # Conctruct the return dict by checking for each in either photo_id_to_lat_lng or
-    # occurs_often if they are in fixed and if not lookup their value:
-    all_keys = occurs_often.union(photo_id_to_lat_lng.keys())
-    return {str(key): photo_id_to_lat_lng.get(key) for key in all_keys if key not in fixed}
+    photo_ids = data['Photo Id']
+    located = data[pd.notnull(data['Lat']) & pd.notnull(data['Lng'])]
+    # One row per distinct (photo, lat, lng). Any photo left with two rows has conflicting fixes.
+    lat_lngs = located.drop_duplicates(['Photo Id', 'Lat', 'Lng'])
+    ambiguous = lat_lngs['Photo Id'][lat_lngs['Photo Id'].duplicated()]
+    if len(ambiguous):
+        raise ValueError(f'Ambiguous fix for {ambiguous.iloc[0]}')
+    photo_id_to_lat_lng = dict(zip(
+        lat_lngs['Photo Id'].tolist(),
+        zip(lat_lngs['Lat'].tolist(), lat_lngs['Lng'].tolist())
+    ))
+
+    photo_counts = photo_ids.value_counts()
+    occurs_often = photo_counts.index[photo_counts > 1]
+    fixed = photo_ids[data['Fixed'] == 'Yes'].unique()
+    keys = pd.Index(lat_lngs['Photo Id']).union(occurs_often).difference(fixed)
+    return {str(key): photo_id_to_lat_lng.get(key) for key in keys.tolist()}
 
 
 def get_source_properties(source, record):
@@ -132,101 +138,100 @@ def get_source_properties(source, record):
         raise ValueError(f'Invalid source {source}')
 
 
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser('Collect data on all the images into a GeoTempoJSON file.')
-    parser.add_argument('--input', type=str,
-                        help='Path to ndjson file containing all image records.')
-    parser.add_argument('--parent_data', type=str,
-                        help='mapping uniqueID to metadata scraped from parent series/fonds/etc',
-                        default='')
-    parser.add_argument('--geocode_results', type=str,
-                        help='json results from geocoding files',
-                        default='data/geocode_results.json')
-    parser.add_argument('--path_to_size', type=str,
-                        help='txt file containing size in pixels of each images.',
-                        default='data/image-sizes.txt')
-    parser.add_argument('--output', type=str,
-                        help='geojson encoded version of geocodes and images metadata',
-                        default='data/images.geojson')
-    parser.add_argument('--patch_csv', type=str,
-                        help='path to a csv to override lat/lngs. Can be local or remote. '
-                             'rows with missing lat/lngs will be skipped in the output.',
-                        default='data/Old Toronto Responses - Override Sheet.csv')
-    parser.add_argument('--drop_unlocated', action='store_true',
-                        help='Omit records without a location, rather than giving them '
-                             'a null geometry. This reduces file size on disk.')
-    parser.add_argument('--source', type=str, default='toronto-archives',
-                        help='Set this to either "toronto-archives" or "tpl". This affects how '
-                             'metadata is attached to the image records.')
-    args = parser.parse_args()
-
-    assert args.source in SOURCES
-
-    parent_data = json.load(open(args.parent_data)) if args.parent_data else {}
-    id_to_geocode = json.load(open(args.geocode_results))
-    path_to_size = load_image_sizes(args.path_to_size)
-
-    num_total = 0
-    num_missing_ids = 0
-    num_missing_images = 0
-    num_processed = 0
-    num_with_dates = 0
-    num_with_geocodes = 0
-    num_with_parent_geocodes = 0
-    num_invalid = 0
-    num_excluded_csv = 0
+# Keys of a --source_spec, and whether they're required.
+SOURCE_SPEC_KEYS = {
+    'source': True,
+    'input': True,
+    'geocode_results': True,
+    'path_to_size': True,
+    'parent_data': False,
+    'drop_unlocated': False,
+}
+
+# Number of serialized features a worker sends back at a time.
+FEATURE_BATCH_SIZE = 1000
+
+
+def parse_source_spec(spec):
+    """Parse a --source_spec like 'source=tpl,input=a.ndjson,...,drop_unlocated' into a dict."""
+    config = {'parent_data': '', 'drop_unlocated': False}
+    for part in spec.split(','):
+        key, has_value, value = part.partition('=')
+        if key not in SOURCE_SPEC_KEYS:
+            raise argparse.ArgumentTypeError(f'Unknown key "{key}" in {spec}')
+        if key == 'drop_unlocated':
+            value = not has_value or value.lower() in ('true', 'yes', '1')
+        config[key] = value
+    missing = [
+        key for key, required in SOURCE_SPEC_KEYS.items() if required and not config.get(key)
+    ]
+    if missing:
+        raise argparse.ArgumentTypeError(f'{spec} is missing {", ".join(missing)}')
+    if config['source'] not in SOURCES:
+        raise argparse.ArgumentTypeError(f'Invalid source {config["source"]}')
+    return config
+
+
+def generate_features(config, patch_csv, stats):
+    """Yield the GeoJSON features for one source.
 
-    patch_csv = load_patch_csv(args.patch_csv)
+    Args:
+        config: a dict, as returned by parse_source_spec.
+        patch_csv: overrides, as returned by load_patch_csv.
+        stats: a Counter, which is updated with what happened to each record.
+    """
+    parent_data = json.load(open(config['parent_data'])) if config['parent_data'] else {}
+    id_to_geocode = json.load(open(config['geocode_results']))
+    path_to_size = load_image_sizes(config['path_to_size'])
 
-    features = []
-    for record in read_ndjson_file(args.input):
-        num_total += 1
+    for record in read_ndjson_file(config['input']):
+        stats['total'] += 1
 
         id_ = record.get('uniqueID')
         if not id_:
-            num_missing_ids += 1
+            stats['missing_ids'] += 1
             continue
 
         if not record.get('imageLink'):
-            num_missing_images += 1
+            stats['missing_images'] += 1
             continue
 
         patched = patch_csv.get(id_, '')
         if patched is None:
-            num_excluded_csv += 1
+            stats['excluded_csv'] += 1
             continue
 
         parent_rec = parent_data.get(id_, {})
-        num_processed += 1
+        stats['processed'] += 1
         geocode = id_to_geocode.get(id_)
 
         if not geocode and 'lat' in parent_rec:
             geocode = parent_rec
-            num_with_parent_geocodes += 1
+            stats['with_parent_geocodes'] += 1
 
         if geocode:
-            num_with_geocodes += 1
+            stats['with_geocodes'] += 1
             if patched:
                 geocode['lat'], geocode['lng'] = patched
 
         year_range = parse_year(record.get('date', parent_rec.get('date', '')))
         year = None
         if year_range:
-            num_with_dates += 1
+            stats['with_dates'] += 1
             year = year_range[0] or year_range[1]  # TODO(danvk): represent the range itself.
 
         image_url = record.get('imageLink')
         assert image_url
         dims = path_to_size.get(os.path.basename(image_url), path_to_size.get(id_ + '.jpg'))
 
-        # If dims is none it means that ImageMagick was not able to parse the image so it doesn't
-        # appear in our image dimension list. This could be because the image was corrupt, or did
-        # not exist on the original website. Regardless, it can't be displayed.
+        # If dims is none it means that image_sizes.py was not able to read the image, so it
+        # doesn't have dimensions. This could be because the image was corrupt or truncated, or
+        # did not exist on the original website. Regardless, it can't be displayed.
         if dims is None:
-            num_invalid += 1
+            stats['invalid'] += 1
             continue
 
-        if args.drop_unlocated and not geocode:
+        if config['drop_unlocated'] and not geocode:
             continue
 
         properties = {
@@ -238,9 +243,10 @@ if __name__ == '__main__':
                 'height': dims[1],
             },
         }
-        deep_update(properties, get_source_properties(args.source, record))
+        deep_update(properties, get_source_properties(config['source'], record))
 
-        features.append({
+        stats['features'] += 1
+        yield {
             'id': id_,
             'type': 'Feature',
             'geometry': {
@@ -248,21 +254,156 @@ if __name__ == '__main__':
                 'coordinates': [geocode['lng'], geocode['lat']],
             } if geocode else None,
             'properties': properties
-        })
+        }
+
 
-    print('   Total records: %s' % num_total)
+def _generate_source(config, patch_csv, results):
+    """Worker process: send batches of serialized features, then the stats, to results."""
+    try:
+        stats = collections.Counter()
+        batch = []
+        for feature in generate_features(config, patch_csv, stats):
+            batch.append(json.dumps(feature))
+            if len(batch) == FEATURE_BATCH_SIZE:
+                results.put(('features', batch))
+                batch = []
+        results.put(('features', batch))
+        results.put(('stats', stats))
+    except Exception:
+        results.put(('error', traceback.format_exc()))
+
+
+def _source_results(config, process, results):
+    """Yield the messages from a _generate_source worker, up to and including its stats."""
+    while True:
+        try:
+            kind, value = results.get(timeout=1)
+        except queue.Empty:
+            if process.is_alive():
+                continue
+            try:
+                # It may have sent its last message just before exiting.
+                kind, value = results.get(timeout=1)
+            except queue.Empty:
+                raise RuntimeError(f'Worker for {config["source"]} exited with code '
+                                   f'{process.exitcode}')
+        if kind == 'error':
+            raise RuntimeError(f'Worker for {config["source"]} failed:\n{value}')
+        yield kind, value
+        if kind == 'stats':
+            return
+
+
+def generate_geojson(configs, patch_csv, output):
+    """Write the features for each source to one GeoJSON file, in the order of configs.
+
+    With several sources, each runs in its own worker process and sends its features back
+    already serialized. Features from later sources wait in their worker's queue until the
+    earlier sources have been written.
 
-    print('  .excluded by csv: %s' % num_excluded_csv)
-    print('  ...invalid image: %s' % num_invalid)
-    print('  .....missing IDs: %s' % num_missing_ids)
-    print('  .......or images: %s' % num_missing_images)
+    Returns:
+        A stats Counter for each config.
+    """
+    with FeatureWriter(output) as out:
+        if len(configs) == 1:
+            stats = collections.Counter()
+            for feature in generate_features(configs[0], patch_csv, stats):
+                out.write(feature)
+            return [stats]
+
+        workers = []
+        for config in configs:
+            results = multiprocessing.Queue()
+            process = multiprocessing.Process(
+                target=_generate_source, args=(config, patch_csv, results), daemon=True)
+            process.start()
+            workers.append((config, process, results))
+
+        all_stats = []
+        for config, process, results in workers:
+            for kind, value in _source_results(config, process, results):
+                if kind == 'features':
+                    for feature_json in value:
+                        out.write_json(feature_json)
+                else:
+                    all_stats.append(value)
+            process.join()
+    return all_stats
+
+
+def print_stats(stats):
+    print('   Total records: %s' % stats['total'])
+
+    print('  .excluded by csv: %s' % stats['excluded_csv'])
+    print('  ...invalid image: %s' % stats['invalid'])
+    print('  .....missing IDs: %s' % stats['missing_ids'])
+    print('  .......or images: %s' % stats['missing_images'])
     print('')
-    print('   num processed: %s' % num_processed)
-    print(' ...and geocodes: %s' % num_with_geocodes)
-    print(' ...from parents: %s' % num_with_parent_geocodes)
-    print('   ...with dates: %s' % num_with_dates)
-
-    json.dump({
-        'type': 'FeatureCollection',
-        'features': features
-    }, open(args.output, 'w'))
+    print('   num processed: %s' % stats['processed'])
+    print(' ...and geocodes: %s' % stats['with_geocodes'])
+    print(' ...from parents: %s' % stats['with_parent_geocodes'])
+    print('   ...with dates: %s' % stats['with_dates'])
+    print('  ...as features: %s' % stats['features'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Collect data on all the images into a GeoTempoJSON file.')
+    parser.add_argument('--input', type=str,
+                        help='Path to ndjson file containing all image records.')
+    parser.add_argument('--parent_data', type=str,
+                        help='mapping uniqueID to metadata scraped from parent series/fonds/etc',
+                        default='')
+    parser.add_argument('--geocode_results', type=str,
+                        help='json results from geocoding files',
+                        default='data/geocode_results.json')
+    parser.add_argument('--path_to_size', type=str,
+                        help='txt file containing size in pixels of each images, as written by '
+                             'image_sizes.py.',
+                        default='data/image-sizes.txt')
+    parser.add_argument('--output', type=str,
+                        help='geojson encoded version of geocodes and images metadata. If this '
+                             'ends in .geojsonl, one feature is written per line (GeoJSONSeq).',
+                        default='data/images.geojson')
+    parser.add_argument('--patch_csv', type=str,
+                        help='path to a csv to override lat/lngs. Can be local or remote. '
+                             'rows with missing lat/lngs will be skipped in the output.',
+                        default='data/Old Toronto Responses - Override Sheet.csv')
+    parser.add_argument('--drop_unlocated', action='store_true',
+                        help='Omit records without a location, rather than giving them '
+                             'a null geometry. This reduces file size on disk.')
+    parser.add_argument('--source', type=str, default='toronto-archives',
+                        help='Set this to either "toronto-archives" or "tpl". This affects how '
+                             'metadata is attached to the image records.')
+    parser.add_argument('--source_spec', type=parse_source_spec, action='append',
+                        help='Generate features for several sources at once. Each is a comma-'
+                             'separated list of source, input, geocode_results, path_to_size '
+                             'and optionally parent_data and drop_unlocated, e.g. "source=tpl,'
+                             'input=images.ndjson,geocode_results=geocodes.json,path_to_size='
+                             'image-sizes.txt,drop_unlocated". This replaces --source, --input, '
+                             '--geocode_results, --path_to_size, --parent_data and '
+                             '--drop_unlocated.')
+    args = parser.parse_args()
+
+    configs = args.source_spec
+    if not configs:
+        assert args.source in SOURCES
+        configs = [{
+            'source': args.source,
+            'input': args.input,
+            'geocode_results': args.geocode_results,
+            'path_to_size': args.path_to_size,
+            'parent_data': args.parent_data,
+            'drop_unlocated': args.drop_unlocated,
+        }]
+
+    patch_csv = load_patch_csv(args.patch_csv)
+    all_stats = generate_geojson(configs, patch_csv, args.output)
+
+    for config, stats in zip(configs, all_stats):
+        if len(configs) > 1:
+            print(f'{config["source"]} ({config["input"]}):')
+        print_stats(stats)
+        print('')
+    if len(configs) > 1:
+        num_features = sum(stats['features'] for stats in all_stats)
+        print(f'Wrote {num_features} features to {args.output}')
@@ -2,29 +2,50 @@
 """Runs through images.ndjson and uses the google maps geocoding api to find location for photos.
 """
 import argparse
+import collections
+import concurrent.futures
 import csv
 import functools
+import hashlib
+import inspect
 import json
 import logging
+import os
 import re
 import sys
 
 import googlemaps
 import tqdm
 
+import extract_noun_phrases
 from extract_noun_phrases import noun_pat
 from fetcher import CacheSession
+from geocode_checkpoint import CheckpointWriter, read_checkpoint
+from geocode_manifest import GeocodeManifest
 from logging_configuration import configure_logging
+from offline_geocoder import CachedGeocoder, OfflineGeocoder
+from parser_profiler import ParserProfiler
 from settings import GMAPS_API_KEY
+from street_matcher import StreetMatcher
+import title_matchers
 from utils import generators
 from utils.id_sample import should_sample
-from utils.timeout import timeout
+from utils.rate_limiter import TokenBucket
+from utils.search_terms import canonical_search_term
+from utils.timeout import Deadline, timeout
 
 googlemaps.client.requests.Session = googlemaps.client.requests.sessions.Session = CacheSession
 
 GOOGLE = 'google'
 EXACT = 'exact'
 
+# Give up on geocoding a search term if it takes longer than this.
+RECORD_TIMEOUT_SECS = 30
+
+# What call_geocoding_api returns instead of Geocoding API results when there's no maps client
+# (--no_network). interpret_geocoding_results turns it into fake_geocode(search term).
+FAKE_RESULTS = ({},)
+
 LOG = logging.getLogger(__name__)
 
 
@@ -48,34 +69,33 @@ _NORM_REPLACEMENTS = [
 ]
 
 
+@functools.lru_cache(maxsize=None)
+def street_key(street):
+    """Normalize a street name, so that e.g. "King St. E." and "King Street East" are equal."""
+    for pat, repl in _NORM_REPLACEMENTS:
+        street = pat.sub(repl, street)
+    return street
+
+
 def are_streets_same(street1, street2):
     """Are these two streets the same, accounting for St. vs. Street, etc."""
-    def normalize(street):
-        for pat, repl in _NORM_REPLACEMENTS:
-            street = re.sub(pat, repl, street)
-        return street
-    a, b = (normalize(street) for street in (street1, street2))
-    return a == b
+    return street_key(street1) == street_key(street2)
 
 
 def unique_streets(street_list):
     """Return a sublist with the unique streets, according to are_streets_same."""
-    if len(street_list) > 10:  # avoid accidental N^2 with large inputs.
-        return []
-    if len(street_list) < 2:
-        return street_list
-    ok_list = [street_list[0]]
-    for street in street_list[1:]:
-        is_ok = True
-        for other in ok_list:
-            if are_streets_same(street, other):
-                is_ok = False
-                break
-        if is_ok:
+    seen = set()
+    ok_list = []
+    for street in street_list:
+        key = street_key(street)
+        if key not in seen:
+            seen.add(key)
             ok_list.append(street)
     return ok_list
 
 
+# The regular expressions below are the reference implementation of StreetMatcher, which is
+# what the parsers actually use. See bench_street_matcher.py.
 def exact_address_regex(street_re_str):
     decimal_suffix = '(?:(?:\.5)?)'
     exact_address_re_str = f'.*?(\d+{decimal_suffix})\s+(?:1/2\s)?({street_re_str})'
@@ -118,6 +138,9 @@ def build_place_name_regex(csv_file):
     return (re.compile(regex, flags=re.I), name_to_place)
 
 
+# These patterns backtrack exponentially on runs of capital letters. The parsers use the
+# equivalent linear-time matchers in title_matchers.py; the regexes are kept as the reference
+# implementation for tests and bench_title_matchers.py.
 CAPITALIZED_TOKEN = '(?:[A-Z][A-Za-z.\']*\s?)'
 CAPITALIZED_TOKENS = f'{CAPITALIZED_TOKEN}+'
 CARDINAL_DIRECTIONS = '(?:east|west|north|south)'
@@ -199,9 +222,9 @@ ADDRESS_TYPE = {'street_address', 'premise'}
 
 
 def parse_corner(title):
-    m = PARSE_CORNER_OF_X_AND_Y_RE.match(title)
+    m = title_matchers.match_corner_of_x_and_y(title)
     if m:
-        parse_capture = ('parse_corner', m.group(1).strip(), m.group(2).strip())
+        parse_capture = ('parse_corner', m[0].strip(), m[1].strip())
         search_term = f'{parse_capture[1]} and {parse_capture[2]} ontario toronto canada'
         return (GOOGLE, search_term, parse_capture, INTERSECTION_TYPE)
     m = SPLIT_ON_CORNER_RE.match(title)
@@ -218,14 +241,14 @@ def parse_corner(title):
                 parse_capture = ('parse_corner', first_street, second_street)
                 search_term = f'{first_street} and {second_street} ontario toronto canada'
                 return (GOOGLE, search_term, parse_capture, INTERSECTION_TYPE)
-    m = X_AT_Y_RE.match(title)  # Spadina, at Yonge, southeast corner
+    m = title_matchers.match_x_at_y_corner(title)  # Spadina, at Yonge, southeast corner
     if m:
-        parse_capture = ('parse_corner', m.group(1).strip(), m.group(2).strip())
+        parse_capture = ('parse_corner', m[0].strip(), m[1].strip())
         search_term = f'{parse_capture[1]} and {parse_capture[2]} ontario toronto canada'
         return (GOOGLE, search_term, parse_capture, INTERSECTION_TYPE)
-    m = CORNER_OF_X_AND_Y.match(title)
+    m = title_matchers.match_corner_of(title)
     if m:
-        parse_capture = ('parse_corner', m.group(1).strip(), m.group(2).strip())
+        parse_capture = ('parse_corner', m[0].strip(), m[1].strip())
         search_term = f'{parse_capture[1]} and {parse_capture[2]} ontario toronto canada'
         return (GOOGLE, search_term, parse_capture, INTERSECTION_TYPE)
     return None
@@ -235,10 +258,10 @@ def parse_direction_from(title):
     if title.startswith('Looking'):
         # otherwise we match things like "Looking at Spadina east over Bay" as (Looking, Spadina)
         title = title.strip('Looking')
-    m = DIRECTION_FROM_RE.match(title)
+    m = title_matchers.match_direction_from(title)
     if m:
-        street1 = m.group(1).strip()
-        street2 = m.group(2).strip()
+        street1 = m[0].strip()
+        street2 = m[1].strip()
         search_results = ('looking', street1, street2)
         search_term = f'{street1} and {street2} ontario toronto canada'
         LOG.debug(f'parse_direction_from_pattern|search_term:{search_term}|title:{title}')
@@ -246,19 +269,20 @@ def parse_direction_from(title):
     return None
 
 
-def parse_exact_address(regex, title):
-    m = regex.match(title.lower())
+def parse_exact_address(street_matcher, title):
+    m = street_matcher.match_exact_address(title.lower())
     if m:
-        search_term = f'{m.group(1)} {m.group(2)} ontario toronto canada'
+        number, street = m
+        search_term = f'{number} {street} ontario toronto canada'
         LOG.debug(f'parse_exact_address|search_term:{search_term}|title:{title}')
-        return (GOOGLE, search_term, ('exact_address', m.group(1), m.group(2)), ADDRESS_TYPE)
+        return (GOOGLE, search_term, ('exact_address', number, street), ADDRESS_TYPE)
     return None
 
 
 def parse_streets_joined_by_and(title):
-    m = JOINED_BY_AND_RE.match(title)
+    m = title_matchers.match_joined_by_and(title)
     if m:
-        street1, street2 = m.group(1).strip(), m.group(2).strip()
+        street1, street2 = m[0].strip(), m[1].strip()
         parse_results = ('streets_joined_by_and', street1, street2)
         search_term = f'{street1} and {street2} ontario toronto canada'
         LOG.debug(f'parse_streets_joined_by_and|search_term:{search_term}|title:{title}')
@@ -269,13 +293,13 @@ def parse_streets_joined_by_and(title):
     return None
 
 
-def parse_two_streets(standalone_street_re, title):
+def parse_two_streets(street_matcher, title):
     """Extract two street names if two are found in a title
 
     Returns:
         Either a search term for the geocoder or None.
     """
-    all_matches = standalone_street_re.findall(title)
+    all_matches = street_matcher.findall(title)
     matches = unique_streets(all_matches)
     if len(all_matches) < len(matches):
         LOG.debug(f'Removed duplicate streets: {all_matches} --> {matches}')
@@ -306,15 +330,25 @@ def get_search_term_from_title(parsers, title):
     return functools.reduce(lambda acc, curr: acc if acc else curr(title), parsers, None)
 
 
-def call_geocoding_api(maps_client, search_string, expected_types):
+def call_geocoding_api(maps_client, search_string):
+    """Fetch the raw Geocoding API results for a search term, or None if the request fails.
+
+    A search term which the API can't locate gets an empty list, not None.
+    """
     if maps_client is None:
-        return fake_geocode(search_string)
+        return FAKE_RESULTS
     try:
-        geocode_results = maps_client.geocode(search_string)
+        return maps_client.geocode(search_string)
     except Exception as e:
         LOG.error(f'call_geocoding_api|search_term:{search_string}|error:{e}')
         LOG.exception(e)
         return None
+
+
+def interpret_geocoding_results(geocode_results, search_string, expected_types):
+    """Extract the top Geocoding API result, if it has one of the expected types."""
+    if geocode_results is FAKE_RESULTS:
+        return fake_geocode(search_string)  # whatever the expected types are.
     if geocode_results:
         if len(geocode_results) > 1:
             LOG.debug(f'Multiple geocode results for f{search_string}')
@@ -356,13 +390,20 @@ def write_result_to_file(filename, result):
         f.write(json.dumps(result))
 
 
-def geocode_title(parsers, maps_client, title, *, strict):
-    outcome = get_search_term_from_title(parsers, title)
+def resolve_outcome(title, outcome, responses, *, strict):
+    """Turn the output of a title parser into a geocode, or None if it can't be located.
+
+    responses maps canonical search terms to (search term, raw Geocoding API results) tuples,
+    as returned by resolve_search_terms.
+    """
     if not outcome:
         return None
     technique, search_term, additional, expected_type = outcome
     if technique == GOOGLE:
-        api_result = call_geocoding_api(maps_client, search_term, expected_type)
+        # The lookup may have been made with another spelling of the search term, but each row
+        # records its own.
+        _, geocode_results = responses.get(canonical_search_term(search_term), (None, None))
+        api_result = interpret_geocoding_results(geocode_results, search_term, expected_type)
         if api_result is not None:
             if not strict or api_result['accuracy'] == 'ROOFTOP':
                 return dict(api_result, **{
@@ -382,38 +423,31 @@ def geocode_title(parsers, maps_client, title, *, strict):
     return None
 
 
-def row_to_result(parsers, maps_client, row, *, strict):
-    title = get_title(row)
-    if title is None:
-        return None
-    geocode_result = geocode_title(parsers, maps_client, title, strict=strict)
-    if geocode_result:
-        return row['uniqueID'], geocode_result
-    else:
-        return None
-
+def build_parsers(street_names_file, pois_file, profiler=None):
+    """Construct the chain of title parsers, in the order in which they're tried.
 
-def main(input_file, street_names_file, pois_file, output_file, sampling_rate, ids,
-         maps_client, strict):
+    If a ParserProfiler is given, each parser is wrapped so that its calls are recorded.
+    """
     street_names = open(street_names_file).read().split('\n')
-    toronto_street_re_str = build_is_a_toronto_street_regex_str(street_names)
-    LOG.debug(f'Toronto street regex: {toronto_street_re_str}')
-    exact_address_re = exact_address_regex(toronto_street_re_str)
-    standalone_street_re = standalone_street_regex(toronto_street_re_str)
+    street_matcher = StreetMatcher(street_names)
     place_name_re, place_map = build_place_name_regex(pois_file)
 
-    parsers = [
-        lambda x: parse_exact_address(exact_address_re, x),
-        lambda x: parse_corner(x),
-        lambda x: parse_direction_from(x),
-        lambda x: parse_two_streets(standalone_street_re, x),
-        lambda x: parse_streets_joined_by_and(x),
-        lambda x: parse_place_name(place_name_re, place_map, x)
+    named_parsers = [
+        ('exact_address', lambda x: parse_exact_address(street_matcher, x)),
+        ('corner', lambda x: parse_corner(x)),
+        ('direction_from', lambda x: parse_direction_from(x)),
+        ('two_streets', lambda x: parse_two_streets(street_matcher, x)),
+        ('streets_joined_by_and', lambda x: parse_streets_joined_by_and(x)),
+        ('place_name', lambda x: parse_place_name(place_name_re, place_map, x))
     ]
+    if profiler:
+        return [profiler.wrap(name, parser) for name, parser in named_parsers]
+    return [parser for _, parser in named_parsers]
 
-    results = {}
-    # note: we convert to a list to get a nicer progress bar.
-    for row in tqdm.tqdm(list(generators.read_ndjson_file(input_file))):
+
+def select_rows(input_file, sampling_rate, ids):
+    """Yield the rows of input_file which pass the sampling and ID filters."""
+    for row in generators.read_ndjson_file(input_file):
         id_ = row['uniqueID']
         if ids is not None and id_ not in ids:
             continue
@@ -422,17 +456,227 @@ def main(input_file, street_names_file, pois_file, output_file, sampling_rate, i
             LOG.debug(f'Skipping {id_} due to sampling rate')
             continue
 
+        yield row
+
+
+def plan_geocodes(parsers, rows, manifest=None):
+    """Plan phase: run the title parsers over every row.
+
+    If a manifest is given, parser outcomes for unchanged titles are taken from it.
+
+    Returns:
+        A list of (uniqueID, title, outcome) tuples, in input order. outcome is the output of
+        get_search_term_from_title. Rows without a title are omitted.
+    """
+    plan = []
+    num_reused = 0
+    # note: we convert to a list to get a nicer progress bar.
+    for row in tqdm.tqdm(list(rows)):
+        id_ = row['uniqueID']
+        title = get_title(row)
+        if title is None:
+            continue
+        if manifest:
+            found, outcome = manifest.get_outcome(id_, title)
+            if found:
+                num_reused += 1
+                plan.append((id_, title, outcome))
+                continue
+        outcome = get_search_term_from_title(parsers, title)
+        plan.append((id_, title, outcome))
+    if manifest:
+        LOG.info(f'Reused {num_reused:,} / {len(plan):,} parses from the manifest.')
+    return plan
+
+
+def plan_search_terms(plan):
+    """Group the Google search terms in a plan by their canonical form.
+
+    Returns:
+        A dict mapping each canonical search term to the search term which will be sent to the
+        geocoder on behalf of all the rows which share it: the first one in the plan.
+    """
+    search_terms = {}
+    num_rows = 0
+    for _, _, outcome in plan:
+        if outcome and outcome[0] == GOOGLE:
+            num_rows += 1
+            search_terms.setdefault(canonical_search_term(outcome[1]), outcome[1])
+
+    num_terms = len(search_terms)
+    LOG.info(f'{num_rows:,} rows need geocoding with {num_terms:,} unique search terms '
+             f'({num_terms / max(num_rows, 1):.1%}); saved {num_rows - num_terms:,} lookups.')
+    return search_terms
+
+
+def _fetch_before_deadline(maps_client, search_term, deadline):
+    if deadline.expired():
+        return None  # the main thread has already given up on this search term.
+    return call_geocoding_api(maps_client, search_term)
+
+
+def resolve_search_terms(maps_client, search_terms, *, workers=1, on_response=None):
+    """Resolve phase: call the geocoder (or its cache) once per unique search term.
+
+    If workers > 1, the calls are made from a pool of threads. Search terms whose lookup failed
+    or timed out are omitted from the results, so that their rows are left for a later run to
+    retry. If set, on_response(key, search_term, api_results) is called on the main thread as
+    each successful lookup finishes.
+
+    Returns:
+        A dict mapping canonical search terms to (search term, raw API results) tuples.
+    """
+    responses = {}
+
+    def add_response(key, search_term, api_results):
+        if api_results is None:
+            return  # e.g. a 5xx, OVER_QUERY_LIMIT or a --cache_only miss.
+        responses[key] = (search_term, api_results)
+        if on_response:
+            on_response(key, search_term, api_results)
+
+    if workers <= 1:
+        for key, search_term in tqdm.tqdm(search_terms.items()):
+            try:
+                with timeout(seconds=RECORD_TIMEOUT_SECS):
+                    api_results = call_geocoding_api(maps_client, search_term)
+            except TimeoutError:
+                LOG.warn(f'Timed out geocoding {search_term}')
+                continue
+            add_response(key, search_term, api_results)
+        return responses
+
+    pending = collections.deque()
+
+    def collect(key, search_term, deadline, future):
         try:
-            with timeout(seconds=30):
-                geocode_result = row_to_result(parsers, maps_client, row, strict=strict)
-                if geocode_result is not None:
-                    uid, result = geocode_result
-                    results[uid] = result
-                LOG.debug(f'{id_}: {geocode_result}')
-        except TimeoutError:
-            LOG.warn(f'Timed out geocoding {id_}: {get_title(row)}')
-            pass
-    write_result_to_file(output_file, results)
+            api_results = future.result(timeout=deadline.remaining())
+        except (TimeoutError, concurrent.futures.TimeoutError):
+            future.cancel()
+            LOG.warn(f'Timed out geocoding {search_term}')
+            return
+        add_response(key, search_term, api_results)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        for key, search_term in tqdm.tqdm(search_terms.items()):
+            deadline = Deadline(RECORD_TIMEOUT_SECS)
+            future = executor.submit(_fetch_before_deadline, maps_client, search_term, deadline)
+            pending.append((key, search_term, deadline, future))
+            # Bound the number of in-flight lookups so that deadlines aren't spent queueing.
+            while len(pending) > 2 * workers:
+                collect(*pending.popleft())
+
+        while pending:
+            collect(*pending.popleft())
+    return responses
+
+
+def parsing_source():
+    """The source of the title parsers in this file.
+
+    That's everything from get_title to get_search_term_from_title, including the regexes in
+    between, plus build_parsers. Changes to the rest of the file (logging, flags, the resolve
+    phase) don't affect how titles are parsed.
+    """
+    lines = open(__file__).readlines()
+    start = get_title.__code__.co_firstlineno - 1
+    last_lines, last_start = inspect.getsourcelines(get_search_term_from_title)
+    return (''.join(lines[start:last_start - 1 + len(last_lines)]) +
+            inspect.getsource(build_parsers))
+
+
+def parser_version(street_names_file, pois_file):
+    """A hash of all the code and data which affect how titles are parsed."""
+    sha1 = hashlib.sha1(parsing_source().encode('utf8'))
+    for path in (inspect.getfile(StreetMatcher), title_matchers.__file__,
+                 extract_noun_phrases.__file__, street_names_file, pois_file):
+        sha1.update(open(path, 'rb').read())
+    return sha1.hexdigest()
+
+
+def main(input_file, street_names_file, pois_file, output_file, sampling_rate, ids,
+         maps_client, strict, workers=1, manifest_file=None, full=False,
+         checkpoint_file=None, resume=False, fsync_every=1000, profile_file=None,
+         num_slowest=10):
+    profiler = ParserProfiler(num_slowest) if profile_file else None
+    parsers = build_parsers(street_names_file, pois_file, profiler)
+    manifest = None
+    if manifest_file:
+        manifest = GeocodeManifest.load(
+            manifest_file, parser_version(street_names_file, pois_file), full=full)
+
+    rows = list(select_rows(input_file, sampling_rate, ids))
+    done = {}
+    if checkpoint_file and resume:
+        done = read_checkpoint(checkpoint_file)
+        LOG.info(f'Resuming: {len(done):,} rows are already in {checkpoint_file}')
+    # When profiling, parse every title rather than using the manifest's outcomes.
+    plan = plan_geocodes(parsers, (row for row in rows if row['uniqueID'] not in done),
+                         None if profiler else manifest)
+    if profiler:
+        profiler.write_report(profile_file)
+        LOG.info(f'Wrote parser profile to {profile_file}')
+
+    results = {}
+    writer = None
+    if checkpoint_file:
+        writer = CheckpointWriter(checkpoint_file, resume=resume, fsync_every=fsync_every)
+
+    def emit(id_, title, outcome, result):
+        results[id_] = result
+        if manifest:
+            manifest.update(id_, title, outcome, result, strict=strict)
+        if writer:
+            writer.write(id_, result)
+        LOG.debug(f'{id_}: {result}')
+
+    try:
+        # Only geocode the rows whose search terms aren't already in the manifest. Other
+        # outcomes don't need the geocoder, so they're cheap to resolve again.
+        num_google = 0
+        num_reused = 0
+        unresolved = collections.defaultdict(list)
+        for id_, title, outcome in plan:
+            if not outcome or outcome[0] != GOOGLE:
+                emit(id_, title, outcome, resolve_outcome(title, outcome, {}, strict=strict))
+                continue
+            num_google += 1
+            if manifest:
+                found, result = manifest.get_result(id_, outcome, strict=strict)
+                if found:
+                    num_reused += 1
+                    # The title may have changed without changing the search term.
+                    emit(id_, title, outcome, result and dict(result, original_title=title))
+                    continue
+            unresolved[canonical_search_term(outcome[1])].append((id_, title, outcome))
+        if manifest:
+            LOG.info(f'Reused {num_reused:,} / {num_google:,} geocodes from the manifest.')
+
+        def on_response(key, search_term, api_results):
+            for id_, title, outcome in unresolved.pop(key):
+                result = resolve_outcome(
+                    title, outcome, {key: (search_term, api_results)}, strict=strict)
+                emit(id_, title, outcome, result)
+
+        search_terms = plan_search_terms(
+            [entry for entries in unresolved.values() for entry in entries])
+        resolve_search_terms(
+            maps_client, search_terms, workers=workers, on_response=on_response)
+    finally:
+        # Keep whatever was finished, even if the run crashed or was interrupted.
+        if writer:
+            writer.close()
+        if manifest:
+            manifest.save()
+
+    # Rows whose geocoding failed or timed out are in neither results nor the checkpoint.
+    output = {}
+    for row in rows:
+        id_ = row['uniqueID']
+        result = results[id_] if id_ in results else done.get(id_)
+        if result is not None:
+            output[id_] = result
+    write_result_to_file(output_file, output)
 
 
 if __name__ == '__main__':
@@ -461,13 +705,62 @@ if __name__ == '__main__':
                         help='If set, stub out the Google Maps API and avoid the network. '
                         'Useful for isolating changes to parsing.',
                         action='store_true')
+    parser.add_argument('--offline',
+                        help='If set, answer geocoding queries from the Geocoding API responses '
+                             'in cache/ instead of calling the API. See offline_geocoder.py.',
+                        action='store_true')
+    parser.add_argument('--cache_only',
+                        help='If set, only use Geocoding API responses which are already in '
+                             "cache/. Search terms which aren't are left unresolved and written "
+                             'to --cache_misses.',
+                        action='store_true')
+    parser.add_argument('--cache_misses', type=str,
+                        help="Where --cache_only writes the search terms which weren't cached, "
+                             'one per line. Defaults to the output file plus .misses.txt.',
+                        default='')
     parser.add_argument('--sample', type=float,
                         help='Process a deterministic sample of images. 1=100%%, 0.1=10%%, etc.',
                         default=1.0)
     parser.add_argument('--ids', type=str,
                         help='Comma-separated list of uniqueIDs to process. Useful for debugging.',
                         default='')
+    parser.add_argument('--workers', type=int,
+                        help='Number of threads to use for geocoding API calls. Titles are '
+                             'still parsed serially and the output is the same as with 1.',
+                        default=1)
+    parser.add_argument('--qps', type=float,
+                        help='Maximum rate of uncached geocoding API calls across all workers.',
+                        default=10.0)
+    parser.add_argument('--manifest', type=str,
+                        help='Where to keep track of past parses and geocodes, so that reruns '
+                             'only redo the rows whose titles or search terms changed. '
+                             'Defaults to a file under cache/geocode_manifests.',
+                        default='')
+    parser.add_argument('--full',
+                        help='Ignore the manifest and parse and geocode every row again.',
+                        action='store_true')
+    parser.add_argument('--checkpoint', type=str,
+                        help='If set, append each result to this NDJSON file as soon as it is '
+                             'available. The output file is still written at the end.',
+                        default='')
+    parser.add_argument('--resume',
+                        help='Skip the rows which are already in the --checkpoint file, e.g. '
+                             'after a crash or Ctrl-C.',
+                        action='store_true')
+    parser.add_argument('--fsync_every', type=int,
+                        help='Flush the --checkpoint file to disk after this many results.',
+                        default=1000)
+    parser.add_argument('--profile_parsers', type=str,
+                        help='If set, record call counts, match counts and timings for each '
+                             'title parser and write them to this file (TSV if it ends with '
+                             '.tsv, otherwise JSON).',
+                        default='')
+    parser.add_argument('--profile_slowest', type=int,
+                        help='Number of slowest titles to keep for each parser when profiling.',
+                        default=10)
     args = parser.parse_args()
+    if args.resume and not args.checkpoint:
+        parser.error('--resume requires --checkpoint')
 
     configure_logging(args.logfile)
 
@@ -476,7 +769,32 @@ if __name__ == '__main__':
     if args.no_network:
         sys.stderr.write('USING FAKE MAPS CLIENT!!\n')
         gmaps_client = None
+    elif args.offline:
+        gmaps_client = OfflineGeocoder.from_cache()
+    elif args.cache_only:
+        gmaps_client = CachedGeocoder()
+    elif args.workers > 1:
+        # googlemaps' own rate limiting isn't shared between threads. Instead, throttle cache
+        # misses with one token bucket shared by all the workers.
+        maps_client = googlemaps.Client(key=GMAPS_API_KEY, queries_per_second=10 ** 6)
+        maps_client.session.rate_limiter = TokenBucket(args.qps)
+        gmaps_client = CachedGeocoder(maps_client)
     else:
-        gmaps_client = googlemaps.Client(key=GMAPS_API_KEY)
+        gmaps_client = CachedGeocoder(googlemaps.Client(key=GMAPS_API_KEY))
+    # Fake geocodes mustn't end up in a manifest which later runs would trust, and nor should
+    # interpolated offline ones or cache misses unless that manifest was asked for.
+    manifest_file = args.manifest or os.path.join(
+        'cache', 'geocode_manifests', os.path.basename(args.output) + '.manifest')
+    if args.no_network or ((args.offline or args.cache_only) and not args.manifest):
+        manifest_file = None
     main(args.input, args.street_names, args.pois, args.output, args.sample, ids,
-         gmaps_client, args.strict)
+         gmaps_client, args.strict, workers=args.workers, manifest_file=manifest_file,
+         full=args.full, checkpoint_file=args.checkpoint or None, resume=args.resume,
+         fsync_every=args.fsync_every, profile_file=args.profile_parsers or None,
+         num_slowest=args.profile_slowest)
+    if gmaps_client:
+        LOG.info(f'Geocoder stats: {gmaps_client.stats()}')
+    if args.cache_only:
+        misses_file = args.cache_misses or args.output + '.misses.txt'
+        gmaps_client.write_misses(misses_file)
+        LOG.info(f'Wrote {len(gmaps_client.misses):,} cache misses to {misses_file}')
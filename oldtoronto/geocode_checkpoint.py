@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""Stream geocoding results to an NDJSON checkpoint so that a crashed run can be resumed.
+
+Each line of a checkpoint looks like:
+
+    {"id": "100001", "result": {"lat": 43.65, "lng": -79.37, ...}}
+
+result is null for rows which the geocoder found no match for, so that they aren't retried on
+resume. Rows whose lookup failed or timed out aren't written at all, so a resumed run retries
+them.
+
+To turn a checkpoint into the uniqueID --> geocode dict which downstream tools expect, run:
+
+    oldtoronto/geocode_checkpoint.py checkpoint.ndjson geocode_results.json
+
+geocode.py does this automatically at the end of a run.
+"""
+
+import argparse
+import json
+import logging
+import os
+
+LOG = logging.getLogger(__name__)
+
+
+class CheckpointWriter(object):
+    """Appends results to a checkpoint, fsyncing every fsync_every records."""
+    def __init__(self, path, *, resume=False, fsync_every=1000):
+        if resume and os.path.exists(path):
+            _truncate_partial_line(path)
+        self._f = open(path, 'a' if resume else 'w')
+        self._fsync_every = fsync_every
+        self._num_unsynced = 0
+
+    def write(self, id_, result):
+        self._f.write(json.dumps({'id': id_, 'result': result}))
+        self._f.write('\n')
+        self._num_unsynced += 1
+        if self._num_unsynced >= self._fsync_every:
+            self.sync()
+
+    def sync(self):
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self._num_unsynced = 0
+
+    def close(self):
+        self.sync()
+        self._f.close()
+
+
+def _truncate_partial_line(path):
+    """Remove a final line which was cut short, e.g. by a crash in the middle of a write."""
+    with open(path, 'rb+') as f:
+        contents = f.read()
+        if contents and not contents.endswith(b'\n'):
+            LOG.warn(f'Removing partial line at the end of {path}')
+            f.truncate(contents.rfind(b'\n') + 1)
+
+
+def read_checkpoint(path):
+    """Load a checkpoint as a uniqueID --> result dict. Later lines win."""
+    results = {}
+    if not os.path.exists(path):
+        return results
+    for line in open(path):
+        if not line.endswith('\n'):
+            break  # a partial line from a crash.
+        record = json.loads(line)
+        results[record['id']] = record['result']
+    return results
+
+
+def compact(results):
+    """Drop the rows which couldn't be geocoded, leaving the geocode_results.json format."""
+    return {
+        id_: result
+        for id_, result in results.items()
+        if result is not None
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Compact a geocoding checkpoint into a JSON dict.')
+    parser.add_argument('checkpoint', type=str, help='NDJSON checkpoint written by geocode.py')
+    parser.add_argument('output', type=str, help='Path to write geocode_results.json')
+    args = parser.parse_args()
+
+    with open(args.output, 'w') as f:
+        json.dump(compact(read_checkpoint(args.checkpoint)), f)
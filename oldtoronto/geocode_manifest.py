@@ -0,0 +1,90 @@
+"""A record of past geocoding work, so that reruns of geocode.py only redo what changed.
+
+For each uniqueID, the manifest stores:
+- a hash of the title and the version of the parsers which parsed it,
+- the parser outcome (the output of get_search_term_from_title),
+- whether the run was strict and the resulting geocode (or None).
+
+A title only needs to be parsed again if it or the parsers changed. A row only needs to be
+geocoded again if its outcome (and hence its search term) changed.
+"""
+
+import hashlib
+import json
+import logging
+import os
+
+LOG = logging.getLogger(__name__)
+
+
+def hash_title(title):
+    return hashlib.sha1(title.encode('utf8')).hexdigest()
+
+
+def outcome_to_json(outcome):
+    """Convert a parser outcome into a JSON-friendly list."""
+    if not outcome:
+        return None
+    technique, search_term, additional, expected_type = outcome
+    if isinstance(expected_type, (set, frozenset)):
+        expected_type = sorted(expected_type)
+    return [technique, search_term, list(additional), expected_type]
+
+
+def outcome_from_json(outcome_json):
+    """Inverse of outcome_to_json."""
+    if not outcome_json:
+        return None
+    technique, search_term, additional, expected_type = outcome_json
+    if isinstance(expected_type, list):
+        expected_type = set(expected_type)
+    return (technique, search_term, tuple(additional), expected_type)
+
+
+class GeocodeManifest(object):
+    def __init__(self, path, parser_version, records=None):
+        self._path = path
+        self._parser_version = parser_version
+        self._records = records if records is not None else {}
+
+    @classmethod
+    def load(cls, path, parser_version, *, full=False):
+        """Load the manifest at path. If full is set or it doesn't exist, start from scratch."""
+        records = {}
+        if not full and os.path.exists(path):
+            records = json.load(open(path))['records']
+            LOG.info(f'Loaded {len(records):,} records from {path}')
+        return cls(path, parser_version, records)
+
+    def get_outcome(self, id_, title):
+        """Return (True, outcome) if a matching parse is on record, else (False, None)."""
+        record = self._records.get(id_)
+        if (record and record['title_hash'] == hash_title(title) and
+                record['parser_version'] == self._parser_version):
+            return True, outcome_from_json(record['outcome'])
+        return False, None
+
+    def get_result(self, id_, outcome, *, strict):
+        """Return (True, result) if a geocode for this outcome is on record, else (False, None)."""
+        record = self._records.get(id_)
+        if (record and 'result' in record and record['strict'] == strict and
+                record['outcome'] == outcome_to_json(outcome)):
+            return True, record['result']
+        return False, None
+
+    def update(self, id_, title, outcome, result, *, strict):
+        # Round-trip through JSON so that records compare equal to ones loaded from disk.
+        self._records[id_] = json.loads(json.dumps({
+            'title_hash': hash_title(title),
+            'parser_version': self._parser_version,
+            'outcome': outcome_to_json(outcome),
+            'strict': strict,
+            'result': result
+        }))
+
+    def save(self):
+        os.makedirs(os.path.dirname(self._path) or '.', exist_ok=True)
+        tmp_path = self._path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'records': self._records}, f)
+        os.replace(tmp_path, self._path)
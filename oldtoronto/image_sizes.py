@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""Measure the dimensions of all the downloaded images, for generate_geojson.py.
+
+Usage:
+
+    oldtoronto/image_sizes.py --images_dir images --output data/toronto-archives/image-sizes.txt
+
+This reads just the JPEG SOF or PNG IHDR header of each image, rather than decoding it, and
+spreads the files across a pool of processes. It also checks that each file ends the way a
+complete JPEG or PNG should, so that truncated downloads are reported instead of silently
+turning into missing images.
+
+The output is an index with one line per image:
+
+    name  width  height  bytes  mtime_ns  error
+
+Rerunning with the same --output only rescans the files which are new, or whose size or mtime
+has changed. Files which couldn't be read have an error and no dimensions.
+"""
+
+import argparse
+import concurrent.futures
+import logging
+import os
+import struct
+
+LOG = logging.getLogger(__name__)
+
+# The first line of an index file.
+INDEX_HEADER = '#oldto-image-sizes v1'
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png'}
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_TRAILER = b'\x00\x00\x00\x00IEND\xaeB`\x82'
+
+# Start Of Frame markers, which hold the dimensions. C4 (DHT), C8 (JPG) and CC (DAC) aren't.
+JPEG_SOF_MARKERS = {0xc0, 0xc1, 0xc2, 0xc3, 0xc5, 0xc6, 0xc7,
+                    0xc9, 0xca, 0xcb, 0xcd, 0xce, 0xcf}
+# Markers which aren't followed by a length and a segment.
+JPEG_STANDALONE_MARKERS = {0x01} | set(range(0xd0, 0xd8))
+
+
+class ImageError(ValueError):
+    """An image which is corrupt, truncated or in an unknown format."""
+    pass
+
+
+def read_exactly(f, n):
+    data = f.read(n)
+    if len(data) < n:
+        raise ImageError('truncated header')
+    return data
+
+
+def jpeg_size(f):
+    """Read (width, height) from the first SOF segment of a JPEG, positioned after the SOI."""
+    while True:
+        if read_exactly(f, 1) != b'\xff':
+            raise ImageError('bad JPEG marker')
+        marker = read_exactly(f, 1)[0]
+        while marker == 0xff:  # fill bytes
+            marker = read_exactly(f, 1)[0]
+        if marker in JPEG_STANDALONE_MARKERS:
+            continue
+        if marker == 0xd9:
+            raise ImageError('JPEG has no SOF segment')
+        length = struct.unpack('>H', read_exactly(f, 2))[0]
+        if length < 2:
+            raise ImageError('bad JPEG segment length')
+        if marker in JPEG_SOF_MARKERS:
+            _precision, height, width = struct.unpack('>BHH', read_exactly(f, 5))
+            return width, height
+        f.seek(length - 2, os.SEEK_CUR)
+
+
+def png_size(f):
+    """Read (width, height) from the IHDR chunk of a PNG, positioned after the signature."""
+    length, chunk_type = struct.unpack('>I4s', read_exactly(f, 8))
+    if chunk_type != b'IHDR' or length < 8:
+        raise ImageError('PNG does not start with IHDR')
+    return struct.unpack('>II', read_exactly(f, 8))
+
+
+def image_size(path):
+    """Get the (width, height) of a JPEG or PNG file from its header.
+
+    Raises:
+        ImageError if the file isn't a complete JPEG or PNG.
+    """
+    with open(path, 'rb') as f:
+        start = f.read(8)
+        if start.startswith(b'\xff\xd8'):
+            f.seek(2)
+            size = jpeg_size(f)
+            # The EOI marker may be followed by a little padding. It can't occur by chance in
+            # the compressed data, where 0xFF bytes are always followed by 0x00.
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - 1024))
+            is_complete = b'\xff\xd9' in f.read()
+        elif start == PNG_SIGNATURE:
+            size = png_size(f)
+            f.seek(-len(PNG_TRAILER), os.SEEK_END)
+            is_complete = f.read() == PNG_TRAILER
+        else:
+            raise ImageError('not a JPEG or PNG')
+    if not is_complete:
+        raise ImageError('truncated')
+    if not size[0] or not size[1]:
+        raise ImageError('zero width or height')
+    return size
+
+
+def scan_image(path):
+    """Returns (width, height, error) for an image. Only one of size and error is set."""
+    try:
+        width, height = image_size(path)
+        return width, height, None
+    except (ImageError, OSError) as e:
+        return None, None, str(e)
+
+
+def load_index(index_file):
+    """Load an index written by write_index.
+
+    Returns:
+        A dict mapping file name --> (width, height, bytes, mtime_ns, error).
+    """
+    index = {}
+    with open(index_file) as f:
+        if f.readline().rstrip('\n') != INDEX_HEADER:
+            raise ValueError(f'{index_file} is not an image size index')
+        for line in f:
+            name, width, height, num_bytes, mtime_ns, error = line.rstrip('\n').split('\t')
+            index[name] = (
+                int(width) if width else None,
+                int(height) if height else None,
+                int(num_bytes),
+                int(mtime_ns),
+                error or None
+            )
+    return index
+
+
+def write_index(index, index_file):
+    tmp_file = index_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        f.write(INDEX_HEADER + '\n')
+        for name, (width, height, num_bytes, mtime_ns, error) in sorted(index.items()):
+            f.write('\t'.join([
+                name, str(width or ''), str(height or ''), str(num_bytes), str(mtime_ns),
+                error or ''
+            ]) + '\n')
+    os.replace(tmp_file, index_file)
+
+
+def update_index(images_dir, old_index, workers=None):
+    """Bring an index up to date with the images in a directory.
+
+    Files whose size and mtime match their entry in old_index aren't read again.
+
+    Returns:
+        The new index, and the number of files which were scanned.
+    """
+    index = {}
+    to_scan = []  # (name, bytes, mtime_ns)
+    for entry in os.scandir(images_dir):
+        if os.path.splitext(entry.name)[1].lower() not in IMAGE_EXTENSIONS:
+            continue
+        stat = entry.stat()
+        old = old_index.get(entry.name)
+        if old and old[2:4] == (stat.st_size, stat.st_mtime_ns):
+            index[entry.name] = old
+        else:
+            to_scan.append((entry.name, stat.st_size, stat.st_mtime_ns))
+
+    paths = [os.path.join(images_dir, name) for name, _, _ in to_scan]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(scan_image, paths, chunksize=256)
+        for (name, num_bytes, mtime_ns), (width, height, error) in zip(to_scan, results):
+            index[name] = (width, height, num_bytes, mtime_ns, error)
+    return index, len(to_scan)
+
+
+def load_image_sizes(sizes_file):
+    """Load image sizes into a file name --> [width, height] dict.
+
+    sizes_file is either an index written by this script, in which case unreadable images are
+    left out, or the output of ImageMagick, e.g.
+
+        identify 'images/*.jpg' > image-sizes.txt
+
+    A sample line of that looks like:
+
+        images/f0124_fl0001_id0001.jpg JPEG 1050x715 1050x715+0+0 8-bit sRGB 122804B ...
+    """
+    with open(sizes_file) as f:
+        is_index = f.readline().rstrip('\n') == INDEX_HEADER
+    if is_index:
+        return {
+            name: [width, height]
+            for name, (width, height, _, _, error) in load_index(sizes_file).items()
+            if not error
+        }
+
+    path_to_dimensions = {}
+    for line in open(sizes_file):
+        parts = line.split(' ')
+        path = os.path.basename(parts[0])
+        dims = [int(x) for x in parts[2].split('x')]
+        path_to_dimensions[path] = dims
+    return path_to_dimensions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Measure the dimensions of downloaded images.')
+    parser.add_argument('--images_dir', type=str, help='Directory of images',
+                        default='images')
+    parser.add_argument('--output', type=str, help='Index file to write or update',
+                        default='data/image-sizes.txt')
+    parser.add_argument('--workers', type=int,
+                        help='Number of processes to read images with. Defaults to one per CPU.',
+                        default=None)
+    parser.add_argument('--full', action='store_true',
+                        help='Rescan every image, even if it is unchanged since the last run.')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    old_index = {}
+    if not args.full and os.path.exists(args.output):
+        try:
+            old_index = load_index(args.output)
+        except ValueError:
+            LOG.info(f'{args.output} is in the old format; rescanning everything.')
+    index, num_scanned = update_index(args.images_dir, old_index, args.workers)
+    write_index(index, args.output)
+
+    errors = sorted((name, entry[4]) for name, entry in index.items() if entry[4])
+    for name, error in errors:
+        LOG.warn(f'{name}: {error}')
+    LOG.info(f'Scanned {num_scanned:,} of {len(index):,} images; {len(errors):,} are unreadable. '
+             f'Wrote {args.output}.')
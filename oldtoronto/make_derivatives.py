@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""Make the mirror images and thumbnails which images.geojson links to.
+
+Usage:
+
+    oldtoronto/make_derivatives.py --images_dir images --output_dir derivatives
+
+This writes a JPEG copy of each downloaded image to derivatives/images/ and a thumbnail to
+derivatives/thumbnails/, the layout which get_mirror_url and get_thumbnail_url in
+generate_geojson.py expect. Pass e.g. --widths 800 1600 to also make derivatives/w800/ and
+derivatives/w1600/. Images are never scaled up.
+
+Outputs which are newer than their original are left alone, so after fetching new images only
+those are processed. Images are spread across a pool of processes. Once they're done, the
+dimensions of every derivative are written to derivatives/<name>-sizes.txt, in the format of
+image_sizes.py. To publish them:
+
+    gsutil -m rsync -r -x '.*\\.txt$' derivatives gs://sidewalk-old-toronto
+
+This needs Pillow.
+"""
+
+import argparse
+import concurrent.futures
+import logging
+import os
+import shutil
+
+import tqdm
+
+from image_sizes import IMAGE_EXTENSIONS, load_index, update_index, write_index
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+LOG = logging.getLogger(__name__)
+
+MIRROR_DIR = 'images'
+THUMBNAIL_DIR = 'thumbnails'
+THUMBNAIL_WIDTH = 400
+JPEG_QUALITY = 85
+
+
+class Derivative(object):
+    """A kind of derivative image: a subdirectory of the output, and the width to shrink to.
+
+    A width of None keeps the original size.
+    """
+    def __init__(self, name, width=None):
+        self.name = name
+        self.width = width
+
+    def __repr__(self):
+        return f'Derivative({self.name!r}, {self.width!r})'
+
+
+def derivatives_for_args(thumbnail_width, widths):
+    return ([Derivative(MIRROR_DIR), Derivative(THUMBNAIL_DIR, thumbnail_width)] +
+            [Derivative(f'w{width}', width) for width in widths or []])
+
+
+def derivative_filename(image_filename):
+    """Derivatives are all JPEGs, named after the original, as in generate_geojson.py."""
+    return os.path.splitext(image_filename)[0] + '.jpg'
+
+
+def is_up_to_date(output_path, source_mtime_ns):
+    try:
+        return os.stat(output_path).st_mtime_ns >= source_mtime_ns
+    except FileNotFoundError:
+        return False
+
+
+def plan_derivatives(images_dir, output_dir, derivatives, full=False):
+    """List the derivatives which need to be (re)made.
+
+    Returns:
+        A list of (source path, [(output path, width), ...]) tuples, one per original image
+        which has at least one missing or stale derivative.
+    """
+    jobs = []
+    for entry in sorted(os.scandir(images_dir), key=lambda entry: entry.name):
+        if os.path.splitext(entry.name)[1].lower() not in IMAGE_EXTENSIONS:
+            continue
+        mtime_ns = entry.stat().st_mtime_ns
+        filename = derivative_filename(entry.name)
+        targets = []
+        for derivative in derivatives:
+            output_path = os.path.join(output_dir, derivative.name, filename)
+            if full or not is_up_to_date(output_path, mtime_ns):
+                targets.append((output_path, derivative.width))
+        if targets:
+            jobs.append((entry.path, targets))
+    return jobs
+
+
+def scaled_size(size, width):
+    """The size to shrink an image to, to fit in width (None for no limit)."""
+    w, h = size
+    if width is None or w <= width:
+        return w, h
+    return width, max(1, round(h * width / w))
+
+
+def save_jpeg(image, output_path):
+    tmp_path = output_path + '.tmp'
+    image.save(tmp_path, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    os.replace(tmp_path, output_path)
+
+
+def make_image_derivatives(job):
+    """Make the derivatives of one image. This runs in a worker process.
+
+    Returns:
+        (source path, error message or None).
+    """
+    source_path, targets = job
+    try:
+        with Image.open(source_path) as image:
+            is_jpeg = image.format == 'JPEG'
+            widths = [width for _, width in targets]
+            if None not in widths:
+                # Let libjpeg decode at a fraction of the full size when that's all we need.
+                image.draft('RGB', scaled_size(image.size, max(widths)))
+            image.load()
+            if image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+
+            for output_path, width in targets:
+                os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                size = scaled_size(image.size, width)
+                if width is None and is_jpeg:
+                    # Mirror JPEGs as they are, rather than losing quality re-encoding them.
+                    tmp_path = output_path + '.tmp'
+                    shutil.copyfile(source_path, tmp_path)
+                    os.replace(tmp_path, output_path)
+                elif size == image.size:
+                    save_jpeg(image, output_path)
+                else:
+                    save_jpeg(image.resize(size, Image.LANCZOS), output_path)
+        return source_path, None
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        return source_path, str(e)
+
+
+def make_derivatives(jobs, workers=None):
+    """Run the jobs from plan_derivatives in a process pool.
+
+    Returns:
+        A dict mapping source path --> error message, for the images which failed.
+    """
+    if Image is None:
+        raise ImportError('make_derivatives.py needs Pillow: pip install Pillow')
+    errors = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(make_image_derivatives, jobs, chunksize=4)
+        for source_path, error in tqdm.tqdm(results, total=len(jobs)):
+            if error:
+                errors[source_path] = error
+    return errors
+
+
+def update_sizes(output_dir, derivative, workers=None):
+    """Record the dimensions of a derivative's images, rescanning only the changed ones."""
+    sizes_file = os.path.join(output_dir, f'{derivative.name}-sizes.txt')
+    old_index = load_index(sizes_file) if os.path.exists(sizes_file) else {}
+    index, _ = update_index(os.path.join(output_dir, derivative.name), old_index, workers)
+    write_index(index, sizes_file)
+    return sizes_file
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Make mirror images and thumbnails of downloaded images.')
+    parser.add_argument('--images_dir', type=str, help='Directory of original images',
+                        default='images')
+    parser.add_argument('--output_dir', type=str, help='Directory to write derivatives to',
+                        default='derivatives')
+    parser.add_argument('--thumbnail_width', type=int, help='Maximum width of thumbnails',
+                        default=THUMBNAIL_WIDTH)
+    parser.add_argument('--widths', type=int, nargs='*',
+                        help='Additional maximum widths to make derivatives for')
+    parser.add_argument('--workers', type=int,
+                        help='Number of processes to use. Defaults to one per CPU.',
+                        default=None)
+    parser.add_argument('--full', action='store_true',
+                        help='Remake every derivative, even if it is up to date.')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    derivatives = derivatives_for_args(args.thumbnail_width, args.widths)
+    jobs = plan_derivatives(args.images_dir, args.output_dir, derivatives, full=args.full)
+    LOG.info(f'{len(jobs):,} images have new or out of date derivatives.')
+    errors = make_derivatives(jobs, args.workers)
+    for source_path, error in sorted(errors.items()):
+        LOG.warn(f'{source_path}: {error}')
+
+    for derivative in derivatives:
+        sizes_file = update_sizes(args.output_dir, derivative, args.workers)
+        LOG.info(f'Wrote sizes of {derivative.name} to {sizes_file}')
+    if errors:
+        LOG.warn(f'Failed to process {len(errors):,} images.')
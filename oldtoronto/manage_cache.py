@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""Inspect and clean up a fetcher cache.
+
+Usage:
+
+    oldtoronto/manage_cache.py stats
+    oldtoronto/manage_cache.py gc [--max_bytes N] [--prune_geocodes_for images.ndjson ...]
+
+stats prints the number and size of the cached responses for each host, when they were last
+used, and the hits and misses of the last run of each program which used the cache.
+
+gc rewrites cache/urls.txt without the URLs which are no longer cached (or reclaims the space
+of removed responses, for a SQLite cache). With --max_bytes, it first evicts the least recently
+used responses until the cache fits. With --prune_geocodes_for, it first removes the Geocoding
+API responses whose search terms don't come up when geocode.py parses any of the given files.
+Pass --dry_run to see what would be removed without changing anything.
+"""
+
+import argparse
+import collections
+import datetime
+import json
+import logging
+import os
+
+import geocode
+from fetcher import RUN_STATS_FILE, Cache, least_recently_used
+from offline_geocoder import cached_geocode_urls, geocode_url_address
+from utils.search_terms import canonical_search_term
+
+LOG = logging.getLogger(__name__)
+
+
+def format_time(t):
+    return datetime.datetime.fromtimestamp(t).isoformat(timespec='seconds') if t else None
+
+
+def cache_stats(cache_dir):
+    """Summarize the responses in a cache, and the last runs which used it."""
+    cache = Cache(cache_dir)
+    hosts = collections.defaultdict(lambda: {'responses': 0, 'bytes': 0, 'accessed': []})
+    for host, _, size, accessed in cache.entries():
+        hosts[host]['responses'] += 1
+        hosts[host]['bytes'] += size
+        hosts[host]['accessed'].append(accessed)
+
+    host_stats = {}
+    for host, stats in sorted(hosts.items()):
+        accessed = sorted(stats.pop('accessed'))
+        stats['least_recently_used'] = format_time(accessed[0])
+        stats['median_last_used'] = format_time(accessed[len(accessed) // 2])
+        stats['most_recently_used'] = format_time(accessed[-1])
+        host_stats[host] = stats
+
+    try:
+        last_runs = json.load(open(os.path.join(cache_dir, RUN_STATS_FILE)))
+    except FileNotFoundError:
+        last_runs = {}
+    for run in last_runs.values():
+        lookups = run['hits'] + run['misses']
+        run['hit_ratio'] = round(run['hits'] / lookups, 4) if lookups else None
+
+    return {
+        'hosts': host_stats,
+        'total': {
+            'responses': sum(stats['responses'] for stats in host_stats.values()),
+            'bytes': sum(stats['bytes'] for stats in host_stats.values())
+        },
+        'last_runs': last_runs
+    }
+
+
+def referenced_search_terms(input_files, street_names_file, pois_file):
+    """The canonical search terms which geocode.py sends to the API for the given files."""
+    parsers = geocode.build_parsers(street_names_file, pois_file)
+    search_terms = set()
+    for input_file in input_files:
+        plan = geocode.plan_geocodes(parsers, geocode.select_rows(input_file, 1.0, None))
+        search_terms.update(geocode.plan_search_terms(plan))
+    return search_terms
+
+
+def unreferenced_geocode_urls(cache, search_terms):
+    """The cached Geocoding API URLs whose canonical search term isn't in search_terms."""
+    urls = []
+    for url in set(cached_geocode_urls(cache)):
+        address = geocode_url_address(url)
+        if (address is not None and canonical_search_term(address) not in search_terms and
+                cache.is_url_in_cache(url)):
+            urls.append(url)
+    return sorted(urls)
+
+
+def gc(cache_dir, max_bytes=None, search_terms=None, dry_run=False):
+    """Clean up a cache. See the module docstring.
+
+    If search_terms is given, cached geocodes for any other search terms are removed.
+
+    Returns:
+        A dict of what was (or, with dry_run, would be) removed.
+    """
+    cache = Cache(cache_dir)
+    report = {}
+    if search_terms is not None:
+        urls = unreferenced_geocode_urls(cache, search_terms)
+        report['pruned_geocodes'] = len(urls)
+        if not dry_run:
+            for url in urls:
+                cache.remove_url_from_cache(url)
+
+    if max_bytes is not None:
+        if dry_run:
+            evicted, _ = least_recently_used(cache.entries(), max_bytes)
+        else:
+            evicted = cache.evict(max_bytes)
+        report['evicted'] = len(evicted)
+
+    if not dry_run:
+        cache.flush()
+        num_before, num_after = cache.compact()
+        report['urls_before'] = num_before
+        report['urls_after'] = num_after
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Inspect and clean up a fetcher cache.')
+    parser.add_argument('--cache_dir', type=str, help='Cache directory', default='cache')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    subparsers.add_parser('stats', help='Summarize what is in the cache')
+    gc_parser = subparsers.add_parser('gc', help='Remove dead and unneeded entries')
+    gc_parser.add_argument('--max_bytes', type=int,
+                           help='Evict the least recently used responses down to this size',
+                           default=None)
+    gc_parser.add_argument('--prune_geocodes_for', type=str, nargs='+',
+                           help='NDJSON files of images, like those passed to geocode.py. '
+                                'Cached geocodes for search terms which none of them produce '
+                                'are removed.',
+                           default=None)
+    gc_parser.add_argument('--street_names', type=str,
+                           help='text file containing street names, as for geocode.py',
+                           default='data/streets.txt')
+    gc_parser.add_argument('--pois', type=str,
+                           help='csv containing pois extracted from osm, as for geocode.py',
+                           default='data/toronto-pois.osm.csv')
+    gc_parser.add_argument('--dry_run', action='store_true',
+                           help='Report what would be removed without changing anything')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == 'stats':
+        print(json.dumps(cache_stats(args.cache_dir), indent=2))
+    else:
+        search_terms = None
+        if args.prune_geocodes_for:
+            search_terms = referenced_search_terms(
+                args.prune_geocodes_for, args.street_names, args.pois)
+        report = gc(args.cache_dir, args.max_bytes, search_terms, args.dry_run)
+        print(json.dumps(report, indent=2))
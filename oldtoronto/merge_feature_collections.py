@@ -4,26 +4,22 @@
 Usage:
 
     merge_feature_collection.py in1.geojson in2.geojson out.geojson
+
+The inputs and output can also be GeoJSONSeq files (.geojsonl). Features are copied across one
+at a time, so the inputs are never loaded into memory in full.
 """
 
-import json
 import sys
 
+from utils.geojson import FeatureWriter, iter_features
+
 
 if __name__ == '__main__':
     assert len(sys.argv) >= 3
     inputs = sys.argv[1:-1]
     output = sys.argv[-1]
 
-    features = []
-    for input_file in inputs:
-        fc = json.load(open(input_file))
-        assert fc['type'] == 'FeatureCollection'
-
-        features += fc['features']
-
-    with open(output, 'w') as out:
-        json.dump({
-            'type': 'FeatureCollection',
-            'features': features
-        }, out)
+    with FeatureWriter(output) as out:
+        for input_file in inputs:
+            for feature in iter_features(input_file):
+                out.write(feature)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""Convert a file-per-URL fetcher cache into a single SQLite database.
+
+Usage:
+
+    oldtoronto/migrate_cache.py --cache_dir cache
+
+This copies every cache/<host>/<hash> file into cache/cache.sqlite3, along with its last access
+time and its URL from cache/urls.txt where it's known. The database is only put in place once
+it's complete, and from then on fetcher.Cache uses it instead of the files. The files are left
+alone; delete them once you're happy with the migration.
+"""
+
+import argparse
+import logging
+import os
+import sqlite3
+
+import tqdm
+
+from fetcher import SQLITE_FILE, SQLITE_SCHEMA, Cache, FileStorage
+
+LOG = logging.getLogger(__name__)
+
+
+def migrate(cache_dir, batch_size=1000):
+    """Copy a file-per-URL cache into a new SQLite database in the same directory.
+
+    Returns:
+        The number of responses copied, and how many of those had a known URL.
+    """
+    db_path = os.path.join(cache_dir, SQLITE_FILE)
+    if os.path.exists(db_path):
+        raise ValueError(f'{db_path} already exists')
+
+    cache = Cache(cache_dir, backend='files')
+    urls = {}  # key --> URL. Later entries in urls.txt win.
+    for url in cache.urls():
+        urls[cache._cache_key(url)[1]] = url
+    LOG.info(f'Read {len(urls):,} URLs from urls.txt')
+
+    tmp_path = db_path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.unlink(tmp_path)
+    db = sqlite3.connect(tmp_path)
+    db.execute(SQLITE_SCHEMA)
+
+    # Insert the responses in urls.txt order, so that the database's URLs are oldest first too.
+    # Files which aren't in urls.txt go at the end.
+    storage = FileStorage(cache_dir)
+    order = {key: i for i, key in enumerate(urls)}
+    entries = sorted(storage.entries(), key=lambda entry: order.get(entry[1], len(order)))
+
+    insert = 'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)'
+    num_copied = num_with_url = 0
+    batch = []
+    for host, key, _, accessed in tqdm.tqdm(entries):
+        url = urls.get(key)
+        batch.append((key, host, url, storage.get(host, key), accessed))
+        num_copied += 1
+        num_with_url += url is not None
+        if len(batch) >= batch_size:
+            db.executemany(insert, batch)
+            batch = []
+    db.executemany(insert, batch)
+    db.commit()
+    db.close()
+    os.replace(tmp_path, db_path)
+    return num_copied, num_with_url
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Migrate a file-per-URL cache to SQLite.')
+    parser.add_argument('--cache_dir', type=str, help='Cache directory to migrate',
+                        default='cache')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    num_copied, num_with_url = migrate(args.cache_dir)
+    LOG.info(f'Copied {num_copied:,} responses ({num_with_url:,} with known URLs) into '
+             f'{os.path.join(args.cache_dir, SQLITE_FILE)}')
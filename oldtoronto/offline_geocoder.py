@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""Answer geocoding queries from the cache of past Google Maps Geocoding API responses.
+
+fetcher.Cache keeps every response which geocode.py has received under
+cache/maps.googleapis.com, but a response can only be found again via its exact URL.
+OfflineGeocoder loads them all into memory, indexed by canonical search term, so that e.g.
+"Bloor St. and Yonge St." finds the response for "Yonge St. and Bloor St.". It stands in for
+googlemaps.Client:
+
+    oldtoronto/geocode.py --offline
+
+Search terms which aren't in the cache get no results, with one exception: if an exact address
+like "12 king street" isn't cached, but other addresses on the same street are, its location is
+interpolated between the nearest ones.
+
+CachedGeocoder is what geocode.py normally uses. It answers search terms from the same index
+without going through googlemaps.Client, and only sends misses to the API. Without a client, it
+records the search terms which it couldn't answer, so that they can be fetched later:
+
+    oldtoronto/geocode.py --cache_only
+
+Run this directly to summarize what's in the cache:
+
+    oldtoronto/offline_geocoder.py --cache_dir cache
+"""
+
+import argparse
+import bisect
+import collections
+import copy
+import json
+import logging
+import math
+import re
+import threading
+import time
+import urllib.parse
+
+from fetcher import Cache
+from utils.search_terms import SEARCH_TERM_SUFFIX, canonical_search_term
+
+LOG = logging.getLogger(__name__)
+
+GEOCODE_HOST = 'maps.googleapis.com'
+GEOCODE_PATH = '/maps/api/geocode/json'
+
+# Responses with any other status (e.g. OVER_QUERY_LIMIT) say nothing about the search term.
+USABLE_STATUSES = {'OK', 'ZERO_RESULTS'}
+
+# Results of these types pin down a single address, so they can be used for interpolation.
+ADDRESS_TYPES = {'street_address', 'premise'}
+
+# A canonical exact address search term, as built by geocode.parse_exact_address.
+ADDRESS_RE = re.compile(r'(\d+(?:\.5)?) (.+)' + re.escape(SEARCH_TERM_SUFFIX))
+
+
+def parse_address(search_term):
+    """Split a canonical search term like "12 king street ontario toronto canada".
+
+    Returns:
+        Either a (number, street) tuple, e.g. (12.0, 'king street'), or None.
+    """
+    m = ADDRESS_RE.fullmatch(search_term)
+    if not m:
+        return None
+    return float(m.group(1)), m.group(2)
+
+
+def geocode_url(address):
+    """The URL which googlemaps.Client requests for a search term, minus the API key.
+
+    fetcher.Cache ignores the key, so this is enough to find a cached response.
+    """
+    query = urllib.parse.urlencode({'address': address})
+    return f'https://{GEOCODE_HOST}{GEOCODE_PATH}?{query}'
+
+
+def geocode_url_address(url):
+    """The search term in a Geocoding API request URL, or None if it doesn't have one."""
+    return dict(urllib.parse.parse_qsl(urllib.parse.urlparse(url).query)).get('address')
+
+
+def cached_geocode_urls(cache):
+    """Yield the URLs of all the cached Geocoding API requests in a fetcher.Cache, oldest first."""
+    for url in cache.urls():
+        parsed_url = urllib.parse.urlparse(url)
+        if parsed_url.netloc == GEOCODE_HOST and parsed_url.path == GEOCODE_PATH:
+            yield url
+
+
+def load_cached_geocodes(cache):
+    """Load the usable Geocoding API responses in a fetcher.Cache.
+
+    Returns:
+        A dict mapping canonical search terms to lists of Geocoding API results.
+    """
+    # The same search term may have been cached under several URLs; the newest one wins.
+    ages = {url: i for i, url in enumerate(cached_geocode_urls(cache))}
+    newest = {}  # search term --> (age, results)
+    num_unusable = 0
+    for url, contents in cache.iter_cached(ages):
+        address = geocode_url_address(url)
+        if address is None:
+            continue
+        response = json.loads(contents)
+        if response.get('status') not in USABLE_STATUSES:
+            num_unusable += 1
+            continue
+        search_term = canonical_search_term(address)
+        if search_term not in newest or newest[search_term][0] < ages[url]:
+            newest[search_term] = (ages[url], response.get('results', []))
+    LOG.info(f'Loaded {len(newest):,} cached geocodes (skipped {num_unusable:,} errors).')
+    return {search_term: results for search_term, (_, results) in newest.items()}
+
+
+class OfflineGeocoder(object):
+    """A drop-in replacement for googlemaps.Client which only knows about cached responses."""
+    def __init__(self, responses):
+        """responses maps canonical search terms to lists of Geocoding API results."""
+        self._responses = responses
+        # street --> sorted list of (number, lat, lng) for the addresses known to be on it.
+        self._addresses = collections.defaultdict(list)
+        for search_term, results in responses.items():
+            address = parse_address(search_term)
+            if not address or not results or not ADDRESS_TYPES & set(results[0]['types']):
+                continue
+            number, street = address
+            location = results[0]['geometry']['location']
+            self._addresses[street].append((number, location['lat'], location['lng']))
+        for addresses in self._addresses.values():
+            addresses.sort()
+        self.num_hits = 0
+        self.num_interpolated = 0
+        self.num_misses = 0
+
+    @classmethod
+    def from_cache(cls, cache_dir='cache'):
+        """Index all the Geocoding API responses in a fetcher.Cache directory."""
+        return cls(load_cached_geocodes(Cache(cache_dir)))
+
+    def geocode(self, address=None, **_kwargs):
+        """Look up a search term, like googlemaps.Client.geocode.
+
+        Returns:
+            A list of Geocoding API results, which is empty if the search term is unknown.
+        """
+        search_term = canonical_search_term(address)
+        results = self._responses.get(search_term)
+        if results is not None:
+            self.num_hits += 1
+            return copy.deepcopy(results)
+        result = self.interpolate(search_term)
+        if result:
+            self.num_interpolated += 1
+            return [result]
+        self.num_misses += 1
+        return []
+
+    def interpolate(self, search_term):
+        """Estimate the location of an address from known addresses on the same street.
+
+        If the address falls between two known ones, its location is linearly interpolated
+        between them. Otherwise the location of the nearest known address is used.
+
+        Returns:
+            Either a Geocoding API result with RANGE_INTERPOLATED accuracy, or None.
+        """
+        address = parse_address(search_term)
+        if not address:
+            return None
+        number, street = address
+        known = self._addresses.get(street)
+        if not known:
+            return None
+
+        i = bisect.bisect_left(known, (number,))
+        if 0 < i < len(known):
+            (number1, lat1, lng1), (number2, lat2, lng2) = known[i - 1], known[i]
+            fraction = (number - number1) / (number2 - number1)
+            lat = lat1 + fraction * (lat2 - lat1)
+            lng = lng1 + fraction * (lng2 - lng1)
+        else:
+            _, lat, lng = known[min(i, len(known) - 1)]
+
+        return {
+            'formatted_address': search_term[:-len(SEARCH_TERM_SUFFIX)],
+            'geometry': {
+                'location': {'lat': lat, 'lng': lng},
+                'location_type': 'RANGE_INTERPOLATED'
+            },
+            'place_id': '',
+            'types': ['street_address']
+        }
+
+    def stats(self):
+        return {
+            'search_terms': len(self._responses),
+            'streets_with_addresses': len(self._addresses),
+            'hits': self.num_hits,
+            'interpolated': self.num_interpolated,
+            'misses': self.num_misses
+        }
+
+
+class LookupStats(object):
+    """Counts and latencies of lookups, broken down by where the answer came from."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._durations = collections.defaultdict(list)
+
+    def record(self, source, secs):
+        with self._lock:
+            self._durations[source].append(secs)
+
+    def to_json(self):
+        with self._lock:
+            durations = {source: sorted(secs) for source, secs in self._durations.items()}
+        return {
+            source: {
+                'lookups': len(secs),
+                'total_secs': sum(secs),
+                'mean_ms': 1000 * sum(secs) / len(secs),
+                'p99_ms': 1000 * secs[max(1, math.ceil(0.99 * len(secs))) - 1],
+                'max_ms': 1000 * secs[-1]
+            }
+            for source, secs in durations.items()
+        }
+
+
+class CachedGeocoder(object):
+    """A drop-in replacement for googlemaps.Client which tries the cache before the client.
+
+    Going through googlemaps.Client and fetcher.CacheSession costs milliseconds even when the
+    response is cached: the client builds and signs a request, then the cache parses the URL
+    again, hashes it and wraps the response. Instead, the first lookup indexes all the cached
+    responses by canonical search term, like OfflineGeocoder, and hits are answered straight
+    from that index. Only misses go to maps_client, which stores its responses in the cache as
+    usual. The index uses the Cache of the client's CacheSession, if it has one, rather than
+    opening another.
+
+    If maps_client is None, nothing goes to the network. Misses (and cached errors) get None,
+    like a failed request, and are remembered so that they can be fetched later.
+    """
+    def __init__(self, maps_client=None, cache_dir='cache'):
+        self._maps_client = maps_client
+        # A fetcher.CacheSession has a cache; a plain requests.Session doesn't.
+        self._cache = getattr(getattr(maps_client, 'session', None), 'cache', None)
+        if self._cache is None:
+            self._cache = Cache(cache_dir)
+        self._responses = None  # canonical search term --> list of results, once loaded.
+        self._responses_lock = threading.Lock()
+        self.misses = set()
+        self._stats = LookupStats()
+
+    def _index(self):
+        if self._responses is None:
+            with self._responses_lock:
+                if self._responses is None:
+                    self._responses = load_cached_geocodes(self._cache)
+        return self._responses
+
+    def geocode(self, address=None, **kwargs):
+        start = time.perf_counter()
+        source = 'cache'
+        try:
+            search_term = canonical_search_term(address)
+            responses = self._index()
+            results = responses.get(search_term)
+            if results is None and self._maps_client:
+                source = 'client'
+                results = self._maps_client.geocode(address, **kwargs)
+                if results is not None:
+                    responses[search_term] = results
+            if results is None:
+                source = 'miss'
+                LOG.debug(f'cache miss for search term: {address}')
+                self.misses.add(address)
+                return None
+            return copy.deepcopy(results)
+        finally:
+            self._stats.record(source, time.perf_counter() - start)
+
+    def write_misses(self, path):
+        """Write the search terms which weren't in the cache, one per line, sorted."""
+        with open(path, 'w') as f:
+            for search_term in sorted(self.misses):
+                f.write(search_term + '\n')
+
+    def stats(self):
+        """Lookup counts and latencies, keyed by source: cache, client or miss."""
+        return self._stats.to_json()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Summarize the geocodes available offline.')
+    parser.add_argument('--cache_dir', type=str,
+                        help='fetcher cache directory containing Geocoding API responses',
+                        default='cache')
+    args = parser.parse_args()
+
+    geocoder = OfflineGeocoder.from_cache(args.cache_dir)
+    print(json.dumps(geocoder.stats(), indent=2))
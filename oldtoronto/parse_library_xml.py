@@ -8,13 +8,27 @@ Usage:
     oldtoronto/parse_library_xml.py data/tpl/tpl-rss-urls.txt data/tpl/toronto-library.ndjson
 
 The choice of field names is somewhat evocative of the Toronto Archives.
+
+URLs which aren't in the cache are skipped, unless --fetch is set. Then they're fetched first,
+one per second by default; see fetch_archive_records.py for how to speed that up.
+
+Cached pages are parsed across a pool of processes (see --workers). The IDs which have been
+written are kept beside the output, in toronto-library.ndjson.ids.sqlite3, so rerunning this
+after adding URLs only appends the new records. Pass --full to rewrite the output instead.
 """
 
+import argparse
 import json
+import os
+import sqlite3
 import sys
 import xml.etree.ElementTree as ET
 
 import fetcher
+from utils.parallel import process_map
+
+# Characters of XML to feed the parser at a time.
+XML_CHUNK_SIZE = 64 * 1024
 
 
 def parse_library_item(item_et):
@@ -49,34 +63,146 @@ def parse_library_item(item_et):
     return o
 
 
+def iter_library_results_xml(xml_str):
+    """Parse RSS results from the Toronto Public Library, one item at a time.
+
+    Each <item> is dropped from the tree once it has been converted, so the whole page is
+    never held in memory at once.
+    """
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    depth = 0
+    channel = None
+    for start in range(0, len(xml_str), XML_CHUNK_SIZE):
+        parser.feed(xml_str[start:start + XML_CHUNK_SIZE])
+        for event, elem in parser.read_events():
+            if event == 'start':
+                depth += 1
+                if depth == 2 and channel is None:
+                    channel = elem  # the first child of <rss>
+                continue
+            depth -= 1
+            if depth == 2 and elem in channel:
+                if elem.tag == 'item':
+                    yield parse_library_item(elem)
+                channel.remove(elem)
+    parser.close()
+
+
 def parse_library_results_xml(xml_str):
     """Parse RSS results from the Toronto Public Library."""
-    root = ET.fromstring(xml_str)
-    results = []
-    for item in root[0].findall('item'):
-        results.append(parse_library_item(item))
-    return results
+    return list(iter_library_results_xml(xml_str))
+
+
+class SeenIds(object):
+    """The uniqueIDs which have been written to an ndjson file, kept in SQLite beside it.
+
+    The size of the ndjson file is saved with each commit. If it doesn't match when the IDs
+    are loaded again, e.g. because an earlier run was killed or the file was replaced, the
+    IDs are read back from the ndjson file instead.
+    """
+    def __init__(self, ndjson_path):
+        self._ndjson_path = ndjson_path
+        self._db = sqlite3.connect(ndjson_path + '.ids.sqlite3')
+        self._db.execute('CREATE TABLE IF NOT EXISTS ids (id TEXT PRIMARY KEY) WITHOUT ROWID')
+        self._db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)')
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'ndjson_bytes'").fetchone()
+        try:
+            num_bytes = os.path.getsize(ndjson_path)
+        except FileNotFoundError:
+            num_bytes = 0
+        if (row[0] if row else 0) != num_bytes:
+            self._rebuild()
+
+    def _rebuild(self):
+        """Reload the IDs from the ndjson file, dropping a partly written last line."""
+        self._db.execute('DELETE FROM ids')
+        num_bytes = 0
+        if os.path.exists(self._ndjson_path):
+            with open(self._ndjson_path, 'rb+') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break
+                    self.add(json.loads(line)['uniqueID'])
+                    num_bytes += len(line)
+                f.truncate(num_bytes)
+        self.commit(num_bytes)
+
+    def __contains__(self, id_):
+        return self._db.execute('SELECT 1 FROM ids WHERE id = ?', (id_,)).fetchone() is not None
+
+    def add(self, id_):
+        self._db.execute('INSERT OR IGNORE INTO ids (id) VALUES (?)', (id_,))
+
+    def commit(self, ndjson_bytes):
+        """Save the IDs added so far, once the ndjson file has been flushed at this size."""
+        self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('ndjson_bytes', ?)",
+                         (ndjson_bytes,))
+        self._db.commit()
+
+
+def cached_pages(f, urls):
+    """Yield (num, page) for the URLs which are cached."""
+    for num, url in enumerate(urls):
+        if f.is_url_in_cache(url):
+            yield num, f.fetch_url_from_cache(url)
+
+
+def _parse_numbered_page(args):
+    """Returns (num, [(ID, ndjson line), ...]) for a cached page. This runs in a worker."""
+    num, page = args
+    return num, [
+        (record['uniqueID'], json.dumps(record))
+        for record in iter_library_results_xml(page.decode('utf8'))
+    ]
+
+
+def write_records(pages, ndjson_output, workers=None):
+    """Parse cached pages, appending the records which aren't in ndjson_output yet to it.
+
+    Returns:
+        The number of records which were written.
+    """
+    seen_ids = SeenIds(ndjson_output)
+    num_written = 0
+    with open(ndjson_output, 'a') as out:
+        for num, records in process_map(_parse_numbered_page, pages, workers=workers):
+            for id_, line in records:
+                if id_ in seen_ids:
+                    continue
+                out.write(line)
+                out.write('\n')
+                seen_ids.add(id_)
+                num_written += 1
+            out.flush()
+            seen_ids.commit(os.fstat(out.fileno()).st_size)
+            sys.stderr.write('Processed %d results...\n' % (1 + num))
+    return num_written
 
 
 if __name__ == '__main__':
-    urls_file_input, ndjson_output = sys.argv[1:]
-    f = fetcher.Fetcher()
-    out = open(ndjson_output, 'w')
-    ids = set()
-    for num, url in enumerate(open(urls_file_input)):
-        url = url.strip()
-
-        if not f.is_url_in_cache(url):
-            continue
-
-        xml = f.fetch_url_from_cache(url).decode('utf8')
-        records = parse_library_results_xml(xml)
-        for record in records:
-            id_ = record['uniqueID']
-            if id_ in ids:
-                continue
-            json.dump(record, out)
-            out.write('\n')
-            ids.add(id_)
-
-        sys.stderr.write('Processed %d results...\n' % (1 + num))
+    parser = argparse.ArgumentParser('Parse Toronto Public Library RSS results into ndjson.')
+    parser.add_argument('urls_file', help='File of RSS result URLs, one per line')
+    parser.add_argument('ndjson_output', help='Where to write the records')
+    parser.add_argument('--fetch', action='store_true',
+                        help="Fetch the URLs which aren't cached before parsing")
+    parser.add_argument('--full', action='store_true',
+                        help='Rewrite the output from scratch, rather than appending to it')
+    parser.add_argument('--parse_workers', type=int,
+                        help='Number of processes to parse pages with. Defaults to one per CPU.',
+                        default=None)
+    fetcher.add_concurrent_fetcher_args(parser, qps=1.0)
+    args = parser.parse_args()
+
+    f = fetcher.ConcurrentFetcher.from_args(args)
+    urls = [url.strip() for url in open(args.urls_file)]
+    if args.fetch:
+        uncached = [url for url in urls if not f.is_url_in_cache(url)]
+        for url, _, error in f.fetch_urls(uncached):
+            if error:
+                sys.stderr.write(f'Failed to fetch {url}: {error}\n')
+    if args.full:
+        for path in (args.ndjson_output, args.ndjson_output + '.ids.sqlite3'):
+            if os.path.exists(path):
+                os.remove(path)
+    num_written = write_records(cached_pages(f, urls), args.ndjson_output, args.parse_workers)
+    sys.stderr.write(f'Wrote {num_written:,} new records to {args.ndjson_output}\n')
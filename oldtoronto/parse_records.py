@@ -11,15 +11,25 @@ Usage:
 Note that all URLs are assumed to have been cached beforehand, e.g. with:
 
     ./fetch_archive_records.py record-ids.txt
+
+To parse a large crawl quickly, pass --fast to skip building the parts of each page which
+hold no metadata, and --workers to parse pages in several processes at once:
+
+    ./parse_records.py --fast --workers 8 record-ids.txt records.ndjson
+
+The output is the same either way. bench_parse_records.py measures the difference, and can
+check that it holds for the pages in your cache.
 """
 
+import argparse
 import json
 import re
 import sys
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 
 import fetcher
 from toronto_archives import url_for_unique_id
+from utils.parallel import process_map
 
 keys = {
     'Access conditions': 'condition',
@@ -64,6 +74,10 @@ link_labels = {
     'Record consists of'
 }
 
+# Everything parse_html looks at is inside one of these. The page around them is skipped
+# when parse_html is called with fast=True.
+RECORD_STRAINER = SoupStrainer(class_=['row', 'img-thumbnail'])
+
 
 def machine_keys(tags):
     """Convert human-readable Toronto archive tags to machine names."""
@@ -75,9 +89,14 @@ def machine_keys(tags):
     return out
 
 
-def parse_html(html):
-    """Parse a single record page."""
-    soup = BeautifulSoup(html, 'html.parser')
+def parse_html(html, fast=False):
+    """Parse a single record page.
+
+    With fast=True, only the .row and .img-thumbnail elements are built into a tree. This
+    gives the same results for any page whose .row elements are properly closed, in about
+    half the time.
+    """
+    soup = BeautifulSoup(html, 'html.parser', parse_only=RECORD_STRAINER if fast else None)
     tags = {}
     for row in soup.select('.row'):
         labels = row.select('#displayLabel')
@@ -108,21 +127,46 @@ def extractId(url):
     return m.group(1)
 
 
-if __name__ == '__main__':
-    (urls_file_input, ndjson_output) = sys.argv[1:]
-    f = fetcher.Fetcher()
-    out = open(ndjson_output, 'w')
-    for num, id_ in enumerate(open(urls_file_input)):
-        id_ = id_.strip()
+def record_json(id_, page, fast=False):
+    """The records.ndjson line (without a newline) for one cached record page."""
+    tags = parse_html(page.decode('utf8'), fast=fast)
+    tags['uniqueID'] = id_
+    return json.dumps(tags)
 
+
+def _numbered_record_json(args):
+    num, id_, page, fast = args
+    return num, record_json(id_, page, fast=fast)
+
+
+def cached_pages(f, ids):
+    """Yield (num, id, page) for the IDs whose record page is in the cache."""
+    for num, id_ in enumerate(ids):
+        id_ = id_.strip()
         url = url_for_unique_id(id_)
         if not f.is_url_in_cache(url):
             continue
+        yield num, id_, f.fetch_url_from_cache(url)
 
-        html = f.fetch_url_from_cache(url).decode('utf8')
-        tags = parse_html(html)
-        tags['uniqueID'] = id_
-        out.write(json.dumps(tags))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Parse cached Toronto Archives record pages.')
+    parser.add_argument('urls_file_input', type=str, help='File of record IDs, one per line')
+    parser.add_argument('ndjson_output', type=str, help='Where to write records.ndjson')
+    parser.add_argument('--fast', action='store_true',
+                        help='Only parse the parts of each page which hold metadata')
+    parser.add_argument('--workers', type=int, help='Number of processes to parse pages with',
+                        default=1)
+    args = parser.parse_args()
+
+    f = fetcher.Fetcher()
+    out = open(args.ndjson_output, 'w')
+    jobs = (
+        (num, id_, page, args.fast)
+        for num, id_, page in cached_pages(f, open(args.urls_file_input))
+    )
+    for num, line in process_map(_numbered_record_json, jobs, workers=args.workers):
+        out.write(line)
         out.write('\n')
 
         if num > 0 and num % 1000 == 0:
@@ -0,0 +1,93 @@
+"""Collect call counts, hit rates and timings for the title parsers in geocode.py.
+
+Use it via geocode.py --profile_parsers report.json (or report.tsv). The report has a row for
+each parser, in the order in which they're tried. Since the chain stops at the first parser
+which matches, later parsers are only called on titles which earlier ones didn't match.
+"""
+
+import heapq
+import json
+import math
+import time
+
+
+class ParserStats(object):
+    def __init__(self, name, num_slowest):
+        self.name = name
+        self.num_calls = 0
+        self.num_matches = 0
+        self.durations = []
+        self._num_slowest = num_slowest
+        self._slowest = []  # min-heap of (secs, title)
+
+    def record(self, title, secs, matched):
+        self.num_calls += 1
+        self.num_matches += int(matched)
+        self.durations.append(secs)
+        if len(self._slowest) < self._num_slowest:
+            heapq.heappush(self._slowest, (secs, title))
+        elif secs > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, (secs, title))
+
+    def slowest(self):
+        """The slowest titles, slowest first, as (secs, title) tuples."""
+        return sorted(self._slowest, reverse=True)
+
+    def percentile(self, p):
+        """Nearest-rank percentile of the call durations, in seconds."""
+        if not self.durations:
+            return 0.0
+        durations = sorted(self.durations)
+        rank = max(1, math.ceil(p / 100 * len(durations)))
+        return durations[rank - 1]
+
+    def to_json(self):
+        total_secs = sum(self.durations)
+        return {
+            'parser': self.name,
+            'calls': self.num_calls,
+            'matches': self.num_matches,
+            'match_rate': self.num_matches / self.num_calls if self.num_calls else 0.0,
+            'total_secs': total_secs,
+            'mean_secs': total_secs / self.num_calls if self.num_calls else 0.0,
+            'p99_secs': self.percentile(99),
+            'max_secs': max(self.durations, default=0.0),
+            'slowest': [{'secs': secs, 'title': title} for secs, title in self.slowest()]
+        }
+
+
+class ParserProfiler(object):
+    """Wraps title parsers to record statistics about each call."""
+    def __init__(self, num_slowest=10):
+        self._stats = []
+        self._num_slowest = num_slowest
+
+    def wrap(self, name, parser):
+        stats = ParserStats(name, self._num_slowest)
+        self._stats.append(stats)
+
+        def profiled_parser(title):
+            start = time.perf_counter()
+            outcome = parser(title)
+            stats.record(title, time.perf_counter() - start, bool(outcome))
+            return outcome
+        return profiled_parser
+
+    def report(self):
+        return [stats.to_json() for stats in self._stats]
+
+    def write_report(self, path):
+        """Write the report as TSV if path ends with .tsv, otherwise as JSON."""
+        report = self.report()
+        with open(path, 'w') as f:
+            if not path.endswith('.tsv'):
+                json.dump(report, f, indent=2)
+                return
+            columns = ['parser', 'calls', 'matches', 'match_rate', 'total_secs', 'mean_secs',
+                       'p99_secs', 'max_secs']
+            f.write('\t'.join(columns + ['slowest_title']) + '\n')
+            for row in report:
+                slowest_title = row['slowest'][0]['title'] if row['slowest'] else ''
+                values = [str(row[column]) for column in columns]
+                values.append(slowest_title.replace('\t', ' '))
+                f.write('\t'.join(values) + '\n')
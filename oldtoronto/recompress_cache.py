@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""Compress or decompress the responses in a fetcher cache, in place.
+
+Usage:
+
+    oldtoronto/recompress_cache.py --cache_dir cache --compression gzip
+
+This rewrites every cached response with the given codec ('gzip', 'zstd' or 'none'), skipping
+the ones which are already stored that way, then reports the bytes saved for each host and how
+long it takes to read a response back before and after. Responses which don't compress well,
+like images, are left uncompressed. Use --dry_run to get the report without changing anything.
+
+To have new responses compressed too, set CACHE_COMPRESSION in settings.py.
+"""
+
+import argparse
+import collections
+import json
+import logging
+import time
+
+import tqdm
+
+from fetcher import (Cache, blob_compression, check_compression, decode_contents,
+                     encode_contents)
+
+LOG = logging.getLogger(__name__)
+
+
+class HostStats(object):
+    """Sizes and read times of one host's responses, before and after recompression."""
+    def __init__(self):
+        self.num_responses = 0
+        self.num_rewritten = 0
+        self.old_bytes = 0
+        self.new_bytes = 0
+        self.raw_bytes = 0
+        self.old_decode_secs = 0.0
+        self.new_decode_secs = 0.0
+
+    def to_json(self):
+        return {
+            'responses': self.num_responses,
+            'rewritten': self.num_rewritten,
+            'raw_bytes': self.raw_bytes,
+            'old_bytes': self.old_bytes,
+            'new_bytes': self.new_bytes,
+            'saved_bytes': self.old_bytes - self.new_bytes,
+            'old_read_mb_per_sec': mb_per_sec(self.raw_bytes, self.old_decode_secs),
+            'new_read_mb_per_sec': mb_per_sec(self.raw_bytes, self.new_decode_secs)
+        }
+
+
+def mb_per_sec(num_bytes, secs):
+    return round(num_bytes / 1e6 / secs, 1) if secs else None
+
+
+def timed_decode(blob):
+    start = time.perf_counter()
+    contents = decode_contents(blob)
+    return contents, time.perf_counter() - start
+
+
+def recompress(cache_dir, compression, dry_run=False):
+    """Rewrite each response in a cache with a new codec (None for no compression).
+
+    The read times only cover decompression, which is the part of reading a response that
+    the codec changes. Each response keeps its access time, so the LRU order is unchanged.
+
+    Returns:
+        A dict mapping host --> HostStats.
+    """
+    check_compression(compression)
+    storage = Cache(cache_dir)._storage
+    stats = collections.defaultdict(HostStats)
+    accessed = {}
+    for host, key, _, t in tqdm.tqdm(list(storage.entries())):
+        blob = storage.get(host, key)
+        if blob is None:
+            continue  # removed since we listed the keys.
+        # Reading a file can bump its atime (e.g. on relatime mounts), so put it back after.
+        accessed[(host, key)] = t
+        host_stats = stats[host]
+        host_stats.num_responses += 1
+        host_stats.old_bytes += len(blob)
+        contents, secs = timed_decode(blob)
+        host_stats.raw_bytes += len(contents)
+        host_stats.old_decode_secs += secs
+
+        if blob_compression(blob) == compression:
+            new_blob = blob
+        else:
+            new_blob = encode_contents(contents, compression)
+        host_stats.new_bytes += len(new_blob)
+        host_stats.new_decode_secs += timed_decode(new_blob)[1]
+        if new_blob != blob:
+            host_stats.num_rewritten += 1
+            if not dry_run:
+                storage.rewrite(host, key, new_blob)
+    storage.touch(accessed)
+    storage.flush()
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Recompress the responses in a fetcher cache.')
+    parser.add_argument('--cache_dir', type=str, help='Cache directory to recompress',
+                        default='cache')
+    parser.add_argument('--compression', type=str, choices=('gzip', 'zstd', 'none'),
+                        help='Codec to store responses with', required=True)
+    parser.add_argument('--dry_run', action='store_true',
+                        help='Report what would change without rewriting anything')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    compression = None if args.compression == 'none' else args.compression
+    stats = recompress(args.cache_dir, compression, dry_run=args.dry_run)
+    report = {host: host_stats.to_json() for host, host_stats in sorted(stats.items())}
+    print(json.dumps(report, indent=2))
+    old_bytes = sum(s.old_bytes for s in stats.values())
+    new_bytes = sum(s.new_bytes for s in stats.values())
+    LOG.info(f'{"Would shrink" if args.dry_run else "Shrank"} {args.cache_dir} from '
+             f'{old_bytes / 1e6:,.1f} MB to {new_bytes / 1e6:,.1f} MB')
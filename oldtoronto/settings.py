@@ -1 +1,8 @@
 GMAPS_API_KEY = ''
+
+# Compress newly cached responses with this codec: None, 'gzip' or 'zstd'. See fetcher.py.
+CACHE_COMPRESSION = None
+
+# Evict the least recently used responses once the cache is bigger than this, or None. The
+# Geocoding API responses are expensive to fetch again, so leave this unset unless disk is tight.
+CACHE_MAX_BYTES = None
@@ -0,0 +1,145 @@
+"""Find Toronto street names in text using a character trie.
+
+This replaces a giant "street1|street2|..." regular expression alternation, which Python tries
+branch by branch at every position in a title. Walking a trie only costs as much as the longest
+street which could start at each position, regardless of how many streets there are.
+
+The matching rules are the same as those of the regular expressions in geocode.py:
+- exact_address_regex: "<number>[.5] [1/2] <street>", case-sensitive on lowercased text.
+- standalone_street_regex: case-insensitive, and the street can't be preceded or followed by
+  an ASCII letter.
+In both cases the longest street wins.
+"""
+
+# Characters which re.IGNORECASE treats as equal to an ASCII letter, but which aren't the same
+# as that letter after lower().
+_SPECIAL_FOLDS = {
+    '\u0130': 'i',  # LATIN CAPITAL LETTER I WITH DOT ABOVE
+    '\u0131': 'i',  # LATIN SMALL LETTER DOTLESS I
+    '\u017f': 's',  # LATIN SMALL LETTER LONG S
+}
+
+# Non-ASCII characters which re.compile('[a-z]', re.I) matches.
+_NON_ASCII_LETTERS = set(_SPECIAL_FOLDS) | {'\u212a'}  # KELVIN SIGN
+
+# Marks the end of a street in a trie node.
+_END = None
+
+
+def _fold(c):
+    """Case-fold a single character the way re.IGNORECASE compares it to ASCII letters."""
+    if c in _SPECIAL_FOLDS:
+        return _SPECIAL_FOLDS[c]
+    lower = c.lower()
+    return lower if len(lower) == 1 else c
+
+
+def _fold_text(text):
+    """Case-fold text, keeping a one-to-one correspondence between characters."""
+    lower = text.lower()
+    if len(lower) == len(text) and not any(c in _SPECIAL_FOLDS for c in text):
+        return lower
+    return ''.join(_fold(c) for c in text)
+
+
+def _is_letter(c):
+    """Equivalent to re.match('[a-z]', c, re.I)."""
+    return ('a' <= c <= 'z') or ('A' <= c <= 'Z') or c in _NON_ASCII_LETTERS
+
+
+class StreetMatcher(object):
+    """Finds streets from a list of street names in titles."""
+    def __init__(self, street_list):
+        self._trie = {}
+        for street in street_list:
+            street = street.strip().lower()
+            if not street:
+                continue
+            node = self._trie
+            for c in street:
+                node = node.setdefault(c, {})
+            node[_END] = True
+
+    def _street_ends(self, text, start):
+        """Return the end offsets of streets starting at text[start], longest first."""
+        ends = []
+        node = self._trie
+        for i in range(start, len(text)):
+            node = node.get(text[i])
+            if node is None:
+                break
+            if _END in node:
+                ends.append(i + 1)
+        ends.reverse()
+        return ends
+
+    def match_exact_address(self, text):
+        """Find the first "<number> <street>" in text, e.g. "203 church street".
+
+        This is equivalent to exact_address_regex(...).match(text). text should already be
+        lowercase.
+
+        Returns:
+            Either a (number, street) tuple or None.
+        """
+        n = len(text)
+        i = 0
+        while i < n:
+            if not text[i].isdecimal():
+                i += 1
+                continue
+            digits_end = i
+            while digits_end < n and text[digits_end].isdecimal():
+                digits_end += 1
+            number_end = digits_end + 2 if text.startswith('.5', digits_end) else digits_end
+            street_start = number_end
+            while street_start < n and text[street_start].isspace():
+                street_start += 1
+
+            if street_start > number_end:
+                candidates = [street_start]
+                half = street_start + 3
+                if text.startswith('1/2', street_start) and half < n and text[half].isspace():
+                    candidates.insert(0, half + 1)
+                for start in candidates:
+                    ends = self._street_ends(text, start)
+                    if ends:
+                        return text[i:number_end], text[start:ends[0]]
+            i = digits_end
+        return None
+
+    def findall(self, text):
+        """Find all the non-overlapping streets in text, in order.
+
+        This is equivalent to standalone_street_regex(...).findall(text). Note that, as with the
+        regex, the character after a street is consumed, so two streets separated by a single
+        non-letter won't both be found.
+        """
+        folded = _fold_text(text)
+        n = len(text)
+        matches = []
+        i = 0
+        while i < n:
+            # Either the start of the string or a non-letter can precede a street.
+            starts = []
+            if i == 0:
+                starts.append(0)
+            if not _is_letter(text[i]):
+                starts.append(i + 1)
+
+            match_end = None
+            for start in starts:
+                for end in self._street_ends(folded, start):
+                    if end == n:
+                        match_end = n
+                    elif not _is_letter(text[end]):
+                        match_end = end + 1
+                    else:
+                        continue
+                    matches.append(text[start:end])
+                    break
+                if match_end is not None:
+                    break
+
+            i = match_end if match_end is not None else i + 1
+        return matches
@@ -38,7 +38,14 @@ from oldtoronto.date_distribution import parse_year # noqa
     (('1942', '1942'), 'November 23 & 24, 1942'),
     (('1923', '1923'), 'Febuary 16, 1923'),
     (None, 'Digitized 2010'),
-    (('1948', '1948'), 'June 15-19, 1948')
+    (('1948', '1948'), 'June 15-19, 1948'),
+    (('1914', '1914'), 'November 27, 1914'),
+    (('1914', '1914'), '27 Nov. 1914'),
+    (('1914', '1914'), 'February 30, 1914'),
+    (None, '[1600]'),
+    (None, 'June 1, 2050'),
+    (None, '[]'),
+    (None, '')
     # Patterns that don't work yet:
     # (('1964', '1980'), '[between ca. 1964 and 1980]')
 ])
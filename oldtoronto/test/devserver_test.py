@@ -0,0 +1,75 @@
+import json
+import os
+import sys
+import tempfile
+
+sys.path.append('oldtoronto')
+
+from nose.tools import eq_ # noqa
+from oldtoronto import devserver # noqa
+
+SHEET_HEADER = 'Timestamp,Photo Id,Location suggestion,Lat,Lng,Fixed\n'
+# The module globals which live_corrections_test changes.
+STATE = ['geojson_file', 'mtime', 'patch_csv', 'patch_version', 'geojson_features', 'patches',
+         'features']
+
+
+def make_feature(id_, lat, lng):
+    return {
+        'id': id_,
+        'type': 'Feature',
+        'geometry': {'type': 'Point', 'coordinates': [lng, lat]},
+        'properties': {'title': f'Photo {id_}', 'date': '1920', 'image': {'url': 'x'}}
+    }
+
+
+def apply_patches_test():
+    features = [make_feature('1', 43.6, -79.4), make_feature('2', 43.7, -79.3),
+                make_feature('3', 43.8, -79.2)]
+    patched = devserver.apply_patches(features, {'1': (43.0, -79.0), '2': None})
+    eq_(['1', '3'], [f['id'] for f in patched])
+    eq_([-79.0, 43.0], patched[0]['geometry']['coordinates'])
+    eq_([-79.4, 43.6], features[0]['geometry']['coordinates'])
+
+
+def live_corrections_test():
+    saved = {name: getattr(devserver, name) for name in STATE}
+    try:
+        with tempfile.TemporaryDirectory() as d:
+            geojson_file = os.path.join(d, 'images.geojson')
+            patch_csv = os.path.join(d, 'patches.csv')
+            json.dump({
+                'type': 'FeatureCollection',
+                'features': [make_feature('1', 43.6, -79.4), make_feature('2', 43.7, -79.3)]
+            }, open(geojson_file, 'w'))
+            open(patch_csv, 'w').write(SHEET_HEADER + '3/20/2018 16:17:46,1,Wrong,43.5,-79.5,\n')
+
+            devserver.geojson_file = geojson_file
+            devserver.patch_csv = patch_csv
+            devserver.mtime = devserver.patch_version = 0
+            client = devserver.app.test_client()
+
+            def coordinates(id_):
+                response = client.get(f'/api/layer/oldtoronto/{id_}')
+                if response.status_code == 404:
+                    return None
+                return response.get_json()['geometry']['coordinates']
+
+            eq_([-79.5, 43.5], coordinates('1'))
+            eq_([-79.3, 43.7], coordinates('2'))
+
+            open(patch_csv, 'a').write('3/20/2018 16:29:48,2,Not here,,,\n'
+                                       '3/20/2018 16:29:49,2,Not here,,,\n')
+            os.utime(patch_csv, (devserver.patch_version + 1, devserver.patch_version + 1))
+            eq_(None, coordinates('2'))
+            eq_([-79.5, 43.5], coordinates('1'))
+
+            # A renamed column keeps the last good corrections, rather than failing requests.
+            open(patch_csv, 'w').write(SHEET_HEADER.replace('Photo Id', 'Photo') +
+                                       '3/20/2018 16:17:46,2,Wrong,43.4,-79.6,\n')
+            os.utime(patch_csv, (devserver.patch_version + 1, devserver.patch_version + 1))
+            eq_(None, coordinates('2'))
+            eq_([-79.5, 43.5], coordinates('1'))
+    finally:
+        for name, value in saved.items():
+            setattr(devserver, name, value)
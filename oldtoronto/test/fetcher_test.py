@@ -0,0 +1,496 @@
+import collections
+import hashlib
+import http.server
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+sys.path.append('oldtoronto')
+
+from nose.tools import eq_, ok_, raises # noqa
+from parameterized import parameterized # noqa
+from oldtoronto import manage_cache, migrate_cache, recompress_cache # noqa
+from oldtoronto.offline_geocoder import geocode_url # noqa
+from oldtoronto.utils.rate_limiter import AdaptiveTokenBucket # noqa
+from oldtoronto.utils.search_terms import canonical_search_term # noqa
+from oldtoronto.fetcher import COMPRESSED_MARKER, Cache, ConcurrentFetcher, NotInCacheError # noqa
+
+URL1 = 'https://maps.googleapis.com/maps/api/geocode/json?address=Yonge&key=abc'
+URL2 = 'http://example.com/page?id=1'
+IMAGE = bytes(range(256)) * 1000
+PAGE = b'<html><body>' + b'<div class="row">Yonge St.</div>' * 100 + b'</body></html>'
+
+
+@parameterized([('files',), ('sqlite',)])
+def cache_test(backend):
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = Cache(cache_dir, backend=backend)
+        ok_(not cache.is_url_in_cache(URL1))
+        cache.store_url_in_cache(URL1, b'one')
+        cache.store_url_in_cache(URL2, b'two')
+        ok_(cache.is_url_in_cache(URL1))
+        # The API key isn't part of the cache key.
+        eq_(b'one', cache.fetch_url_from_cache(URL1.replace('key=abc', 'key=xyz')))
+        eq_(b'two', cache.fetch_url_from_cache(URL2))
+        eq_([URL1, URL2], list(cache.urls()))
+
+        cache.remove_url_from_cache(URL2)
+        ok_(not cache.is_url_in_cache(URL2))
+        cache.flush()
+
+        cache = Cache(cache_dir)  # detects the backend.
+        eq_(b'one', cache.fetch_url_from_cache(URL1))
+
+
+@raises(NotInCacheError)
+def cache_miss_test():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        Cache(cache_dir, backend='sqlite').fetch_url_from_cache(URL1)
+
+
+def migrate_cache_test():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = Cache(cache_dir, backend='files')
+        cache.store_url_in_cache(URL2, b'old')
+        cache.store_url_in_cache(URL1, b'one')
+        cache.store_url_in_cache(URL2, b'two')
+        # Other files in the cache directory, like manifests, aren't responses.
+        os.makedirs(os.path.join(cache_dir, 'geocode_manifests'))
+        open(os.path.join(cache_dir, 'geocode_manifests', 'x.manifest'), 'w').write('{}')
+
+        eq_((2, 2), migrate_cache.migrate(cache_dir))
+
+        cache = Cache(cache_dir)
+        eq_(b'one', cache.fetch_url_from_cache(URL1))
+        eq_(b'two', cache.fetch_url_from_cache(URL2))
+        eq_([URL2, URL1], list(cache.urls()))
+        ok_(cache.location(URL1).endswith('cache.sqlite3#' + cache._cache_key(URL1)[1]))
+
+
+@parameterized([('files',), ('sqlite',)])
+def cache_index_test(backend):
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = Cache(cache_dir, backend=backend)
+        cache.store_url_in_cache(URL1, b'one')
+        cache.flush()
+
+        cache = Cache(cache_dir, backend=backend)
+        ok_(cache.is_url_in_cache(URL1))  # loaded from storage.
+        cache.store_url_in_cache(URL2, b'two')
+        ok_(cache.is_url_in_cache(URL2))
+        # Contents come back in storage order, not the order they were asked for.
+        eq_([(URL1, b'one'), (URL2, b'two')],
+            list(cache.iter_cached([URL2, 'http://example.com/missing', URL1])))
+        cache.remove_url_from_cache(URL1)
+        ok_(not cache.is_url_in_cache(URL1))
+        eq_([(URL2, b'two')], list(cache.iter_cached([URL1, URL2])))
+
+
+def cache_index_deleted_file_test():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = Cache(cache_dir, backend='files')
+        cache.store_url_in_cache(URL2, b'two')
+        os.unlink(cache.location(URL2))  # e.g. by another process.
+        ok_(cache.is_url_in_cache(URL2))
+        try:
+            cache.fetch_url_from_cache(URL2)
+            ok_(False, 'Expected NotInCacheError')
+        except NotInCacheError:
+            pass
+        ok_(not cache.is_url_in_cache(URL2))
+
+
+@parameterized([('files',), ('sqlite',)])
+def cache_compression_test(backend):
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = Cache(cache_dir, backend=backend)
+        cache.store_url_in_cache(URL1, PAGE)
+        cache.flush()
+        cache = Cache(cache_dir, backend=backend, compression='gzip')
+        cache.store_url_in_cache(URL2, PAGE)
+        cache.flush()
+        ok_(cache._storage.get(*cache._cache_key(URL2)).startswith(COMPRESSED_MARKER + b'gzip'))
+
+        # Uncompressed and compressed responses can be read either way.
+        for cache in (Cache(cache_dir), Cache(cache_dir, compression='gzip')):
+            eq_(PAGE, cache.fetch_url_from_cache(URL1))
+            eq_(PAGE, cache.fetch_url_from_cache(URL2))
+            eq_({URL1: PAGE, URL2: PAGE}, dict(cache.iter_cached([URL1, URL2])))
+
+
+def cache_compression_incompressible_test():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = Cache(cache_dir, compression='gzip')
+        contents = os.urandom(1000)
+        cache.store_url_in_cache(URL2, contents)
+        eq_(contents, open(cache.location(URL2), 'rb').read())  # stored raw.
+        eq_(contents, cache.fetch_url_from_cache(URL2))
+
+
+@raises(ValueError)
+def cache_unknown_compression_test():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        Cache(cache_dir, compression='rar')
+
+
+@parameterized([('files',), ('sqlite',)])
+def recompress_cache_test(backend):
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = Cache(cache_dir, backend=backend)
+        cache.store_url_in_cache(URL1, b'{}')
+        cache.store_url_in_cache(URL2, PAGE)
+        cache.flush()
+
+        stats = recompress_cache.recompress(cache_dir, 'gzip')
+        eq_(['example.com', 'maps.googleapis.com'], sorted(stats))
+        eq_(1, stats['example.com'].num_rewritten)
+        eq_(0, stats['maps.googleapis.com'].num_rewritten)  # too small to be worth it.
+        ok_(stats['example.com'].new_bytes < stats['example.com'].old_bytes)
+
+        cache = Cache(cache_dir)
+        eq_(PAGE, cache.fetch_url_from_cache(URL2))
+        eq_(0, recompress_cache.recompress(cache_dir, 'gzip')['example.com'].num_rewritten)
+
+        recompress_cache.recompress(cache_dir, None)
+        eq_(PAGE, cache._storage.get(*cache._cache_key(URL2)))
+
+
+@parameterized([('files',), ('sqlite',)])
+def recompress_cache_keeps_lru_order_test(backend):
+    with tempfile.TemporaryDirectory() as cache_dir:
+        urls = [f'http://example.com/page?id={i}' for i in range(3)]
+        cache = Cache(cache_dir, backend=backend)
+        for url in urls:
+            cache.store_url_in_cache(url, PAGE)
+        # Make the last URL the least recently used, days ago.
+        cache._storage.touch({
+            cache._cache_key(url): 1e9 - i * 86400 for i, url in enumerate(urls)})
+        cache.flush()
+
+        eq_(3, recompress_cache.recompress(cache_dir, 'gzip')['example.com'].num_rewritten)
+        cache = Cache(cache_dir, backend=backend)
+        accessed = {key: t for _, key, _, t in cache.entries()}
+        eq_([1e9 - i * 86400 for i in range(3)],
+            [accessed[cache._cache_key(url)[1]] for url in urls])
+        eq_([cache._cache_key(url) for url in reversed(urls)], cache.evict(0))
+
+
+@parameterized([('files',), ('sqlite',)])
+def cache_eviction_test(backend):
+    with tempfile.TemporaryDirectory() as cache_dir:
+        urls = [f'http://example.com/page?id={i}' for i in range(4)]
+        cache = Cache(cache_dir, backend=backend, max_bytes=350)
+        for url in urls[:3]:
+            cache.store_url_in_cache(url, b'x' * 100)
+        start = time.time()
+        cache.fetch_url_from_cache(urls[0])
+        cache.store_url_in_cache(urls[3], b'x' * 100)  # 400 bytes: evict down to 315.
+
+        ok_(cache.is_url_in_cache(urls[0]))
+        eq_(3, sum(cache.is_url_in_cache(url) for url in urls))
+        cache.flush()
+        eq_(300, sum(size for _, _, size, _ in Cache(cache_dir, backend=backend).entries()))
+        accessed = {key: t for _, key, _, t in Cache(cache_dir, backend=backend).entries()}
+        ok_(accessed[cache._cache_key(urls[0])[1]] >= start)
+
+
+def sha1(url):
+    return hashlib.sha1(url.encode('utf8')).hexdigest()
+
+
+def file_storage_concurrent_put_test():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        storage = Cache(cache_dir, backend='files')._storage
+        urls = [f'http://example.com/page?id={i}' for i in range(400)]
+
+        def put(i):
+            for url in urls[i::8]:
+                storage.put('example.com', sha1(url), url, url.encode() * 100)
+
+        threads = [threading.Thread(target=put, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        eq_(sorted(urls), sorted(storage.urls()))
+        eq_(sorted(sha1(url) for url in urls), sorted(key for _, key in storage.keys()))
+        eq_(sorted(sha1(url) for url in urls), sorted(os.listdir(f'{cache_dir}/example.com')))
+        eq_(urls[7].encode() * 100, storage.get('example.com', sha1(urls[7])))
+
+
+@parameterized([('files',), ('sqlite',)])
+def cache_concurrent_eviction_test(backend):
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = Cache(cache_dir, backend=backend, max_bytes=2000)
+
+        def store(i):
+            for j in range(50):
+                cache.store_url_in_cache(f'http://example.com/page?id={i}-{j}', b'x' * 100)
+
+        threads = [threading.Thread(target=store, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        cache.flush()
+
+        # The index agrees with what's actually stored.
+        eq_(set(Cache(cache_dir, backend=backend)._storage.keys()), set(cache._keys()))
+        ok_(sum(size for _, _, size, _ in cache.entries()) <= 2000)
+
+
+def cache_run_stats_test():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = Cache(cache_dir)
+        cache.store_url_in_cache(URL1, b'one')
+        Cache(cache_dir).fetch_url_from_cache(URL1)  # counts are shared by both Caches.
+        try:
+            cache.fetch_url_from_cache(URL2)
+        except NotInCacheError:
+            pass
+        cache.flush()
+
+        run_stats = manage_cache.cache_stats(cache_dir)['last_runs']
+        eq_(1, len(run_stats))
+        run = list(run_stats.values())[0]
+        eq_((1, 1, 1, 0.5), (run['hits'], run['misses'], run['stores'], run['hit_ratio']))
+
+
+def cache_compact_test():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = Cache(cache_dir, backend='files')
+        cache.store_url_in_cache(URL1, b'old')
+        cache.store_url_in_cache(URL2, b'two')
+        cache.store_url_in_cache(URL1, b'one')
+        cache.remove_url_from_cache(URL2)
+        eq_((3, 1), cache.compact())
+        eq_([URL1], list(cache.urls()))
+        eq_(b'one', cache.fetch_url_from_cache(URL1))
+
+
+@parameterized([('files',), ('sqlite',)])
+def gc_prune_geocodes_test(backend):
+    with tempfile.TemporaryDirectory() as cache_dir:
+        used_url = geocode_url('Yonge St. and Bloor St. ontario toronto canada')
+        unused_url = geocode_url('Queen St. and Bay St. ontario toronto canada')
+        cache = Cache(cache_dir, backend=backend)
+        for url in (used_url, unused_url, URL2):
+            cache.store_url_in_cache(url, b'{}')
+        cache.flush()
+        search_terms = {canonical_search_term('bloor st. and yonge st. ontario toronto canada')}
+
+        eq_({'pruned_geocodes': 1},
+            manage_cache.gc(cache_dir, search_terms=search_terms, dry_run=True))
+        eq_(1, manage_cache.gc(cache_dir, search_terms=search_terms)['pruned_geocodes'])
+        cache = Cache(cache_dir)
+        ok_(cache.is_url_in_cache(used_url))
+        ok_(not cache.is_url_in_cache(unused_url))
+        ok_(cache.is_url_in_cache(URL2))
+
+
+class StandInServer(object):
+    """A local HTTP server which serves /page, /missing (404) and /busy (429 the first time).
+
+    /image serves IMAGE, and supports Range requests. /image-norange ignores them.
+    /image-truncated drops the connection halfway through the first response. /image-badrange
+    answers Range requests with the whole image, as a 206.
+    """
+    def __init__(self):
+        self.requests = collections.Counter()
+        self.ranges = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        lock = threading.Lock()
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                with lock:
+                    server.requests[self.path] += 1
+                    num_requests = server.requests[self.path]
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                time.sleep(0.02)
+                with lock:
+                    server.in_flight -= 1
+                if self.path.startswith('/image'):
+                    self.send_image(num_requests)
+                    return
+                if self.path.startswith('/missing'):
+                    self.send_response(404)
+                elif self.path.startswith('/busy') and num_requests == 1:
+                    self.send_response(429)
+                    self.send_header('Retry-After', '0')
+                else:
+                    self.send_response(200)
+                body = self.path.encode('utf8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def send_image(self, num_requests):
+                start = 0
+                if self.headers['Range'] and not self.path.startswith('/image-norange'):
+                    server.ranges.append(self.headers['Range'])
+                    if not self.path.startswith('/image-badrange'):
+                        start = int(self.headers['Range'][len('bytes='):-1])
+                    self.send_response(206)
+                    self.send_header('Content-Range',
+                                     f'bytes {start}-{len(IMAGE) - 1}/{len(IMAGE)}')
+                else:
+                    self.send_response(200)
+                self.send_header('Content-Length', str(len(IMAGE) - start))
+                self.end_headers()
+                if self.path.startswith('/image-truncated') and num_requests == 1:
+                    self.wfile.write(IMAGE[:len(IMAGE) // 2])
+                    self.close_connection = True
+                    return
+                self.wfile.write(IMAGE[start:])
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.host = '127.0.0.1:%d' % self._httpd.server_address[1]
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+
+    def url(self, path):
+        return f'http://{self.host}{path}'
+
+    def close(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+def concurrent_fetcher_test():
+    server = StandInServer()
+    try:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            urls = [server.url(f'/page?id={i}') for i in range(20)]
+            f = ConcurrentFetcher(cache_dir, per_host=3, rate=1000)
+            results = list(f.fetch_urls(urls))
+            eq_([(url, url[url.index('/page'):].encode('utf8'), None) for url in urls], results)
+            ok_(1 < server.max_in_flight <= 3)
+
+            # Everything is cached now.
+            f = ConcurrentFetcher(cache_dir, per_host=3, rate=1000)
+            eq_(results, list(f.fetch_urls(urls)))
+            eq_(20, sum(server.requests.values()))
+    finally:
+        server.close()
+
+
+def concurrent_fetcher_errors_test():
+    server = StandInServer()
+    try:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            f = ConcurrentFetcher(cache_dir, rate=1000)
+            url, contents, error = f.fetch_url(server.url('/missing'))
+            eq_((None, 404), (contents, error.response.status_code))
+            eq_(1, server.requests['/missing'])  # not retried.
+
+            eq_(b'/busy', f.fetch_url(server.url('/busy'))[1])
+            eq_(2, server.requests['/busy'])
+            ok_(f.rate(server.host) < 501)  # halved by the 429, then back up a little.
+            ok_(not f.is_url_in_cache(server.url('/missing')))
+    finally:
+        server.close()
+
+
+def adaptive_token_bucket_test():
+    bucket = AdaptiveTokenBucket(1.0, min_rate=0.5, max_rate=2.0, increase=0.5, slow_secs=1.0)
+    bucket.on_success(0.1)
+    eq_(1.5, bucket.rate)
+    bucket.on_success(0.1)
+    bucket.on_success(0.1)
+    eq_(2.0, bucket.rate)  # capped.
+    bucket.on_success(5.0)  # too slow.
+    eq_(1.0, bucket.rate)
+    bucket.on_throttle()  # within the cooldown of the last cut.
+    eq_(1.0, bucket.rate)
+
+
+@parameterized([('/image', ['bytes=1000-']), ('/image-norange', [])])
+def concurrent_fetcher_download_test(path, expected_ranges):
+    server = StandInServer()
+    try:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            f = ConcurrentFetcher(cache_dir, rate=1000)
+            image_path = os.path.join(cache_dir, 'image.jpg')
+            # Left over from an interrupted download.
+            open(image_path + '.part', 'wb').write(IMAGE[:1000])
+
+            eq_([(server.url(path), image_path, None)],
+                list(f.download_all([(server.url(path), image_path)])))
+            eq_(IMAGE, open(image_path, 'rb').read())
+            eq_(expected_ranges, server.ranges)
+            ok_(not os.path.exists(image_path + '.part'))
+            ok_(not f.is_url_in_cache(server.url(path)))
+
+            _, _, error = f.download(server.url('/missing'), image_path + '.2')
+            eq_(404, error.response.status_code)
+    finally:
+        server.close()
+
+
+def concurrent_fetcher_truncated_download_test():
+    # Like urllib3 1.x, let a body which is shorter than its Content-Length end quietly.
+    iter_content = requests.models.Response.iter_content
+
+    def iter_content_unchecked(self, *args, **kwargs):
+        try:
+            yield from iter_content(self, *args, **kwargs)
+        except requests.exceptions.ChunkedEncodingError:
+            return
+
+    requests.models.Response.iter_content = iter_content_unchecked
+    server = StandInServer()
+    try:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            image_path = os.path.join(cache_dir, 'image.jpg')
+            url = server.url('/image-truncated')
+            f = ConcurrentFetcher(cache_dir, rate=1000, retries=0)
+            _, _, error = f.download(url, image_path)
+            ok_(isinstance(error, requests.exceptions.RequestException))
+            # What arrived is kept for next time, but isn't mistaken for the whole image.
+            ok_(not os.path.exists(image_path))
+            offset = os.path.getsize(image_path + '.part')
+            ok_(0 < offset <= len(IMAGE) // 2)
+
+            eq_((url, image_path, None), f.download(url, image_path))
+            eq_(IMAGE, open(image_path, 'rb').read())
+            eq_([f'bytes={offset}-'], server.ranges)
+    finally:
+        server.close()
+        requests.models.Response.iter_content = iter_content
+
+
+def concurrent_fetcher_bad_range_download_test():
+    server = StandInServer()
+    try:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            image_path = os.path.join(cache_dir, 'image.jpg')
+            open(image_path + '.part', 'wb').write(IMAGE[:1000])
+            f = ConcurrentFetcher(cache_dir, rate=1000)
+            url = server.url('/image-badrange')
+            eq_((url, image_path, None), f.download(url, image_path))
+            eq_(IMAGE, open(image_path, 'rb').read())
+            eq_(2, server.requests['/image-badrange'])  # retried without a Range header.
+            eq_(['bytes=1000-'], server.ranges)
+    finally:
+        server.close()
+
+
+def concurrent_fetcher_download_from_cache_test():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        f = ConcurrentFetcher(cache_dir)
+        f._cache.store_url_in_cache(URL2, IMAGE)
+        image_path = os.path.join(cache_dir, 'image.jpg')
+        eq_((URL2, image_path, None), f.download(URL2, image_path))
+        eq_(IMAGE, open(image_path, 'rb').read())
+        ok_(not os.path.exists(image_path + '.part'))
@@ -1,9 +1,15 @@
+import argparse
 from io import StringIO
+import json
+import os
+import tempfile
 
+from nose.tools import eq_
 import sys
 
 sys.path.append('oldtoronto')
-from oldtoronto.generate_geojson import load_patch_csv # noqa
+from oldtoronto.generate_geojson import ( # noqa
+    generate_geojson, load_patch_csv, parse_source_spec)
 
 
 TEST_DATA = StringIO("""Timestamp,Photo Id,Location suggestion,Lat,Lng,Fixed
@@ -19,3 +25,67 @@ def test_load_patch_csv():
     assert patched['212373'] is None
     assert patched['144582'] == (10, 10)
     assert '462670' not in patched
+
+
+def write_source(d, source, records, geocodes, sizes):
+    """Write the input files for one source, returning its config."""
+    paths = {key: os.path.join(d, f'{source}.{key}') for key in ('ndjson', 'json', 'txt')}
+    with open(paths['ndjson'], 'w') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+    json.dump(geocodes, open(paths['json'], 'w'))
+    open(paths['txt'], 'w').write(
+        ''.join(f'images/{name} JPEG {w}x{h} {w}x{h}+0+0 8-bit sRGB 1B\n'
+                for name, (w, h) in sizes.items()))
+    return parse_source_spec(f'source={source},input={paths["ndjson"]},'
+                             f'geocode_results={paths["json"]},path_to_size={paths["txt"]}')
+
+
+def test_parse_source_spec():
+    eq_({
+        'source': 'tpl',
+        'input': 'a.ndjson',
+        'geocode_results': 'b.json',
+        'path_to_size': 'c.txt',
+        'parent_data': '',
+        'drop_unlocated': True
+    }, parse_source_spec('source=tpl,input=a.ndjson,geocode_results=b.json,path_to_size=c.txt,'
+                         'drop_unlocated'))
+    for spec in ('source=tpl,input=a.ndjson', 'source=x,input=a,geocode_results=b,path_to_size=c',
+                 'source=tpl,inptu=a,geocode_results=b,path_to_size=c'):
+        try:
+            parse_source_spec(spec)
+            assert False, spec
+        except argparse.ArgumentTypeError:
+            pass
+
+
+def test_generate_geojson_multiple_sources():
+    with tempfile.TemporaryDirectory() as d:
+        archives = write_source(d, 'toronto-archives', [
+            {'uniqueID': '1', 'title': 'Yonge St.', 'date': '1920',
+             'imageLink': 'https://gencat4.eloquent-systems.com:443/x/f1.jpg'},
+            {'uniqueID': '2', 'title': 'Bay St.', 'date': 'n.d.',
+             'imageLink': 'https://gencat4.eloquent-systems.com:443/x/f2.jpg'},
+            {'uniqueID': '3', 'title': 'No size', 'imageLink': 'https://x/f3.jpg'},
+        ], {'1': {'lat': 43.6, 'lng': -79.4}}, {'f1.jpg': (10, 20), 'f2.jpg': (30, 40)})
+        tpl = write_source(d, 'tpl', [
+            {'uniqueID': 'PICT1', 'title': 'King St.', 'url': 'https://tpl/1',
+             'imageLink': 'https://static.torontopubliclibrary.ca/da/images/MC/pict1.jpg'},
+        ], {'PICT1': {'lat': 43.7, 'lng': -79.3}}, {'pict1.jpg': (50, 60)})
+        patches = {'1': (43.5, -79.5)}
+
+        merged = os.path.join(d, 'images.geojson')
+        all_stats = generate_geojson([archives, tpl], patches, merged)
+        eq_([2, 1], [stats['features'] for stats in all_stats])
+        eq_(1, all_stats[0]['invalid'])
+
+        features = []
+        for i, config in enumerate([archives, tpl]):
+            output = os.path.join(d, f'{i}.geojson')
+            generate_geojson([config], patches, output)
+            features += json.load(open(output))['features']
+        eq_(json.dumps({'type': 'FeatureCollection', 'features': features}), open(merged).read())
+        eq_(['1', '2', 'PICT1'], [f['id'] for f in features])
+        eq_([-79.5, 43.5], features[0]['geometry']['coordinates'])
+        eq_(None, features[1]['geometry'])
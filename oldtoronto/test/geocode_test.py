@@ -6,11 +6,16 @@ sys.path.append('oldtoronto')
 
 from nose.tools import eq_, ok_ # noqa
 from parameterized import parameterized # noqa
-from oldtoronto import geocode # noqa
+from oldtoronto import geocode, geocode_checkpoint # noqa
+from oldtoronto.street_matcher import StreetMatcher # noqa
 
 
 class MapsClientMock(object):
+    def __init__(self):
+        self.search_terms = []
+
     def geocode(self, search_term):
+        self.search_terms.append(search_term)
         search_term_to_response = {
             'Davenport Road and Uxbridge Avenue ontario toronto canada': [{
                 'formatted_address': 'Uxbridge Ave & Davenport Rd, Toronto, ON M6N, Canada',
@@ -43,6 +48,13 @@ class MapsClientMock(object):
         return search_term_to_response.get(search_term, [])
 
 
+class FailingMapsClientMock(MapsClientMock):
+    """Raises for every request, like a client which is over its quota."""
+    def geocode(self, search_term):
+        self.search_terms.append(search_term)
+        raise Exception('OVER_QUERY_LIMIT')
+
+
 images = [
     {
         'title': 'Rear of 203 Church Street leaning wall',
@@ -117,6 +129,7 @@ pois = [
 toronto_street_re_str = geocode.build_is_a_toronto_street_regex_str(street_names)
 exact_address_regex = geocode.exact_address_regex(toronto_street_re_str)
 standalone_street_re = geocode.standalone_street_regex(toronto_street_re_str)
+street_matcher = StreetMatcher(street_names)
 
 
 @parameterized([
@@ -129,6 +142,7 @@ def test_standalone_street_regex(text, should_match):
     m = standalone_street_re.search(text)
     does_match = not not m
     eq_(does_match, should_match)
+    eq_(standalone_street_re.findall(text), street_matcher.findall(text))
 
 
 @parameterized([
@@ -208,7 +222,7 @@ def parse_direction_from_test(original, match):
 ])
 def parse_two_streets_test(original, result):
     method, search_term, _, expected_type = \
-        geocode.parse_two_streets(standalone_street_re, original)
+        geocode.parse_two_streets(street_matcher, original)
     eq_(method, 'google')
     eq_(search_term.split(' ontario')[0], result)
     eq_(geocode.INTERSECTION_TYPE, expected_type)
@@ -232,10 +246,12 @@ def parse_two_streets_test(original, result):
 ])
 def extract_exact_address_test(original, result):
     method, search_term, _, expected_type = \
-        geocode.parse_exact_address(exact_address_regex, original)
+        geocode.parse_exact_address(street_matcher, original)
     eq_(method, 'google')
     eq_(search_term.split(' ontario')[0], result)
     eq_(expected_type, geocode.ADDRESS_TYPE)
+    m = exact_address_regex.match(original.lower())
+    eq_((m.group(1), m.group(2)), street_matcher.match_exact_address(original.lower()))
 
 
 @parameterized([
@@ -333,7 +349,9 @@ def are_streets_same_test(street1, street2, result):
     (['King Street'], ['King Street']),
     (['King Street', 'Queen Street'], ['King Street', 'Queen Street']),
     (['King Street', 'King St'], ['King Street']),
-    (['King Street', 'King St. W.', 'King St.'], ['King Street', 'King St. W.'])
+    (['King Street', 'King St. W.', 'King St.'], ['King Street', 'King St. W.']),
+    (['King Street', 'Queen Street'] * 10 + ['Bay Street'],
+     ['King Street', 'Queen Street', 'Bay Street'])
 ])
 def unique_streets_test(streets, result):
     eq_(result, geocode.unique_streets(streets))
@@ -416,3 +434,260 @@ def geocode_pipeline_test():
         images_ndjson.name, street_names_file.name, pois_file.name,
         output_file.name, 1.0, None, maps_client, False)
     check_output_file(output_file)
+
+
+def geocode_pipeline_concurrent_test():
+    images_ndjson = create_images_ndjson(images)
+    street_names_file = create_street_names_file()
+    pois_file = create_pois_file()
+    serial_output_file = tempfile.NamedTemporaryFile()
+    concurrent_output_file = tempfile.NamedTemporaryFile()
+    maps_client = MapsClientMock()
+    geocode.main(
+        images_ndjson.name, street_names_file.name, pois_file.name,
+        serial_output_file.name, 1.0, None, maps_client, False)
+    geocode.main(
+        images_ndjson.name, street_names_file.name, pois_file.name,
+        concurrent_output_file.name, 1.0, None, maps_client, False, workers=4)
+    check_output_file(concurrent_output_file)
+    concurrent_output_file.seek(0)
+    eq_(serial_output_file.read(), concurrent_output_file.read())
+
+
+def geocode_pipeline_no_network_test():
+    images_ndjson = create_images_ndjson(images)
+    street_names_file = create_street_names_file()
+    pois_file = create_pois_file()
+    output_file = tempfile.NamedTemporaryFile()
+    geocode.main(
+        images_ndjson.name, street_names_file.name, pois_file.name,
+        output_file.name, 1.0, None, None, True)
+    output_file.seek(0)
+    as_json = json.load(output_file)
+    # Fake geocodes are accepted whatever type is expected.
+    search_term = 'Davenport Road and Uxbridge Avenue ontario toronto canada'
+    eq_(dict(geocode.fake_geocode(search_term),
+             original_title='Northwest corner Davenport Road and Uxbridge Avenue - '
+                            'Defective building',
+             technique=['parse_corner', 'Davenport Road', 'Uxbridge Avenue']),
+        as_json['100007'])
+    eq_(['street_address'], as_json['100001']['types'])
+
+
+@parameterized([
+    ('Yonge and Bloor ontario toronto canada', 'bloor and yonge ontario toronto canada'),
+    ('Bloor  and yonge ontario toronto canada', 'bloor and yonge ontario toronto canada'),
+    ('203 church street ontario toronto canada', '203 church street ontario toronto canada'),
+    ('A and B and C ontario toronto canada', 'a and b and c ontario toronto canada'),
+])
+def canonical_search_term_test(search_term, expected):
+    eq_(expected, geocode.canonical_search_term(search_term))
+
+
+def geocode_pipeline_dedupes_search_terms_test():
+    images_ndjson = create_images_ndjson(images + [
+        {
+            'title': 'Uxbridge Avenue and Davenport Road, looking west',
+            'uniqueID': '100008',
+        },
+        {
+            'title': 'Rear of 203 Church Street',
+            'uniqueID': '100009',
+        }
+    ])
+    street_names_file = create_street_names_file()
+    pois_file = create_pois_file()
+    output_file = tempfile.NamedTemporaryFile()
+    maps_client = MapsClientMock()
+    geocode.main(
+        images_ndjson.name, street_names_file.name, pois_file.name,
+        output_file.name, 1.0, None, maps_client, False)
+    check_output_file(output_file)
+    output_file.seek(0)
+    as_json = json.load(output_file)
+
+    eq_(sorted(maps_client.search_terms), [
+        '161 beatrice street ontario toronto canada',
+        '203 church street ontario toronto canada',
+        'Davenport Road and Uxbridge Avenue ontario toronto canada',
+    ])
+    eq_(as_json['100008']['lat'], 43.6701965)
+    eq_(as_json['100008']['technique'],
+        ['two streets', 'Uxbridge Avenue', 'Davenport Road'])
+    # The lookup is shared, but each row keeps its own search term.
+    eq_(as_json['100008']['search_term'],
+        'Uxbridge Avenue and Davenport Road ontario toronto canada')
+    eq_(as_json['100007']['search_term'],
+        'Davenport Road and Uxbridge Avenue ontario toronto canada')
+    eq_(as_json['100009']['lat'], 43.6558684)
+
+
+def geocode_pipeline_manifest_test():
+    street_names_file = create_street_names_file()
+    pois_file = create_pois_file()
+    output_file = tempfile.NamedTemporaryFile()
+    manifest_dir = tempfile.TemporaryDirectory()
+    manifest_file = manifest_dir.name + '/geocode.manifest'
+
+    def run(rows, maps_client, full=False):
+        images_ndjson = create_images_ndjson(rows)
+        geocode.main(
+            images_ndjson.name, street_names_file.name, pois_file.name,
+            output_file.name, 1.0, None, maps_client, False,
+            manifest_file=manifest_file, full=full)
+        output_file.seek(0)
+        return json.load(output_file)
+
+    maps_client = MapsClientMock()
+    first = run(images, maps_client)
+    check_output_file(output_file)
+    eq_(len(maps_client.search_terms), 3)
+
+    # A rerun with an unchanged input shouldn't call the geocoder at all.
+    maps_client = MapsClientMock()
+    eq_(first, run(images, maps_client))
+    eq_(maps_client.search_terms, [])
+
+    # Only the row whose title changed gets geocoded again.
+    changed = [dict(image) for image in images]
+    changed[1]['title'] = '161 Beatrice Street, rear'
+    maps_client = MapsClientMock()
+    second = run(changed, maps_client)
+    eq_(maps_client.search_terms, [])  # the search term didn't change.
+    eq_(second['100004']['original_title'], '161 Beatrice Street, rear')
+    eq_(second['100004']['lat'], first['100004']['lat'])
+
+    changed[1]['title'] = '203 Church Street'
+    maps_client = MapsClientMock()
+    third = run(changed, maps_client)
+    eq_(maps_client.search_terms, ['203 church street ontario toronto canada'])
+    eq_(third['100004']['original_title'], '203 Church Street')
+
+    maps_client = MapsClientMock()
+    run(images, maps_client, full=True)
+    eq_(len(maps_client.search_terms), 3)
+
+
+def geocode_pipeline_manifest_failed_lookups_test():
+    images_ndjson = create_images_ndjson(images)
+    street_names_file = create_street_names_file()
+    pois_file = create_pois_file()
+    output_file = tempfile.NamedTemporaryFile()
+    manifest_dir = tempfile.TemporaryDirectory()
+    manifest_file = manifest_dir.name + '/geocode.manifest'
+
+    def run(maps_client):
+        geocode.main(
+            images_ndjson.name, street_names_file.name, pois_file.name,
+            output_file.name, 1.0, None, maps_client, False, manifest_file=manifest_file)
+
+    maps_client = FailingMapsClientMock()
+    run(maps_client)
+    eq_(len(maps_client.search_terms), 3)
+    output_file.seek(0)
+    ok_('100001' not in json.load(output_file))
+
+    # The failed lookups mustn't be mistaken for search terms with no match.
+    maps_client = MapsClientMock()
+    run(maps_client)
+    eq_(len(maps_client.search_terms), 3)
+    check_output_file(output_file)
+
+    maps_client = MapsClientMock()
+    run(maps_client)
+    eq_(maps_client.search_terms, [])
+
+
+def parsing_source_test():
+    source = geocode.parsing_source()
+    ok_(source.startswith('def get_title(row):'))
+    for name in ('parse_corner', 'parse_place_name', 'get_search_term_from_title',
+                 'build_parsers'):
+        ok_(f'def {name}(' in source, name)
+    ok_('DIRECTION_FROM_RE = ' in source)
+    for name in ('call_geocoding_api', 'resolve_search_terms', 'main'):
+        ok_(f'def {name}(' not in source, name)
+
+
+def geocode_pipeline_checkpoint_resume_test():
+    images_ndjson = create_images_ndjson(images)
+    street_names_file = create_street_names_file()
+    pois_file = create_pois_file()
+    output_file = tempfile.NamedTemporaryFile()
+    checkpoint_file = tempfile.NamedTemporaryFile()
+
+    def run(maps_client, resume):
+        geocode.main(
+            images_ndjson.name, street_names_file.name, pois_file.name,
+            output_file.name, 1.0, None, maps_client, False,
+            checkpoint_file=checkpoint_file.name, resume=resume, fsync_every=1)
+
+    run(MapsClientMock(), False)
+    check_output_file(output_file)
+    checkpoint = geocode_checkpoint.read_checkpoint(checkpoint_file.name)
+    eq_(len(checkpoint), len(images))
+    ok_(checkpoint['100022'] is None)
+    output_file.seek(0)
+    eq_(json.load(output_file), geocode_checkpoint.compact(checkpoint))
+
+    # Simulate a crash partway through writing the fifth line.
+    lines = open(checkpoint_file.name).readlines()
+    with open(checkpoint_file.name, 'w') as f:
+        f.write(''.join(lines[:4]) + lines[4][:10])
+    maps_client = MapsClientMock()
+    run(maps_client, True)
+    check_output_file(output_file)
+    # Results which need the geocoder are written last, so two of them remain.
+    eq_(len(maps_client.search_terms), 2)
+    eq_(len(geocode_checkpoint.read_checkpoint(checkpoint_file.name)), len(images))
+
+
+def geocode_pipeline_checkpoint_resume_failed_lookups_test():
+    images_ndjson = create_images_ndjson(images)
+    street_names_file = create_street_names_file()
+    pois_file = create_pois_file()
+    output_file = tempfile.NamedTemporaryFile()
+    checkpoint_file = tempfile.NamedTemporaryFile()
+
+    def run(maps_client, resume):
+        geocode.main(
+            images_ndjson.name, street_names_file.name, pois_file.name,
+            output_file.name, 1.0, None, maps_client, False,
+            checkpoint_file=checkpoint_file.name, resume=resume, fsync_every=1)
+
+    run(FailingMapsClientMock(), False)
+    checkpoint = geocode_checkpoint.read_checkpoint(checkpoint_file.name)
+    # Only the rows which didn't need the geocoder are done, including one with no match.
+    eq_(sorted(checkpoint), ['100022', '100023', '100024'])
+    ok_(checkpoint['100022'] is None)
+
+    maps_client = MapsClientMock()
+    run(maps_client, True)
+    eq_(len(maps_client.search_terms), 3)
+    check_output_file(output_file)
+    eq_(len(geocode_checkpoint.read_checkpoint(checkpoint_file.name)), len(images))
+
+
+def geocode_pipeline_profile_parsers_test():
+    images_ndjson = create_images_ndjson(images)
+    street_names_file = create_street_names_file()
+    pois_file = create_pois_file()
+    output_file = tempfile.NamedTemporaryFile()
+    profile_file = tempfile.NamedTemporaryFile(suffix='.json')
+    geocode.main(
+        images_ndjson.name, street_names_file.name, pois_file.name,
+        output_file.name, 1.0, None, MapsClientMock(), False,
+        profile_file=profile_file.name, num_slowest=2)
+    check_output_file(output_file)
+
+    report = json.load(open(profile_file.name))
+    eq_([row['parser'] for row in report], [
+        'exact_address', 'corner', 'direction_from', 'two_streets', 'streets_joined_by_and',
+        'place_name'
+    ])
+    by_name = {row['parser']: row for row in report}
+    eq_((by_name['exact_address']['calls'], by_name['exact_address']['matches']), (6, 2))
+    eq_((by_name['corner']['calls'], by_name['corner']['matches']), (4, 1))
+    eq_((by_name['place_name']['calls'], by_name['place_name']['matches']), (3, 2))
+    eq_(len(by_name['place_name']['slowest']), 2)
+    ok_(by_name['place_name']['p99_secs'] <= by_name['place_name']['max_secs'])
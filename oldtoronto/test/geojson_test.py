@@ -0,0 +1,85 @@
+import json
+import os
+import sys
+import tempfile
+
+sys.path.append('oldtoronto')
+
+from nose.tools import eq_, raises # noqa
+from oldtoronto.utils import geojson # noqa
+from oldtoronto.utils.geojson import FeatureWriter, iter_features # noqa
+
+FEATURES = [
+    {
+        'id': str(i),
+        'type': 'Feature',
+        'geometry': {'type': 'Point', 'coordinates': [-79.38 + i / 1000, 43.65]} if i % 3
+        else None,
+        'properties': {'title': f'Yonge St. [{i}], "looking" north', 'date': None}
+    }
+    for i in range(50)
+]
+
+
+def read_all(path, chunk_size):
+    geojson.READ_CHUNK_SIZE = chunk_size
+    try:
+        return list(iter_features(path))
+    finally:
+        geojson.READ_CHUNK_SIZE = 1024 * 1024
+
+
+def feature_collection_test():
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, 'images.geojson')
+        for features in (FEATURES, []):
+            with FeatureWriter(path) as out:
+                for feature in features:
+                    out.write(feature)
+            eq_(json.dumps({'type': 'FeatureCollection', 'features': features}),
+                open(path).read())
+            for chunk_size in (7, 100, 1024 * 1024):
+                eq_(features, read_all(path, chunk_size))
+        eq_(['images.geojson'], os.listdir(d))
+
+
+def geojson_seq_test():
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, 'images.geojsonl')
+        with FeatureWriter(path) as out:
+            for feature in FEATURES:
+                out.write(feature)
+        eq_(len(FEATURES), len(open(path).readlines()))
+        eq_(FEATURES, list(iter_features(path)))
+
+
+def read_other_feature_collections_test():
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, 'images.geojson')
+        json.dump({'type': 'FeatureCollection', 'features': FEATURES}, open(path, 'w'), indent=2)
+        eq_(FEATURES, read_all(path, 100))
+        json.dump({'features': FEATURES, 'type': 'FeatureCollection'}, open(path, 'w'))
+        eq_(FEATURES, read_all(path, 100))
+
+
+@raises(ValueError)
+def truncated_feature_collection_test():
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, 'images.geojson')
+        contents = json.dumps({'type': 'FeatureCollection', 'features': FEATURES})
+        open(path, 'w').write(contents[:-100])
+        read_all(path, 100)
+
+
+def failed_write_test():
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, 'images.geojson')
+        open(path, 'w').write('old')
+        try:
+            with FeatureWriter(path) as out:
+                out.write(FEATURES[0])
+                raise KeyError('uniqueID')
+        except KeyError:
+            pass
+        eq_('old', open(path).read())
+        eq_(['images.geojson'], os.listdir(d))
@@ -0,0 +1,91 @@
+import os
+import struct
+import sys
+import tempfile
+import zlib
+
+sys.path.append('oldtoronto')
+
+from nose.tools import eq_, ok_, raises # noqa
+from oldtoronto.image_sizes import ( # noqa
+    ImageError, image_size, load_image_sizes, load_index, update_index, write_index)
+
+
+def make_jpeg(width, height):
+    """A JPEG with an APP0 segment, a progressive SOF and some (fake) scan data."""
+    app0 = b'\xff\xe0' + struct.pack('>H', 16) + b'JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00'
+    sof2 = b'\xff\xc2' + struct.pack('>HBHHB', 11, 8, height, width, 1) + b'\x01\x11\x00'
+    sos = b'\xff\xda' + struct.pack('>HB', 8, 1) + b'\x01\x00\x00\x3f\x00'
+    return b'\xff\xd8' + app0 + sof2 + sos + b'\x12\xff\x00\x34' * 100 + b'\xff\xd9'
+
+
+def make_png(width, height):
+    def chunk(chunk_type, data):
+        crc = zlib.crc32(chunk_type + data)
+        return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', crc)
+    ihdr = struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0)
+    idat = zlib.compress(b'\x00' * (width + 1) * height)
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', ihdr) + chunk(b'IDAT', idat) +
+            chunk(b'IEND', b''))
+
+
+def write(path, contents):
+    open(path, 'wb').write(contents)
+    return path
+
+
+def image_size_test():
+    with tempfile.TemporaryDirectory() as d:
+        eq_((1050, 715), image_size(write(os.path.join(d, 'a.jpg'), make_jpeg(1050, 715))))
+        eq_((64, 32), image_size(write(os.path.join(d, 'b.png'), make_png(64, 32))))
+
+
+def image_size_errors_test():
+    jpeg = make_jpeg(10, 20)
+    png = make_png(10, 20)
+    with tempfile.TemporaryDirectory() as d:
+        for name, contents in [('truncated.jpg', jpeg[:-50]),
+                               ('truncated_header.jpg', jpeg[:10]),
+                               ('truncated.png', png[:-20]),
+                               ('html.jpg', b'<html>Not found</html>'),
+                               ('empty.jpg', b'')]:
+            try:
+                image_size(write(os.path.join(d, name), contents))
+                ok_(False, f'Expected an ImageError for {name}')
+            except ImageError:
+                pass
+
+
+def update_index_test():
+    with tempfile.TemporaryDirectory() as d:
+        images_dir = os.path.join(d, 'images')
+        os.makedirs(images_dir)
+        write(os.path.join(images_dir, 'a.jpg'), make_jpeg(30, 40))
+        write(os.path.join(images_dir, 'bad.jpg'), make_jpeg(30, 40)[:-20])
+        write(os.path.join(images_dir, 'notes.txt'), b'not an image')
+        index_file = os.path.join(d, 'image-sizes.txt')
+
+        index, num_scanned = update_index(images_dir, {}, workers=2)
+        eq_(2, num_scanned)
+        write_index(index, index_file)
+        eq_(index, load_index(index_file))
+        eq_({'a.jpg': [30, 40]}, load_image_sizes(index_file))
+        eq_('truncated', index['bad.jpg'][4])
+
+        # Unchanged files aren't read again, even if they now look different.
+        path = os.path.join(images_dir, 'a.jpg')
+        stat = os.stat(path)
+        write(path, make_jpeg(50, 40))
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        write(os.path.join(images_dir, 'c.png'), make_png(5, 6))
+        index, num_scanned = update_index(images_dir, load_index(index_file))
+        eq_(1, num_scanned)
+        eq_((30, 40), index['a.jpg'][:2])
+        eq_((5, 6), index['c.png'][:2])
+
+
+def load_identify_output_test():
+    with tempfile.TemporaryDirectory() as d:
+        path = write(os.path.join(d, 'image-sizes.txt'), b'images/f0124_fl0001_id0001.jpg JPEG '
+                     b'1050x715 1050x715+0+0 8-bit sRGB 122804B 0.000u 0:00.009\n')
+        eq_({'f0124_fl0001_id0001.jpg': [1050, 715]}, load_image_sizes(path))
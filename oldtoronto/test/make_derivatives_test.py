@@ -0,0 +1,85 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append('oldtoronto')
+
+from nose.tools import eq_ # noqa
+from oldtoronto.make_derivatives import ( # noqa
+    Image, derivatives_for_args, make_derivatives, plan_derivatives, scaled_size, update_sizes)
+
+
+def touch(path, mtime_ns):
+    open(path, 'ab').close()
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def scaled_size_test():
+    eq_((400, 300), scaled_size((800, 600), 400))
+    eq_((300, 200), scaled_size((300, 200), 400))
+    eq_((800, 600), scaled_size((800, 600), None))
+    eq_((400, 1), scaled_size((4000, 1), 400))
+
+
+def plan_derivatives_test():
+    derivatives = derivatives_for_args(400, [800])
+    eq_(['images', 'thumbnails', 'w800'], [d.name for d in derivatives])
+    with tempfile.TemporaryDirectory() as d:
+        images_dir = os.path.join(d, 'images')
+        output_dir = os.path.join(d, 'derivatives')
+        os.makedirs(images_dir)
+        for name in ('images', 'thumbnails', 'w800'):
+            os.makedirs(os.path.join(output_dir, name))
+        touch(os.path.join(images_dir, 'a.jpg'), 2000)
+        touch(os.path.join(images_dir, 'b.png'), 2000)
+        touch(os.path.join(images_dir, 'c.jpg.part'), 2000)
+
+        # a.jpg has an up-to-date mirror and a stale thumbnail; b.png has nothing yet.
+        touch(os.path.join(output_dir, 'images', 'a.jpg'), 3000)
+        touch(os.path.join(output_dir, 'thumbnails', 'a.jpg'), 1000)
+        touch(os.path.join(output_dir, 'w800', 'a.jpg'), 2000)
+        eq_([
+            (os.path.join(images_dir, 'a.jpg'), [
+                (os.path.join(output_dir, 'thumbnails', 'a.jpg'), 400)
+            ]),
+            (os.path.join(images_dir, 'b.png'), [
+                (os.path.join(output_dir, 'images', 'b.jpg'), None),
+                (os.path.join(output_dir, 'thumbnails', 'b.jpg'), 400),
+                (os.path.join(output_dir, 'w800', 'b.jpg'), 800)
+            ])
+        ], plan_derivatives(images_dir, output_dir, derivatives))
+        eq_(2, len(plan_derivatives(images_dir, output_dir, derivatives, full=True)))
+
+
+def make_derivatives_test():
+    if Image is None:
+        raise unittest.SkipTest('Pillow is not installed')
+    derivatives = derivatives_for_args(100, [])
+    with tempfile.TemporaryDirectory() as d:
+        images_dir = os.path.join(d, 'images')
+        output_dir = os.path.join(d, 'derivatives')
+        os.makedirs(images_dir)
+        Image.new('RGB', (500, 250), 'red').save(os.path.join(images_dir, 'a.jpg'))
+        Image.new('RGBA', (50, 60)).save(os.path.join(images_dir, 'b.png'))
+        open(os.path.join(images_dir, 'c.jpg'), 'wb').write(b'<html>Not found</html>')
+
+        errors = make_derivatives(plan_derivatives(images_dir, output_dir, derivatives))
+        eq_([os.path.join(images_dir, 'c.jpg')], list(errors))
+        sizes = {}
+        for derivative in derivatives:
+            for line in open(update_sizes(output_dir, derivative)).readlines()[1:]:
+                name, width, height = line.split('\t')[:3]
+                sizes[derivative.name, name] = (int(width), int(height))
+        eq_({
+            ('images', 'a.jpg'): (500, 250),
+            ('images', 'b.jpg'): (50, 60),
+            ('thumbnails', 'a.jpg'): (100, 50),
+            ('thumbnails', 'b.jpg'): (50, 60),
+        }, sizes)
+        eq_(open(os.path.join(images_dir, 'a.jpg'), 'rb').read(),
+            open(os.path.join(output_dir, 'images', 'a.jpg'), 'rb').read())
+
+        # Only the failed image is tried again.
+        eq_([os.path.join(images_dir, 'c.jpg')],
+            [path for path, _ in plan_derivatives(images_dir, output_dir, derivatives)])
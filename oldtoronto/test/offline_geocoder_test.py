@@ -0,0 +1,131 @@
+import json
+import os
+import sys
+import tempfile
+import urllib.parse
+
+sys.path.append('oldtoronto')
+
+from nose.tools import eq_, ok_ # noqa
+from oldtoronto.fetcher import Cache, CacheSession # noqa
+from oldtoronto.offline_geocoder import CachedGeocoder, OfflineGeocoder # noqa
+
+
+def make_result(lat, lng, types):
+    return {
+        'formatted_address': 'somewhere',
+        'geometry': {'location': {'lat': lat, 'lng': lng}, 'location_type': 'ROOFTOP'},
+        'place_id': 'abc',
+        'types': types
+    }
+
+
+def store_response(cache, search_term, status, results):
+    url = ('https://maps.googleapis.com/maps/api/geocode/json?' +
+           urllib.parse.urlencode({'address': search_term, 'key': 'secret'}))
+    cache.store_url_in_cache(url, json.dumps({'status': status, 'results': results}).encode())
+
+
+def make_geocoder(cache_dir):
+    cache = Cache(cache_dir)
+    store_response(cache, 'Yonge St. and Bloor St. ontario toronto canada', 'OK',
+                   [make_result(43.67, -79.39, ['intersection'])])
+    store_response(cache, '10 king street ontario toronto canada', 'OK',
+                   [make_result(43.0, -79.0, ['street_address'])])
+    store_response(cache, '20 king street ontario toronto canada', 'OK',
+                   [make_result(44.0, -80.0, ['premise'])])
+    store_response(cache, 'Nowhere and Elsewhere ontario toronto canada', 'ZERO_RESULTS', [])
+    store_response(cache, 'Bay and Front ontario toronto canada', 'OVER_QUERY_LIMIT', [])
+    return OfflineGeocoder.from_cache(cache_dir)
+
+
+def offline_geocoder_lookup_test():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        geocoder = make_geocoder(cache_dir)
+
+    results = geocoder.geocode('bloor st.  and YONGE St. ontario toronto canada')
+    eq_(1, len(results))
+    eq_(43.67, results[0]['geometry']['location']['lat'])
+    eq_([], geocoder.geocode('Nowhere and Elsewhere ontario toronto canada'))
+    # Errors aren't cached answers.
+    eq_([], geocoder.geocode('Bay and Front ontario toronto canada'))
+    eq_(2, geocoder.num_hits)
+    eq_(1, geocoder.num_misses)
+
+
+def offline_geocoder_interpolation_test():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        geocoder = make_geocoder(cache_dir)
+
+    def location(search_term):
+        results = geocoder.geocode(search_term)
+        if not results:
+            return None
+        eq_('RANGE_INTERPOLATED', results[0]['geometry']['location_type'])
+        location = results[0]['geometry']['location']
+        return round(location['lat'], 6), round(location['lng'], 6)
+
+    eq_((43.5, -79.5), location('15 king street ontario toronto canada'))
+    eq_((43.1, -79.1), location('11 King Street ontario toronto canada'))
+    eq_((44.0, -80.0), location('100 king street ontario toronto canada'))
+    eq_((43.0, -79.0), location('2.5 king street ontario toronto canada'))
+    eq_(None, location('12 queen street ontario toronto canada'))
+    eq_(4, geocoder.num_interpolated)
+    eq_(1, geocoder.stats()['streets_with_addresses'])
+
+
+def cache_only_geocoder_test():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        make_geocoder(cache_dir)
+        geocoder = CachedGeocoder(cache_dir=cache_dir)
+
+        results = geocoder.geocode('Yonge St. and Bloor St. ontario toronto canada')
+        eq_(43.67, results[0]['geometry']['location']['lat'])
+        eq_([], geocoder.geocode('Nowhere and Elsewhere ontario toronto canada'))
+        # Search terms are looked up by their canonical form.
+        results = geocoder.geocode('Bloor St.  and yonge st. ontario toronto canada')
+        eq_(43.67, results[0]['geometry']['location']['lat'])
+        eq_(None, geocoder.geocode('Bay and Front ontario toronto canada'))
+        eq_(None, geocoder.geocode('15 king street ontario toronto canada'))
+        eq_(None, geocoder.geocode('Bay and Front ontario toronto canada'))
+
+        misses_file = os.path.join(cache_dir, 'misses.txt')
+        geocoder.write_misses(misses_file)
+        eq_(['15 king street ontario toronto canada',
+             'Bay and Front ontario toronto canada'],
+            open(misses_file).read().splitlines())
+        stats = geocoder.stats()
+        eq_(3, stats['cache']['lookups'])
+        eq_(3, stats['miss']['lookups'])
+
+
+class MapsClientMock(object):
+    def __init__(self, session=None):
+        self.search_terms = []
+        self.session = session
+
+    def geocode(self, address):
+        self.search_terms.append(address)
+        return [make_result(1.0, 2.0, ['intersection'])]
+
+
+def cached_geocoder_test():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        make_geocoder(cache_dir)
+        cache = Cache(cache_dir)
+        maps_client = MapsClientMock(CacheSession(cache))
+        geocoder = CachedGeocoder(maps_client, cache_dir=cache_dir)
+        ok_(geocoder._cache is cache)  # rather than a second index of the same directory.
+
+        for _ in range(2):
+            results = geocoder.geocode('Yonge St. and Bloor St. ontario toronto canada')
+            eq_(43.67, results[0]['geometry']['location']['lat'])
+            results = geocoder.geocode('Bay and Front ontario toronto canada')
+            eq_(1.0, results[0]['geometry']['location']['lat'])
+
+        # Only the cached error went to the client, and only once.
+        eq_(['Bay and Front ontario toronto canada'], maps_client.search_terms)
+        eq_(set(), geocoder.misses)
+        stats = geocoder.stats()
+        eq_({'cache': 3, 'client': 1},
+            {source: row['lookups'] for source, row in stats.items()})
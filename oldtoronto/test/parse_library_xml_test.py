@@ -0,0 +1,60 @@
+import json
+import os
+import sys
+import tempfile
+
+sys.path.append('oldtoronto')
+
+from nose.tools import eq_ # noqa
+from oldtoronto import parse_library_xml # noqa
+from oldtoronto.parse_library_xml import parse_library_results_xml, write_records # noqa
+
+
+def make_item(id_):
+    return f'''<item><title>Yonge St., looking north {id_}</title><link>https://x/{id_}</link>
+    <record><recordId>{id_}</recordId><attributes>
+      <attr name="p_dig_subject_topical">Streets</attr>
+      <attr name="p_dig_subject_topical">Yonge Street</attr>
+      <attr name="p_file_name">PICTURES-R-{id_}.JPG</attr>
+    </attributes></record></item>'''
+
+
+def make_page(ids):
+    items = ''.join(make_item(id_) for id_ in ids)
+    return (f'<?xml version="1.0" encoding="UTF-8"?>\n<rss version="2.0"><channel>'
+            f'<title>Results</title>{items}</channel></rss>').encode('utf8')
+
+
+def parse_library_results_xml_test():
+    parse_library_xml.XML_CHUNK_SIZE = 50  # make sure items span several chunks.
+    try:
+        records = parse_library_results_xml(make_page(['1', '2']).decode('utf8'))
+    finally:
+        parse_library_xml.XML_CHUNK_SIZE = 64 * 1024
+    eq_(['1', '2'], [r['uniqueID'] for r in records])
+    eq_('Yonge St., looking north 1', records[0]['title'])
+    eq_('Streets\nYonge Street', records[0]['subject'])
+    eq_('https://static.torontopubliclibrary.ca/da/images/MC/pictures-r-2.jpg',
+        records[1]['imageLink'])
+
+
+def write_records_test():
+    pages = [make_page(['1', '2']), make_page(['2', '3']), make_page(['4'])]
+    with tempfile.TemporaryDirectory() as d:
+        output = os.path.join(d, 'toronto-library.ndjson')
+
+        def ids():
+            return [json.loads(line)['uniqueID'] for line in open(output)]
+
+        eq_(3, write_records(enumerate(pages[:2]), output, workers=1))
+        eq_(['1', '2', '3'], ids())
+
+        # A rerun only appends the new records.
+        eq_(1, write_records(enumerate(pages), output, workers=2))
+        eq_(['1', '2', '3', '4'], ids())
+
+        # If the output was cut off, the dropped records are written again.
+        contents = open(output).read()
+        open(output, 'w').write(contents[:-20])
+        eq_(1, write_records(enumerate(pages), output, workers=1))
+        eq_(contents, open(output).read())
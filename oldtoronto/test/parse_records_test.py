@@ -0,0 +1,50 @@
+import sys
+
+sys.path.append('oldtoronto')
+
+from nose.tools import eq_ # noqa
+from oldtoronto.parse_records import parse_html, record_json # noqa
+from oldtoronto.utils.parallel import process_map # noqa
+
+PAGE = '''<html><head><script>var row = '<div class="row">';</script></head><body>
+<nav class="navbar"><ul><li><a href="/x">Search</a></li></ul></nav>
+<div class="container">
+<div class="row"><div class="col-md-3"><span id="displayLabel">Title</span></div>
+<div class="col-md-9"><span id="displayData">Yonge St. &amp; King St., looking north</span></div>
+</div>
+<div class="row"><div class="col-md-3"><span id="displayLabel">Forms part of</span></div>
+<div class="col-md-9"><span id="displayData"><a href="/permalink.html?key=KEY_123">Fonds 1244</a>
+<br><a href="/permalink.html?key=KEY_456">Series 372</a></span></div></div>
+<div class="row"><div class="col-md-12">No label here</div></div>
+<div class="row"><div class="col-md-3"><span id="displayLabel">Comments</span></div>
+<div class="col-md-9"><span id="displayData">Ignored</span></div></div>
+<a class="img-thumbnail" href="/images/1244_1.jpg"><img src="/thumbs/1244_1.jpg"></a>
+</div></body></html>
+'''
+
+
+def parse_html_test():
+    expected = {
+        'title': 'Yonge St. & King St., looking north',
+        'part_of': 'Fonds 1244\nSeries 372',
+        'part_of_links': [('123', 'Fonds 1244'), ('456', 'Series 372')],
+        'imageLink': 'https://gencat4.eloquent-systems.com:443/images/1244_1.jpg'
+    }
+    eq_(expected, parse_html(PAGE))
+    eq_(expected, parse_html(PAGE, fast=True))
+
+
+def _square(x):
+    return x * x
+
+
+def process_map_test():
+    eq_([x * x for x in range(200)], list(process_map(_square, range(200), workers=3,
+                                                      batch_size=7)))
+    eq_([], list(process_map(_square, [], workers=2)))
+    eq_([0, 1, 4], list(process_map(_square, iter(range(3)), workers=1)))
+
+
+def record_json_test():
+    page = PAGE.encode('utf8')
+    eq_(record_json('1', page), record_json('1', page, fast=True))
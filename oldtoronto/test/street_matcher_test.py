@@ -0,0 +1,57 @@
+import sys
+
+sys.path.append('oldtoronto')
+
+from nose.tools import eq_ # noqa
+from parameterized import parameterized # noqa
+from oldtoronto import geocode # noqa
+from oldtoronto.street_matcher import StreetMatcher # noqa
+
+streets = [
+    'King Street',
+    'King Street West',
+    'Queen St. E.',
+    'Yonge Street',
+    'yonge',
+    '',
+]
+
+matcher = StreetMatcher(streets)
+street_re_str = geocode.build_is_a_toronto_street_regex_str(streets)
+exact_address_re = geocode.exact_address_regex(street_re_str)
+standalone_street_re = geocode.standalone_street_regex(street_re_str)
+
+
+@parameterized([
+    ('12 king street west', ('12', 'king street west')),
+    ('12 king street westerly', ('12', 'king street west')),
+    ('12.5 yonge street', ('12.5', 'yonge street')),
+    ('3.55 yonge street', ('55', 'yonge street')),
+    ('28-30 king street', ('30', 'king street')),
+    ('717  1/2 queen st. e.', ('717', 'queen st. e.')),
+    ('717 1/2  queen st. e.', ('2', 'queen st. e.')),
+    ('12king street', None),
+    ('12 King Street', None),  # the caller lowercases titles.
+    ('1914, 12 spadina, 7 yonge', ('7', 'yonge')),
+    ('', None),
+])
+def match_exact_address_test(text, expected):
+    eq_(expected, matcher.match_exact_address(text))
+    m = exact_address_re.match(text)
+    eq_(expected, (m.group(1), m.group(2)) if m else None)
+
+
+@parameterized([
+    ('King Street West looking east', ['King Street West']),
+    ('King Street Westerly', ['King Street']),
+    ('KING STREET and yonge street', ['KING STREET', 'yonge street']),
+    ('Yonge/King Street', ['Yonge']),
+    ('Yonge, King Street', ['Yonge', 'King Street']),
+    ('Yongestreet', []),
+    ('(Queen St. E.)', ['Queen St. E.']),
+    ('Kıng Street', ['Kıng Street']),
+    ('', []),
+])
+def findall_test(text, expected):
+    eq_(expected, matcher.findall(text))
+    eq_(expected, standalone_street_re.findall(text))
@@ -0,0 +1,79 @@
+import sys
+
+sys.path.append('oldtoronto')
+
+from nose.tools import eq_ # noqa
+from parameterized import parameterized # noqa
+from oldtoronto import geocode # noqa
+from oldtoronto import title_matchers # noqa
+
+
+def regex_groups(regex, title):
+    m = regex.match(title)
+    return m.groups()[:2] if m else None
+
+
+@parameterized([
+    ('Yonge and Bloor', ('Yonge', 'Bloor')),
+    ('Photo of Queen St., and Spadina Ave.', ('Queen St.', 'Spadina Ave.')),
+    ('King & Bay looking north', ('King', 'Bay ')),
+    ('ABC DEF and ghi', None),
+    ('Yonge\nand Bloor', ('Yonge', 'Bloor')),
+    ('photo\nof Yonge and Bloor', None),  # .*? doesn't match newlines.
+])
+def match_joined_by_and_test(title, expected):
+    eq_(expected, title_matchers.match_joined_by_and(title))
+    eq_(expected, regex_groups(geocode.JOINED_BY_AND_RE, title))
+
+
+@parameterized([
+    ('Yonge St., looking north from Bloor St.', ('Yonge St.', 'Bloor St.')),
+    ('Bay St. [?] : looking east across the Harbour', ('Bay St.', 'Harbour')),
+    ('Front St. looking west to 100 Queen', ('Front St.', 'Queen')),
+    ('Front St. west of', None),
+])
+def match_direction_from_test(title, expected):
+    eq_(expected, title_matchers.match_direction_from(title))
+    eq_(expected, regex_groups(geocode.DIRECTION_FROM_RE, title))
+
+
+@parameterized([
+    ('Northeast corner of Yonge and Bloor', ('Yonge', 'Bloor')),
+    ('Photo, s. w. corner the Bay and Front St.', ('Bay', 'Front St.')),
+    ('NE corner of Yonge and', None),
+])
+def match_corner_of_x_and_y_test(title, expected):
+    eq_(expected, title_matchers.match_corner_of_x_and_y(title))
+    eq_(expected, regex_groups(geocode.PARSE_CORNER_OF_X_AND_Y_RE, title))
+
+
+@parameterized([
+    ('Spadina, at Yonge, southeast corner', ('Spadina', 'Yonge')),
+    ('Spadina at Yonge St. NW corner', ('Spadina', 'Yonge St. ')),
+    ('Spadina at Yonge', None),
+])
+def match_x_at_y_corner_test(title, expected):
+    eq_(expected, title_matchers.match_x_at_y_corner(title))
+    eq_(expected, regex_groups(geocode.X_AT_Y_RE, title))
+
+
+@parameterized([
+    ('Corner of Yonge and the Gardiner Expressway', ('Yonge', 'Gardiner Expressway')),
+    ('House at corner of Bay St., and Front St.', ('Bay St.', 'Front St.')),
+    ('Corner of Yonge and the', None),
+])
+def match_corner_of_test(title, expected):
+    eq_(expected, title_matchers.match_corner_of(title))
+    eq_(expected, regex_groups(geocode.CORNER_OF_X_AND_Y, title))
+
+
+@parameterized([
+    (title_matchers.match_joined_by_and, 'A' * 10000 + '! and B'),
+    (title_matchers.match_direction_from, 'A' * 10000 + '! looking north from B'),
+    (title_matchers.match_corner_of_x_and_y, 'Northeast corner of ' + 'A' * 10000 + ' and'),
+    (title_matchers.match_x_at_y_corner, 'A' * 10000 + ' at ' + 'A' * 10000 + ' corner'),
+    (title_matchers.match_corner_of, 'Corner of ' + 'A' * 10000 + ' and'),
+])
+def pathological_title_test(matcher, title):
+    # The regexes would backtrack exponentially on these.
+    eq_(None, matcher(title))
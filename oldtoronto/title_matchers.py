@@ -0,0 +1,364 @@
+"""Match the capitalized-phrase title patterns from geocode.py in linear time.
+
+Patterns like DIRECTION_FROM_RE combine a leading .*? with a repeated group of capitalized
+tokens:
+
+    (?:[A-Z][A-Za-z.']*\\s?)+
+
+A run of capital letters like "ABCD" can be split into tokens in exponentially many ways. When
+the rest of the pattern fails to match, Python's backtracking regex engine tries all of them, at
+every starting position, so a title with a long run of capitals effectively never finishes.
+
+The functions here return the same groups as the regular expressions: the leftmost match, with
+the longest phrase which lets the rest of the pattern match. Instead of backtracking, they rely
+on the fact that a phrase starting at an uppercase letter can end anywhere up to the end of its
+"run", i.e. the longest phrase starting there. The rest of each pattern is checked once per
+position, and tables built in a single pass over the title give the longest phrase for each
+start. Each match is O(len(title)).
+"""
+
+import re
+import string
+
+_PHRASE_CHARS = frozenset(string.ascii_letters + ".'")
+
+# Quick checks for connecting words which a title needs in order to match at all. These don't
+# contain repeated groups, so they can't backtrack.
+_AND_RE = re.compile(r'\s(?:and|&)\s[A-Z]')
+_DIRECTION_FROM_RE = re.compile(r'(?:east|west|north|south)\s(?:from|of|across|to)\s')
+
+
+def _is_upper(c):
+    return 'A' <= c <= 'Z'
+
+
+class _Title(object):
+    """Lookup tables for a single title.
+
+    run_end[i]: if title[i] is an uppercase letter, the end of the longest phrase starting there.
+    next_upper[i]: index of the first uppercase letter at or after i, or len(title).
+    next_newline[i]: index of the first newline at or after i, or len(title). The regexes' .*?
+        doesn't match newlines.
+    """
+    def __init__(self, text):
+        self.text = text
+        n = self.n = len(text)
+        self.run_end = [n] * (n + 1)
+        self.next_upper = [n] * (n + 1)
+        self.next_newline = [n] * (n + 1)
+        body_end = n  # end of the phrase characters starting at i, excluding a trailing space.
+        for i in range(n - 1, -1, -1):
+            c = text[i]
+            upper = _is_upper(c)
+            if not (c in _PHRASE_CHARS or (c.isspace() and self.is_upper(i + 1))):
+                body_end = i
+            if body_end < n and text[body_end].isspace():
+                self.run_end[i] = body_end + 1
+            else:
+                self.run_end[i] = body_end
+            self.next_upper[i] = i if upper else self.next_upper[i + 1]
+            self.next_newline[i] = i if c == '\n' else self.next_newline[i + 1]
+
+    def char(self, i):
+        return self.text[i] if i < self.n else ''
+
+    def is_upper(self, i):
+        return i < self.n and _is_upper(self.text[i])
+
+    def is_space(self, i):
+        return i < self.n and self.text[i].isspace()
+
+    def skip_comma(self, i):
+        """Position after an optional comma, i.e. after ",?"."""
+        return i + 1 if self.char(i) == ',' else i
+
+    def next_upper_on_line(self, i):
+        """Where ".*?" followed by a phrase can put the phrase, or None."""
+        j = self.next_upper[i]
+        return j if j < self.next_newline[i] else None
+
+    def longest_phrase(self, i):
+        """The end of the longest phrase starting at i, or None if there isn't one."""
+        return self.run_end[i] if self.is_upper(i) else None
+
+
+class _PhraseFinder(object):
+    """Finds phrases which are followed by the rest of a pattern.
+
+    follow(end) checks whether the rest of the pattern matches after a phrase which ends at end.
+    It returns None if it doesn't, or else a value describing the match, e.g. where the next
+    group starts.
+    """
+    def __init__(self, title, follow):
+        self.title = title
+        n = title.n
+        self.follows = [follow(end) for end in range(n + 1)]
+        # last_end[i]: the largest end <= i for which follow matches, or -1.
+        self.last_end = []
+        last = -1
+        for end, value in enumerate(self.follows):
+            if value is not None:
+                last = end
+            self.last_end.append(last)
+        # first_start[i]: the first start >= i of a phrase for which follow matches, or n.
+        self.first_start = [n] * (n + 1)
+        for i in range(n - 1, -1, -1):
+            end = self.longest_from(i)
+            self.first_start[i] = i if end is not None else self.first_start[i + 1]
+
+    def longest_from(self, start):
+        """The end of the longest matching phrase which starts at start, or None.
+
+        This is the equivalent of "(TOKENS)<rest of pattern>" at a fixed position.
+        """
+        run_end = self.title.longest_phrase(start)
+        if run_end is None:
+            return None
+        end = self.last_end[run_end]
+        return end if end > start else None
+
+    def find(self, start=0):
+        """The equivalent of ".*?(TOKENS)<rest of pattern>" starting at start.
+
+        Returns:
+            Either (phrase start, phrase end, follow(phrase end)) or None.
+        """
+        phrase_start = self.first_start[start]
+        if phrase_start >= self.title.next_newline[start]:
+            return None
+        end = self.longest_from(phrase_start)
+        return phrase_start, end, self.follows[end]
+
+
+def _intercardinal_end(title, i):
+    """Match INTERCARDINAL_RE, e.g. " northeast" or " s. w.", at i.
+
+    Returns:
+        Either the end of the match or None.
+    """
+    text = title.text
+    if text.startswith(('NE', 'NW', 'SW', 'SE'), i):
+        return i + 2
+    # N_START or S_START: "^N" at the very start, or whitespace followed by "n".
+    if i == 0 and title.char(0) in ('N', 'S'):
+        letter, rest = title.char(0).lower(), 1
+    elif title.is_space(i) and title.char(i + 1) in ('n', 's'):
+        letter, rest = title.char(i + 1), i + 2
+    else:
+        return None
+
+    if text.startswith('orth' if letter == 'n' else 'outh', rest):
+        j = rest + 4
+        if title.char(j) == '-':
+            j += 1
+        return j + 4 if text.startswith(('east', 'west'), j) else None
+    if title.char(rest) == '.':
+        j = rest + 1
+        if title.is_space(j):
+            j += 1
+        return j + 2 if text.startswith(('e.', 'w.'), j) else None
+    return None
+
+
+def _corner_end(title, i):
+    """Match INTERCARDINAL_RE followed by " corner" at i, returning the end or None."""
+    end = _intercardinal_end(title, i)
+    if end is None or not title.is_space(end) or not title.text.startswith('corner', end + 1):
+        return None
+    return end + 7
+
+
+def match_joined_by_and(text):
+    """Equivalent to JOINED_BY_AND_RE.match(text), e.g. "Yonge and Bloor".
+
+    Returns:
+        Either the two (unstripped) groups or None.
+    """
+    if not _AND_RE.search(text):
+        return None
+    title = _Title(text)
+
+    def follow(end):
+        i = title.skip_comma(end)
+        if not title.is_space(i):
+            return None
+        if text.startswith('and', i + 1) and title.is_space(i + 4):
+            start = i + 5
+        elif text.startswith('&', i + 1) and title.is_space(i + 2):
+            start = i + 3
+        else:
+            return None
+        return start if title.is_upper(start) else None
+
+    m = _PhraseFinder(title, follow).find()
+    if not m:
+        return None
+    start1, end1, start2 = m
+    return text[start1:end1], text[start2:title.run_end[start2]]
+
+
+def match_direction_from(text):
+    """Equivalent to DIRECTION_FROM_RE.match(text), e.g. "Yonge St., looking north from Bloor".
+
+    Returns:
+        Either the two (unstripped) groups or None.
+    """
+    if not _DIRECTION_FROM_RE.search(text):
+        return None
+    title = _Title(text)
+
+    def follow(end):
+        # The optional parts of the pattern are tried in the same order as the regex tries them.
+        i = title.skip_comma(end)
+        for cruft in (' [?]', ''):
+            if cruft and not (title.is_space(i) and text.startswith('[?]', i + 1)):
+                continue
+            j = i + len(cruft)
+            for colon in (' :', ''):
+                if colon and not (title.is_space(j) and title.char(j + 1) == ':'):
+                    continue
+                k = j + len(colon)
+                if not title.is_space(k):
+                    continue
+                for looking in ('looking ', ''):
+                    if looking and not (text.startswith('looking', k + 1) and
+                                        title.is_space(k + 8)):
+                        continue
+                    start = _direction_from_end(title, k + 1 + len(looking))
+                    if start is not None:
+                        start = title.next_upper_on_line(start)
+                    if start is not None:
+                        return start
+        return None
+
+    m = _PhraseFinder(title, follow).find()
+    if not m:
+        return None
+    start1, end1, start2 = m
+    return text[start1:end1], text[start2:title.run_end[start2]]
+
+
+def _direction_from_end(title, i):
+    """Match e.g. "north from " at i, returning the end or None."""
+    text = title.text
+    for direction in ('east', 'west', 'north', 'south'):
+        if text.startswith(direction, i):
+            j = i + len(direction)
+            break
+    else:
+        return None
+    if not title.is_space(j):
+        return None
+    for word in ('from', 'of', 'across', 'to'):
+        if text.startswith(word, j + 1):
+            k = j + 1 + len(word)
+            return k + 1 if title.is_space(k) else None
+    return None
+
+
+def match_corner_of_x_and_y(text):
+    """Equivalent to PARSE_CORNER_OF_X_AND_Y_RE.match(text), e.g. "northeast corner of A and B".
+
+    Returns:
+        Either the two (unstripped) groups or None.
+    """
+    if 'corner' not in text:
+        return None
+    title = _Title(text)
+
+    def follow(end):
+        if (title.is_space(end) and text.startswith('and', end + 1) and
+                title.is_space(end + 4) and title.is_upper(end + 5)):
+            return end + 5
+        return None
+
+    finder = None
+    for i in range(min(title.next_newline[0] + 1, title.n)):
+        corner_end = _corner_end(title, i)
+        if corner_end is None:
+            continue
+        if finder is None:
+            finder = _PhraseFinder(title, follow)
+        starts = [corner_end]
+        if title.is_space(corner_end) and text.startswith('of', corner_end + 1):
+            starts.insert(0, corner_end + 3)
+        for start in starts:
+            if not title.is_space(start):
+                continue
+            m = finder.find(start + 1)
+            if m:
+                start1, end1, start2 = m
+                return text[start1:end1], text[start2:title.run_end[start2]]
+    return None
+
+
+def match_x_at_y_corner(text):
+    """Equivalent to X_AT_Y_RE.match(text), e.g. "Spadina, at Yonge, southeast corner".
+
+    Returns:
+        Either the two (unstripped) groups or None.
+    """
+    if 'corner' not in text or 'at' not in text:
+        return None
+    title = _Title(text)
+    n = title.n
+
+    # first_corner[i]: the first position >= i at which "<intercardinal> corner" starts.
+    first_corner = [n + 1] * (n + 2)
+    for i in range(n - 1, -1, -1):
+        first_corner[i] = i if _corner_end(title, i) is not None else first_corner[i + 1]
+
+    def corner_follows(end):
+        # ".*?" can't cross a newline, but the corner's leading whitespace can be one.
+        return True if first_corner[end] <= title.next_newline[end] else None
+
+    second = _PhraseFinder(title, corner_follows)
+
+    def follow(end):
+        i = title.skip_comma(end)
+        if not (title.is_space(i) and text.startswith('at', i + 1) and title.is_space(i + 3)):
+            return None
+        end2 = second.longest_from(i + 4)
+        return (i + 4, end2) if end2 is not None else None
+
+    m = _PhraseFinder(title, follow).find()
+    if not m:
+        return None
+    start1, end1, (start2, end2) = m
+    return text[start1:end1], text[start2:end2]
+
+
+def match_corner_of(text):
+    """Equivalent to CORNER_OF_X_AND_Y.match(text), e.g. "Corner of A and the B".
+
+    Returns:
+        Either the two (unstripped) groups or None.
+    """
+    if 'orner' not in text:
+        return None
+    title = _Title(text)
+
+    def follow(end):
+        i = title.skip_comma(end)
+        if not (title.is_space(i) and text.startswith('and', i + 1) and title.is_space(i + 4)):
+            return None
+        start = i + 5
+        if text.startswith('the', start) and title.is_space(start + 3):
+            start += 4  # the Gardiner Expressway
+        return start if title.is_upper(start) else None
+
+    finder = None
+    for i in range(min(title.next_newline[0] + 1, title.n)):
+        if not (title.char(i) == 'c' or (i == 0 and title.char(i) == 'C')):
+            continue
+        if not (text.startswith('orner', i + 1) and title.is_space(i + 6) and
+                text.startswith('of', i + 7) and title.is_space(i + 9)):
+            continue
+        if finder is None:
+            finder = _PhraseFinder(title, follow)
+        start1 = i + 10
+        end1 = finder.longest_from(start1)
+        if end1 is not None:
+            start2 = finder.follows[end1]
+            return text[start1:end1], text[start2:title.run_end[start2]]
+    return None
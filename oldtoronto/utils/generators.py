@@ -1,5 +1,16 @@
+import itertools
 import json
 
 
 def read_ndjson_file(input_file):
     return (json.loads(line) for line in open(input_file))
+
+
+def batches(items, batch_size):
+    """Split an iterable into lists of batch_size items (the last one may be shorter)."""
+    it = iter(items)
+    while True:
+        batch = list(itertools.islice(it, batch_size))
+        if not batch:
+            return
+        yield batch
@@ -0,0 +1,120 @@
+"""Read and write GeoJSON one feature at a time.
+
+Files ending in .geojsonl, .geojsons or .ndjson are GeoJSONSeq: one feature per line, with no
+surrounding FeatureCollection. Anything else is a regular FeatureCollection.
+"""
+
+import json
+import os
+import re
+
+SEQ_EXTENSIONS = {'.geojsonl', '.geojsons', '.ndjson'}
+
+# Characters of a FeatureCollection to read at a time.
+READ_CHUNK_SIZE = 1024 * 1024
+
+# How json.dump starts a {'type': 'FeatureCollection', 'features': [...]} dict, give or take
+# whitespace. Files which start any other way are read with json.load.
+FEATURE_COLLECTION_START = re.compile(
+    r'\s*\{\s*"type"\s*:\s*"FeatureCollection"\s*,\s*"features"\s*:\s*\[')
+WHITESPACE = re.compile(r'[\s,]*')
+
+
+def is_geojson_seq(path):
+    return os.path.splitext(path)[1].lower() in SEQ_EXTENSIONS
+
+
+class FeatureWriter(object):
+    """Write features to a FeatureCollection or GeoJSONSeq file as they're produced.
+
+    The output is written to a temporary file, which replaces path when the writer is closed,
+    so path never holds a partial file. A FeatureCollection comes out exactly as it would from
+    json.dump({'type': 'FeatureCollection', 'features': features}, f).
+
+    Use it as a context manager:
+
+        with FeatureWriter('images.geojson') as out:
+            for feature in features:
+                out.write(feature)
+    """
+    def __init__(self, path, seq=None):
+        self.path = path
+        self.seq = is_geojson_seq(path) if seq is None else seq
+        self.num_features = 0
+        self._tmp_path = path + '.tmp'
+        self._out = open(self._tmp_path, 'w')
+        if not self.seq:
+            self._out.write('{"type": "FeatureCollection", "features": [')
+
+    def write(self, feature):
+        self.write_json(json.dumps(feature))
+
+    def write_json(self, feature_json):
+        """Write a feature which has already been serialized with json.dumps."""
+        if self.seq:
+            self._out.write(feature_json)
+            self._out.write('\n')
+        else:
+            if self.num_features:
+                self._out.write(', ')
+            self._out.write(feature_json)
+        self.num_features += 1
+
+    def close(self):
+        if not self.seq:
+            self._out.write(']}')
+        self._out.close()
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        self._out.close()
+        os.remove(self._tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type:
+            self.abort()
+        else:
+            self.close()
+
+
+def _iter_collection_features(f, decoder):
+    """Decode the features of a FeatureCollection file one at a time."""
+    buf = f.read(READ_CHUNK_SIZE)
+    m = FEATURE_COLLECTION_START.match(buf)
+    if not m:
+        f.seek(0)
+        fc = json.load(f)
+        assert fc['type'] == 'FeatureCollection'
+        yield from fc['features']
+        return
+
+    pos = m.end()
+    while True:
+        pos = WHITESPACE.match(buf, pos).end()
+        if pos < len(buf) and buf[pos] == ']':
+            return
+        try:
+            feature, pos = decoder.raw_decode(buf, pos)
+            yield feature
+        except json.JSONDecodeError:
+            # The next feature runs past what's been read so far.
+            more = f.read(READ_CHUNK_SIZE)
+            if not more:
+                raise
+            buf = buf[pos:] + more
+            pos = 0
+
+
+def iter_features(path):
+    """Yield the features in a FeatureCollection or GeoJSONSeq file, without loading it all."""
+    with open(path) as f:
+        if is_geojson_seq(path):
+            for line in f:
+                line = line.strip('\x1e \t\r\n')  # GeoJSONSeq may use RS separators.
+                if line:
+                    yield json.loads(line)
+        else:
+            yield from _iter_collection_features(f, json.JSONDecoder())
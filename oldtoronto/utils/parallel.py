@@ -0,0 +1,32 @@
+import collections
+import concurrent.futures
+import os
+
+from utils.generators import batches
+
+
+def _map_batch(fn, batch):
+    return [fn(item) for item in batch]
+
+
+def process_map(fn, items, workers=None, batch_size=64):
+    """Like map(fn, items), but spread across a pool of processes.
+
+    Results are yielded in the same order as items. Items are sent to the workers in batches
+    to keep the overhead of pickling them down, and only a couple of batches per worker are
+    read ahead, so items can be a long generator. fn must be a module-level function.
+
+    With workers=1, everything happens in this process.
+    """
+    workers = workers or os.cpu_count()
+    if workers == 1:
+        yield from map(fn, items)
+        return
+    pending = collections.deque()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        for batch in batches(items, batch_size):
+            pending.append(executor.submit(_map_batch, fn, batch))
+            while len(pending) > 2 * workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
@@ -0,0 +1,87 @@
+"""A token bucket which can be shared between threads to throttle requests."""
+
+import threading
+import time
+
+
+class TokenBucket(object):
+    """Allow `rate` acquisitions per second on average, with bursts of up to `capacity`."""
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, self.rate))
+        self._tokens = self.capacity
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._last_refill
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+        self._last_refill = now
+
+    def acquire(self):
+        """Block until a token is available, then consume it."""
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_s = (1 - self._tokens) / self.rate
+            time.sleep(wait_s)
+
+
+class AdaptiveTokenBucket(TokenBucket):
+    """A TokenBucket whose rate adapts to how well the server is coping, AIMD-style.
+
+    Each good response raises the rate by increase / rate, i.e. by about `increase` per second
+    (additive increase), up to max_rate. A throttled or failed request (e.g. a 429 or 5xx), or
+    a response which took longer than slow_secs, multiplies it by backoff (multiplicative
+    decrease), down to min_rate. Requests which were already in flight often fail together, so
+    the rate is cut at most once per cooldown_secs.
+    """
+    def __init__(self, rate, min_rate=None, max_rate=None, increase=0.1, backoff=0.5,
+                 slow_secs=None, cooldown_secs=1.0, capacity=1):
+        super(AdaptiveTokenBucket, self).__init__(rate, capacity)
+        self.min_rate = min_rate if min_rate is not None else min(self.rate, 0.1)
+        self.max_rate = max_rate if max_rate is not None else self.rate
+        self._increase = increase
+        self._backoff = backoff
+        self._slow_secs = slow_secs
+        self._cooldown_secs = cooldown_secs
+        self._last_decrease = float('-inf')
+        self._paused_until = float('-inf')
+
+    def _set_rate(self, rate):
+        self._refill()  # tokens accrued so far count at the old rate.
+        self.rate = min(self.max_rate, max(self.min_rate, rate))
+
+    def on_success(self, latency_secs):
+        """Record a good response, which took latency_secs."""
+        if self._slow_secs is not None and latency_secs > self._slow_secs:
+            self.on_throttle()
+            return
+        with self._lock:
+            self._set_rate(self.rate + self._increase / self.rate)
+
+    def on_throttle(self, retry_after_secs=None):
+        """Record a request which the server refused or failed, and back off.
+
+        If the server said when to retry, no tokens are handed out until then.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if retry_after_secs:
+                self._paused_until = max(self._paused_until, now + retry_after_secs)
+            if now - self._last_decrease >= self._cooldown_secs:
+                self._set_rate(self.rate * self._backoff)
+                self._last_decrease = now
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                wait_s = self._paused_until - time.monotonic()
+            if wait_s <= 0:
+                break
+            time.sleep(wait_s)
+        super(AdaptiveTokenBucket, self).acquire()
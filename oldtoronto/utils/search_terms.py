@@ -0,0 +1,17 @@
+"""Helpers for the Google search terms which geocode.py builds from titles."""
+
+# All Google search terms end with this, e.g. "Yonge and Bloor ontario toronto canada".
+SEARCH_TERM_SUFFIX = ' ontario toronto canada'
+
+
+def canonical_search_term(search_term):
+    """Normalize a search term so that equivalent searches share a key.
+
+    Case and whitespace are ignored, and "X and Y" is the same intersection as "Y and X".
+    """
+    term = ' '.join(search_term.lower().split())
+    if term.endswith(SEARCH_TERM_SUFFIX):
+        streets = term[:-len(SEARCH_TERM_SUFFIX)].split(' and ')
+        if len(streets) == 2:
+            term = ' and '.join(sorted(streets)) + SEARCH_TERM_SUFFIX
+    return term
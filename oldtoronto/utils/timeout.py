@@ -1,9 +1,12 @@
 import signal
+import time
 
 
 class timeout:
     """Run a code block with a timeout.
 
+    This relies on SIGALRM, so it only works on the main thread. Use Deadline elsewhere.
+
     See https://stackoverflow.com/a/22348885/388951
     """
     def __init__(self, seconds=1, error_message='Timeout'):
@@ -19,3 +22,20 @@ class timeout:
 
     def __exit__(self, _type, _value, _traceback):
         signal.alarm(0)
+
+
+class Deadline(object):
+    """A point in time by which a piece of work should be finished.
+
+    Unlike timeout, this can't interrupt anything. It is checked cooperatively, e.g. by passing
+    remaining() to Future.result(), which makes it safe to use from any thread.
+    """
+    def __init__(self, seconds):
+        self._expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        """Seconds left before the deadline, or 0 if it has passed."""
+        return max(0.0, self._expires_at - time.monotonic())
+
+    def expired(self):
+        return self.remaining() == 0.0